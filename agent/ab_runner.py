@@ -0,0 +1,303 @@
+# llm_relevance_agent/agent/ab_runner.py
+"""
+ab_runner.py
+
+A/B-прогон нескольких вариантов агента за один проход по датасету.
+
+Вариант (`Variant`) задаёт версию промта need_search, версию промта classify и построитель поискового
+запроса (`agent_nodes.SEARCH_QUERY_BUILDERS`: "full" — организация + запрос пользователя, "org" — только
+организация). Каждый вариант строки проходит скомпилированный граф агента (`build_relevance_graph`: фильтр поиска,
+спекулятивный поиск и время узлов работают так же, как в `RelevanceAgentEvaluator`), все варианты — одновременно.
+На время прогона раннер подключается к узлам как объект объединения вызовов (`agent_nodes.call_sharing`):
+
+1. need_search — одинаковые промты (например, need_search_v1 и need_search_v3 совпадают) отправляются один раз;
+2. поиск — одинаковые запросы к Tavily выполняются один раз;
+3. classify — одинаковые промты (та же версия и тот же результат поиска) отправляются один раз.
+
+Совпадающие вызовы объединяются и между строками (повторы входов), в том числе пока первый вызов ещё выполняется;
+вызов, завершившийся исключением или ответом "ERROR", не переиспользуется — следующее обращение повторяет его.
+В лог варианта, получившего чужой результат, пишется `{этап}_shared`, токены и поиск учитываются один раз.
+
+Результат — широкая таблица: для каждого варианта `{name}_response`, `{name}_pred`, `{name}_log`,
+плюс `consensus_pred` (голосование большинством) и `unanimous`; отчёт — accuracy вариантов,
+попарное совпадение, согласие/расхождение (`utils.compare.consensus_report`) и экономия вызовов.
+
+Запуск:
+    python -m agent.ab_runner --variants v1:v1 v3:v3 v3:v3:org --concurrency 8 --split val [--search_gate]
+"""
+
+import os
+import json
+import asyncio
+import logging
+import argparse
+from typing import NamedTuple
+from agent import agent_nodes
+from agent.agent_nodes import SEARCH_QUERY_BUILDERS
+from agent.agent_graph import build_relevance_graph
+from agent.prompt_loader import get_prompt_registry
+from agent.prompt_log import LOG_MODES
+from utils.config import RELEVANCE_COL, AGENT_LOG_MODE, SEARCH_GATE_ENABLED
+from utils.records import build_records
+from utils.metrics import responses_to_labels
+from utils.progress import tqdm
+from utils.compare import consensus_report, majority_vote
+from utils.telemetry import summarize_logs, format_summary
+
+logger = logging.getLogger(__name__)
+
+
+class Variant(NamedTuple):
+    """Вариант агента: версии промтов need_search и classify и построитель поискового запроса."""
+    name: str
+    need_search_version: str
+    classify_version: str
+    search_query: str = "full"
+
+
+def parse_variant(spec: str) -> Variant:
+    """
+    Разбирает описание варианта "need_search:classify[:search_query]" с необязательным именем "name=...".
+
+    Пример: "v3:v3", "v3:v1:org", "short=v3:v3:org".
+    """
+    name, _, body = spec.rpartition("=")
+    parts = body.split(":")
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Неверное описание варианта: {spec} (ожидается need_search:classify[:search_query])")
+    need_search_version, classify_version = parts[:2]
+    search_query = parts[2] if len(parts) == 3 else "full"
+    name = name or "_".join(parts if search_query != "full" else parts[:2])
+    return Variant(name, need_search_version, classify_version, search_query)
+
+
+class ABRunner:
+    """
+    Параметры:
+        variants (list[Variant | str]): Варианты (строки разбираются `parse_variant`).
+        use_cache (bool): Использовать кэш поиска.
+        max_concurrency (int): Число строк, обрабатываемых одновременно.
+        log_mode (str): "full" или "slim" (см. `agent.prompt_log`).
+        search_gate (bool): Локальный фильтр перед decide_need_search (по умолчанию SEARCH_GATE_ENABLED).
+        speculative_search (bool): Поиск параллельно с решением о его необходимости.
+    """
+
+    def __init__(self, variants, use_cache=True, max_concurrency=4, log_mode=AGENT_LOG_MODE,
+                 search_gate=SEARCH_GATE_ENABLED, speculative_search=False):
+        self.variants = [parse_variant(v) if isinstance(v, str) else v for v in variants]
+        if not self.variants:
+            raise ValueError("Не задано ни одного варианта")
+        names = [v.name for v in self.variants]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Имена вариантов должны быть уникальны: {', '.join(names)}")
+        registry = get_prompt_registry()
+        for v in self.variants:
+            registry.get("need_search", v.need_search_version)
+            registry.get("classify", v.classify_version)
+            if v.search_query not in SEARCH_QUERY_BUILDERS:
+                raise ValueError(f"Неизвестный построитель запроса: {v.search_query}. "
+                                 f"Допустимые: {', '.join(SEARCH_QUERY_BUILDERS)}")
+        if log_mode not in LOG_MODES:
+            raise ValueError(f"Неизвестный режим лога: {log_mode}. Допустимые: {', '.join(LOG_MODES)}")
+
+        try:
+            self.graph = build_relevance_graph(speculative_search=speculative_search, search_gate=search_gate)
+        except Exception as e:
+            logger.error(f"Ошибка при создании графа: {e}")
+            raise
+
+        self.use_cache = use_cache
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.log_mode = log_mode
+        self.calls = {}
+        self._memo = {}
+
+    def _state(self, record, variant: Variant):
+        return {
+            "query": record.query,
+            "org": {
+                "name": record.name,
+                "address": record.address,
+                "normalized_main_rubric_name_ru": record.rubric,
+                "reviews_summarized": record.reviews,
+                "search_info": "",
+            },
+            "use_cache": self.use_cache,
+            "prompt_version": variant.need_search_version,
+            "classify_version": variant.classify_version,
+            "search_query": variant.search_query,
+            "log": {},
+            "response": None,
+            "next_action": None,
+            "log_mode": self.log_mode,
+        }
+
+    async def shared(self, stage: str, key, make):
+        """
+        Выполняет `make()` один раз на ключ; повторные и одновременные обращения ждут тот же результат
+        (интерфейс `agent_nodes.call_sharing`). Неудачный вызов (исключение или ответ "ERROR") вытесняется
+        из памяти, и следующее обращение выполняет его заново.
+
+        Returns:
+            tuple: (результат, True — результат получен другим вызовом).
+        """
+        counts = self.calls.setdefault(stage, {"requested": 0, "executed": 0})
+        counts["requested"] += 1
+        memo_key = (stage, key)
+        task = self._memo.get(memo_key)
+        shared = task is not None
+        if not shared:
+            counts["executed"] += 1
+            task = self._memo[memo_key] = asyncio.ensure_future(make())
+        try:
+            result = await task
+        except BaseException:
+            self._evict(memo_key, task)
+            raise
+        if _failed(result):
+            self._evict(memo_key, task)
+        return result, shared
+
+    def _evict(self, memo_key, task):
+        if self._memo.get(memo_key) is task:
+            del self._memo[memo_key]
+
+    async def _ainvoke(self, state):
+        try:
+            return await self.graph.ainvoke(state)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке строки (A/B): {e}")
+            return {"response": "ERROR", "log": {**state["log"], "error": str(e)}}
+
+    async def _run_row(self, record, semaphore):
+        states = [self._state(record, variant) for variant in self.variants]
+        async with semaphore:
+            if not agent_nodes.get_llm():
+                logger.error("LLM не инициализирован")
+                return [("ERROR", state["log"]) for state in states]
+            finals = await asyncio.gather(*(self._ainvoke(state) for state in states))
+        return [(final.get("response") or "ERROR", final.get("log", {})) for final in finals]
+
+    async def arun(self, data_eval):
+        """
+        Асинхронный прогон всех вариантов. Returns: (широкая таблица, отчёт).
+        """
+        self.calls, self._memo = {}, {}
+        records = build_records(data_eval)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_row(record, progress):
+            result = await self._run_row(record, semaphore)
+            progress.update(1)
+            return result
+
+        token = agent_nodes.call_sharing.set(self)
+        try:
+            with tqdm(total=len(records), desc="A/B Evaluation") as progress:
+                rows = await asyncio.gather(*(run_row(record, progress) for record in records))
+        finally:
+            agent_nodes.call_sharing.reset(token)
+            self._memo = {}
+        return self._assemble(data_eval, rows)
+
+    def run(self, data_eval):
+        """Синхронная обёртка над `arun` (в Jupyter используйте `await runner.arun(...)`)."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.arun(data_eval))
+        raise RuntimeError("Обнаружен запущенный event loop (Jupyter): используйте `await runner.arun(...)`")
+
+    def _assemble(self, data_eval, rows):
+        wide = data_eval.copy()
+        pred_cols, all_logs = [], []
+        for i, variant in enumerate(self.variants):
+            responses = [row[i][0] for row in rows]
+            logs = [row[i][1] for row in rows]
+            wide[f"{variant.name}_response"] = responses
+            wide[f"{variant.name}_pred"] = responses_to_labels(responses)
+            wide[f"{variant.name}_log"] = logs
+            pred_cols.append(f"{variant.name}_pred")
+            all_logs.extend(logs)
+
+        votes, _, unanimous = majority_vote(wide[pred_cols].to_numpy(dtype=float))
+        wide["consensus_pred"] = votes
+        wide["unanimous"] = unanimous
+
+        report = consensus_report(wide, pred_cols)
+        report["variants_config"] = [variant._asdict() for variant in self.variants]
+        report["calls"] = self.calls
+        report["telemetry"] = summarize_logs(all_logs)
+        print_report(report)
+        return wide, report
+
+
+def _failed(result) -> bool:
+    """Ответ LLM "ERROR" (в том числе внутри кортежа оценки logprob) — результат, который не переиспользуется."""
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    return getattr(result, "text", result) == "ERROR"
+
+
+def print_report(report: dict):
+    print(f"A/B-прогон: {report['rows']} строк")
+    for col, stats in report["variants"].items():
+        print(f"  {col:<24} accuracy {stats['accuracy']:.4f} (валидных {stats['valid']})")
+    for pair, share in report["agreement"].items():
+        print(f"  совпадение {pair}: {share:.4f}")
+    print(f"  Голосование большинством: accuracy {report['majority']['accuracy']:.4f}")
+    print(f"  Единогласно: {report['unanimous']['share']*100:.1f}% строк, accuracy {report['unanimous']['accuracy']:.4f}")
+    print(f"  Расхождения: {report['disagreement']['share']*100:.1f}% строк")
+    for stage, counts in report["calls"].items():
+        saved = 1 - counts["executed"] / counts["requested"] if counts["requested"] else 0.0
+        print(f"  {stage}: выполнено {counts['executed']} из {counts['requested']} вызовов (сэкономлено {saved*100:.1f}%)")
+    print(format_summary(report["telemetry"]))
+
+
+def main(args):
+    from dotenv import load_dotenv
+    from utils.config import DATA_PATH, ENV_PATH, AGENT_RESULTS_DIR, setup_logging
+    from utils.data_loader import load_dataset
+
+    setup_logging()
+    load_dotenv(ENV_PATH)
+    _, val_data, test_data = load_dataset(DATA_PATH, drop_uncertain=True, val_frac=0.01)
+    data = val_data if args.split == "val" else test_data
+    if args.limit:
+        data = data.head(args.limit)
+
+    runner = ABRunner(
+        args.variants, use_cache=True, max_concurrency=args.concurrency, log_mode=args.log_mode,
+        search_gate=SEARCH_GATE_ENABLED if args.search_gate is None else args.search_gate,
+        speculative_search=args.speculative_search,
+    )
+    wide, report = runner.run(data)
+
+    os.makedirs(AGENT_RESULTS_DIR, exist_ok=True)
+    predictions_path = os.path.join(AGENT_RESULTS_DIR, f"ab_{args.split}_predictions.csv")
+    disagreements_path = os.path.join(AGENT_RESULTS_DIR, f"ab_{args.split}_disagreements.csv")
+    report_path = os.path.join(AGENT_RESULTS_DIR, f"ab_{args.split}_report.json")
+    wide.to_csv(predictions_path, index=False)
+    pred_cols = [f"{variant.name}_pred" for variant in runner.variants]
+    wide.loc[~wide["unanimous"], ["text", "name", RELEVANCE_COL, *pred_cols, "consensus_pred"]].to_csv(
+        disagreements_path, index=False,
+    )
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f" Результаты сохранены в:\n- {predictions_path}\n- {disagreements_path}\n- {report_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A/B-прогон нескольких вариантов агента за один проход.")
+    parser.add_argument("--variants", nargs="+", required=True,
+                        help="Варианты need_search:classify[:search_query], например v1:v1 v3:v3 v3:v3:org")
+    parser.add_argument("--split", type=str, choices=["val", "test"], default="val", help="Часть датасета")
+    parser.add_argument("--limit", type=int, default=None, help="Оценить только первые N строк")
+    parser.add_argument("--concurrency", type=int, default=4, help="Число строк, обрабатываемых одновременно")
+    parser.add_argument("--log_mode", type=str, choices=list(LOG_MODES), default=AGENT_LOG_MODE,
+                        help="slim — не хранить полные промты в логах вариантов")
+    parser.add_argument("--search_gate", action="store_true", default=None,
+                        help="Локальный фильтр перед decide_need_search (по умолчанию SEARCH_GATE_ENABLED)")
+    parser.add_argument("--speculative_search", action="store_true",
+                        help="Запускать поиск параллельно с решением о его необходимости")
+    main(parser.parse_args())
@@ -1,8 +1,20 @@
 # llm_relevance_agent/agent/agent_graph.py
 from typing import TypedDict, Dict, Any, Optional
-from langgraph.graph import StateGraph, END
-from agent.agent_nodes import decide_need_search_node, search_node, classify_node
+from utils.telemetry import instrument_node
+from agent.agent_nodes import (
+    decide_need_search_node, search_node, classify_node,
+    adecide_need_search_node, asearch_node, aclassify_node,
+    speculative_decide_need_search_node, aspeculative_decide_need_search_node,
+    gate_need_search_node, agate_need_search_node,
+)
  
+def _node(name, fn, afn):
+    """Узел графа с синхронной и асинхронной реализацией; время выполнения пишется в лог (`utils.telemetry`)."""
+    from langchain_core.runnables import RunnableLambda
+
+    return RunnableLambda(instrument_node(name, fn), afunc=instrument_node(name, afn))
+
+
 class AgentState(TypedDict):
     query: str
     org: Dict[str, Any]
@@ -10,9 +22,14 @@ class AgentState(TypedDict):
     response: Optional[str]
     use_cache: bool
     prompt_version: str
+    classify_version: Optional[str]  # версия промта classify, если отличается от prompt_version (A/B-прогон)
     next_action: Optional[str]  # Для условных переходов
+    log_mode: str  # "full" — полные промты в логе, "slim" — ссылки на шаблон (см. agent.prompt_log)
+    search_query: str  # построитель поискового запроса: "full" или "org" (см. agent_nodes.SEARCH_QUERY_BUILDERS)
+    search_budget: int  # бюджет токенов контекста поиска, 0 — без постобработки (см. agent.search_postprocess)
+    scoring: str  # "text" или "logprob" — вероятность релевантности по первому токену (см. baseline.logprob_scoring)
 
-def build_relevance_graph():
+def build_relevance_graph(speculative_search: bool = False, defer_classify: bool = False, search_gate: bool = False):
     """
     Строит и компилирует граф агента для оценки релевантности организации запросу.
 
@@ -22,34 +39,66 @@ def build_relevance_graph():
     - classify: классифицирует релевантность организации запросу на основе доступной информации.
 
     Управляющая логика:
-    - Старт в узле "decide_need_search".
+    - Старт в узле "decide_need_search" (или "gate_need_search" при `search_gate=True`).
     - Переход либо напрямую в "classify", либо сначала в "search", затем в "classify" — 
       в зависимости от значения поля `next_action` в состоянии.
 
+    Каждый узел имеет синхронную и асинхронную реализацию: `invoke`/`batch` используют
+    синхронные функции, `ainvoke`/`abatch` — асинхронные (с AsyncOpenAI-клиентом).
+    Время выполнения каждого узла пишется в `log["node_time"]` (см. `utils.telemetry`).
+
+    Параметры:
+        speculative_search (bool): Спекулятивный режим — поиск запускается одновременно с решением
+            decide_need_search (результат отбрасывается, если решение NO). Сокращает критический путь
+            строк с поиском примерно на один LLM-вызов ценой лишних поисков (пишутся в лог).
+        defer_classify (bool): Граф без узла classify — завершается после решения/поиска,
+            а классификацию выполняет вызывающий код пакетами (`classify_packed_states`).
+        search_gate (bool): Узел gate_need_search перед decide_need_search — очевидные решения о поиске
+            принимаются локально (`agent.search_gate`), LLM спрашивается только для неуверенных строк.
+
     Возвращает:
         Скомпилированный объект графа агента (`CompiledGraph`), готовый к запуску.
     """
+    # langgraph (~0.6 с) импортируется при сборке графа, а не при импорте модуля
+    from langgraph.graph import StateGraph, END
+
     # Передаем типизированное состояние
     builder = StateGraph(AgentState)
     
     # Добавляем узлы с правильными именами
-    builder.add_node("decide_need_search", decide_need_search_node)
-    builder.add_node("search", search_node)
-    builder.add_node("classify", classify_node)
+    if speculative_search:
+        decide_node = _node("decide_need_search", speculative_decide_need_search_node, aspeculative_decide_need_search_node)
+    else:
+        decide_node = _node("decide_need_search", decide_need_search_node, adecide_need_search_node)
+    builder.add_node("decide_need_search", decide_node)
+    builder.add_node("search", _node("search", search_node, asearch_node))
+    if not defer_classify:
+        builder.add_node("classify", _node("classify", classify_node, aclassify_node))
+    classify_target = END if defer_classify else "classify"
     
+    if search_gate:
+        builder.add_node("gate_need_search", _node("gate_need_search", gate_need_search_node, agate_need_search_node))
+
     #  точка входа
-    builder.set_entry_point("decide_need_search")
+    builder.set_entry_point("gate_need_search" if search_gate else "decide_need_search")
     
     # Условные переходы через функцию
     def route_decision(state: AgentState) -> str:
         return state.get("next_action", "classify")
     
+    if search_gate:
+        builder.add_conditional_edges(
+            "gate_need_search",
+            route_decision,
+            {"decide": "decide_need_search", "search": "search", "classify": classify_target}
+        )
     builder.add_conditional_edges(
         "decide_need_search", 
         route_decision,
-        {"search": "search", "classify": "classify"}
+        {"search": "search", "classify": classify_target}
     )
-    builder.add_edge("search", "classify")
-    builder.add_edge("classify", END)
+    builder.add_edge("search", classify_target)
+    if not defer_classify:
+        builder.add_edge("classify", END)
     
     return builder.compile()
\ No newline at end of file
@@ -11,23 +11,114 @@ agent_nodes.py
 - выполнения поиска (search_node)
 - классификации релевантности (classify_node)
 
-LLM используется через GPTInterface (обёртка над OpenAI API).
+У каждого узла есть асинхронный вариант (adecide_need_search_node, asearch_node, aclassify_node),
+который используется графом при запуске через ainvoke/abatch.
+
+Спекулятивный режим (speculative_decide_need_search_node): поиск запускается одновременно
+с LLM-решением о его необходимости; при ответе NO результат отбрасывается, а факт
+оплаченного впустую поиска записывается в лог.
+
+Локальный фильтр (gate_need_search_node): очевидные решения о поиске принимаются правилами
+и лёгкой моделью без LLM (см. `agent.search_gate`), в decide_need_search попадают только неуверенные строки.
+
+Пакетная классификация (classify_packed_states): несколько строк оцениваются одним запросом к LLM;
+используется оценщиком при `pack_size > 1` вместо узла classify.
+
+Постобработка поиска (`state["search_budget"]` > 0): выдача очищается от почти-дубликатов и сокращается
+до бюджета токенов по предложениям, наиболее близким к запросу и организации (см. `agent.search_postprocess`).
+
+Режим оценки по logprobs (`state["scoring"] == "logprob"`): classify запрашивает один токен ответа
+и пишет в лог калиброванную вероятность релевантности и логит (см. `baseline.logprob_scoring`).
+
+Объединение вызовов (`call_sharing`): при заданном объекте объединения асинхронные узлы отправляют одинаковые
+промты и поисковые запросы параллельных состояний один раз (A/B-прогон вариантов, `agent.ab_runner`);
+в лог состояния, получившего чужой результат, пишется `{этап}_shared`.
+
+Версия промта classify может отличаться от версии need_search (`state["classify_version"]`).
+
+LLM используется через GPTInterface (обёртка над OpenAI API); клиент создаётся при первом обращении (`get_llm`).
 """
 
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
 from baseline.llm_interface import GPTInterface
-from agent.search_tools import search_info
-from agent.prompt_loader import load_prompt
+from baseline.packed_prompts import classify_packed, aclassify_packed, strip_answer_tail
+from baseline.prompt_templates import PROMPT_SPLIT_MARKER
+from baseline.logprob_scoring import score_prompt, ascore_prompt
+from agent.search_tools import search_info_meta, get_cached_results, search_remote
+from utils.config import SEARCH_POOL_SIZE, SEARCH_TOKEN_BUDGET
+from agent.prompt_loader import render_prompt_parts
+from agent.prompt_log import log_prompt
+from agent.search_gate import get_search_gate
+from agent.search_postprocess import postprocess_search_results
+from utils.telemetry import record_llm_call, record_search
 import logging
 import re
 
 # Логгер для ошибок
 logger = logging.getLogger(__name__)
 
-try:
-    llm = GPTInterface()
-except Exception as e:
-    logger.error(f"Ошибка при создании GPTInterface: {e}")
-    llm = None
+# Общий клиент LLM создаётся при первом вызове узла (`get_llm`), а не при импорте модуля
+llm = None
+_llm_failed = False
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """
+    Общий `GPTInterface` узлов агента (создаётся один раз; подменённый `agent_nodes.llm` возвращается как есть).
+
+    Returns:
+        GPTInterface | None: None, если клиент не удалось создать (ошибка пишется в лог один раз).
+    """
+    global llm, _llm_failed
+    if llm is not None or _llm_failed:
+        return llm
+    with _llm_lock:
+        if llm is None and not _llm_failed:
+            try:
+                llm = GPTInterface()
+            except Exception as e:
+                logger.error(f"Ошибка при создании GPTInterface: {e}")
+                _llm_failed = True
+    return llm
+
+
+async def aclose_llm():
+    """
+    Закрывает соединения общего клиента LLM в текущем цикле событий.
+    Вызывается перед завершением цикла (`asyncio.run`), который использовал асинхронные узлы.
+    """
+    aclose = getattr(llm, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+# Объект объединения одинаковых вызовов асинхронных узлов: `async shared(stage, key, make)` -> (результат, True —
+# результат получен другим вызовом). Задаётся вызывающим кодом на время прогона; по умолчанию выключено.
+call_sharing = contextvars.ContextVar("call_sharing", default=None)
+
+
+async def _shared_call(stage: str, key, make):
+    """Выполняет корутину `make()` напрямую или через активный `call_sharing`. Returns: (результат, shared)."""
+    sharing = call_sharing.get()
+    if sharing is None:
+        return await make(), False
+    return await sharing.shared(stage, key, make)
+
+
+def _mark_shared(state, stage: str):
+    if "log" not in state:
+        state["log"] = {}
+    state["log"][f"{stage}_shared"] = True
+
+# Пул потоков для спекулятивных поисков (синхронный режим графа)
+_speculative_executor = ThreadPoolExecutor(max_workers=SEARCH_POOL_SIZE, thread_name_prefix="speculative_search")
+# Ссылки на фоновые asyncio-задачи отброшенных поисков, чтобы их не собрал GC до завершения
+_background_tasks = set()
 
 def fill_prompt(template: str, **kwargs) -> str:
     """
@@ -74,6 +165,19 @@ def build_search_query(org_name: str, rubric: str, address: str, user_query: str
     query_parts = [part.strip() for part in [first_name, rubric, address, user_query] if part and part.strip()]
     return " ".join(query_parts)
 
+def build_org_search_query(org_name: str, rubric: str, address: str, user_query: str) -> str:
+    """
+    Поисковый запрос только по организации (без запроса пользователя): одна и та же организация
+    получает один запрос для всех пользовательских запросов, поэтому результаты чаще берутся из кэша.
+    """
+    return build_search_query(org_name, rubric, address, "")
+
+# Построители поискового запроса: state["search_query"] -> функция (по умолчанию "full")
+SEARCH_QUERY_BUILDERS = {
+    "full": build_search_query,
+    "org": build_org_search_query,
+}
+
 def clean_search_results(raw_results: str) -> str:
     """
     Удаляет строки с 'Missing:' из текста поисковой выдачи.
@@ -90,6 +194,87 @@ def clean_search_results(raw_results: str) -> str:
     cleaned_lines = [line for line in lines if "Missing:" not in line]
     return "\n".join(cleaned_lines).strip()
 
+def _join_parts(parts) -> str:
+    prefix, suffix = parts
+    return f"{prefix}{suffix}" if prefix else suffix
+
+def _ask_llm(state, stage: str, parts) -> str:
+    """
+    Вызывает LLM со статическим префиксом и переменной частью промта (см. `GPTInterface.prefix_layout`).
+    """
+    prefix, suffix = parts
+    result = get_llm().complete(suffix, prefix=prefix)
+    record_llm_call(state, stage, result)
+    return result.text
+
+async def _aask_llm(state, stage: str, parts) -> str:
+    prefix, suffix = parts
+    result, shared = await _shared_call(stage, parts, lambda: get_llm().acomplete(suffix, prefix=prefix))
+    if shared:
+        _mark_shared(state, stage)
+    else:
+        record_llm_call(state, stage, result)
+    return result.text
+
+def _apply_score(state, prob, logit, result, shared=False):
+    if shared:
+        _mark_shared(state, "classification")
+    else:
+        record_llm_call(state, "classification", result)
+    if prob is not None:
+        state["log"]["classification_prob"] = round(prob, 4)
+        state["log"]["classification_logit"] = round(logit, 4)
+
+def _score_llm(state, parts) -> str:
+    """
+    Классификация в режиме logprob: ответ по вероятности первого токена, вероятность и логит — в лог.
+    """
+    prefix, suffix = parts
+    response, prob, logit, result = score_prompt(get_llm(), suffix, prefix=prefix)
+    _apply_score(state, prob, logit, result)
+    return response
+
+async def _ascore_llm(state, parts) -> str:
+    prefix, suffix = parts
+    (response, prob, logit, result), shared = await _shared_call(
+        "classification", ("logprob", *parts), lambda: ascore_prompt(get_llm(), suffix, prefix=prefix),
+    )
+    _apply_score(state, prob, logit, result, shared)
+    return response
+
+def _build_need_search_parts(state):
+    """
+    Формирует промт для решения о необходимости поиска.
+
+    Args:
+        state (dict): Состояние агента, включая `query`, `org`, `prompt_version`.
+
+    Returns:
+        tuple[str | None, str]: Статический префикс шаблона need_search и заполненная переменная часть.
+    """
+    org = state["org"]
+    return render_prompt_parts(
+        "need_search",
+        state.get("prompt_version", "v1"),
+        query=state["query"],
+        name=org.get("name"),
+        address=org.get("address"),
+        rubric=org.get("normalized_main_rubric_name_ru"),
+        reviews=org.get("reviews_summarized"),
+    )
+
+def _apply_need_search_decision(state, prompt: str, decision: str):
+    """
+    Записывает решение о поиске в лог и выставляет `next_action`.
+    """
+    if "log" not in state:
+        state["log"] = {}
+
+    state["log"]["need_search_decision"] = decision
+    log_prompt(state, "search_prompt", prompt)
+
+    state["next_action"] = "search" if "YES" in decision else "classify"
+
 def decide_need_search_node(state):
     """
     Узел агента: принимает решение, нужен ли дополнительный поиск.
@@ -100,42 +285,118 @@ def decide_need_search_node(state):
     Returns:
         dict: Обновлённое состояние с полем `next_action` ('search' или 'classify').
     """
-    if not llm:
+    if not get_llm():
         logger.error("LLM не инициализирован")
         state["next_action"] = "classify"
         return state
-    
-    org = state["org"]
-    query = state["query"]
-    version = state.get("prompt_version", "v1")
-    
+
     try:
-        prompt_template = load_prompt("need_search", version)
-        prompt = fill_prompt(
-            prompt_template,
-            query=query,
-            name=org.get("name"),
-            address=org.get("address"),
-            rubric=org.get("normalized_main_rubric_name_ru"),
-            reviews=org.get("reviews_summarized"),
-        )
-        
-        decision = llm.call_gpt(prompt).strip().upper()
-        
-        if "log" not in state:
-            state["log"] = {}
-        
-        state["log"]["need_search_decision"] = decision
-        state["log"]["search_prompt"] = prompt
-        
-        state["next_action"] = "search" if "YES" in decision else "classify"
-        
+        parts = _build_need_search_parts(state)
+        decision = _ask_llm(state, "need_search", parts).strip().upper()
+        _apply_need_search_decision(state, _join_parts(parts), decision)
+
     except Exception as e:
         logger.error(f"Ошибка в decide_need_search_node: {e}")
         state["next_action"] = "classify"
     
     return state
 
+async def adecide_need_search_node(state):
+    """
+    Асинхронная версия `decide_need_search_node`.
+    """
+    if not get_llm():
+        logger.error("LLM не инициализирован")
+        state["next_action"] = "classify"
+        return state
+
+    try:
+        parts = _build_need_search_parts(state)
+        decision = (await _aask_llm(state, "need_search", parts)).strip().upper()
+        _apply_need_search_decision(state, _join_parts(parts), decision)
+
+    except Exception as e:
+        logger.error(f"Ошибка в decide_need_search_node: {e}")
+        state["next_action"] = "classify"
+
+    return state
+
+def gate_need_search_node(state):
+    """
+    Узел агента: локальный фильтр перед decide_need_search (см. `agent.search_gate`).
+    Очевидные строки получают решение о поиске без LLM, неуверенные уходят в decide_need_search.
+
+    Returns:
+        dict: Состояние с `next_action` ('search', 'classify' или 'decide').
+    """
+    if "log" not in state:
+        state["log"] = {}
+    try:
+        gate = get_search_gate(state.get("prompt_version", "v1"))
+        decision, prob, source = gate.decide(state["query"], state["org"])
+    except Exception as e:
+        logger.error(f"Ошибка в gate_need_search_node: {e}")
+        decision, prob, source = None, None, None
+
+    state["log"]["need_search_gate"] = {
+        "decision": decision,
+        "prob": None if prob is None else round(prob, 4),
+        "source": source,
+    }
+    if decision is None:
+        state["next_action"] = "decide"
+        return state
+
+    state["log"]["need_search_decision"] = decision
+    state["next_action"] = "search" if decision == "YES" else "classify"
+    return state
+
+async def agate_need_search_node(state):
+    """
+    Асинхронная версия `gate_need_search_node` (фильтр локальный и быстрый, выполняется в цикле событий).
+    """
+    return gate_need_search_node(state)
+
+def _state_search_query(state) -> str:
+    """
+    Формирует поисковый запрос по данным организации из состояния (построитель — `state["search_query"]`).
+    """
+    org = state["org"]
+    builder = SEARCH_QUERY_BUILDERS[state.get("search_query") or "full"]
+    return builder(
+        org.get("name", ""),
+        org.get("normalized_main_rubric_name_ru", ""),
+        org.get("address", ""),
+        state["query"],
+    )
+
+def _apply_search_results(state, search_query: str, search_results: str):
+    """
+    Очищает результаты поиска и кладёт их в `org["search_info"]` и лог.
+    При бюджете токенов (`state["search_budget"]`, по умолчанию SEARCH_TOKEN_BUDGET) текст дополнительно
+    сокращается `agent.search_postprocess`, в лог пишется степень сжатия.
+    """
+    search_results_cleaned = clean_search_results(search_results)
+
+    if "log" not in state:
+        state["log"] = {}
+    budget = state.get("search_budget", SEARCH_TOKEN_BUDGET)
+    if budget:
+        context = postprocess_search_results(search_results_cleaned, state["query"], state["org"], budget=budget)
+        search_results_cleaned = context.text
+        state["log"].update(context.as_log())
+
+    state["org"]["search_info"] = search_results_cleaned
+    state["log"]["search_query"] = search_query
+    state["log"]["search_results"] = search_results_cleaned
+
+def _apply_search_error(state, error: Exception):
+    logger.error(f"Ошибка в search_node: {error}")
+    if "log" not in state:
+        state["log"] = {}
+    state["log"]["search_error"] = str(error)
+    state["org"]["search_info"] = ""
+
 def search_node(state):
     """
     Узел агента: выполняет поиск дополнительной информации об организации.
@@ -146,36 +407,87 @@ def search_node(state):
     Returns:
         dict: Обновлённое состояние с добавленным `search_info` и логами.
     """
-    org = state["org"]
-    query = state["query"]
     use_cache = state.get("use_cache", True)
-    
-    name = org.get("name", "")
-    rubric = org.get("normalized_main_rubric_name_ru", "")
-    address = org.get("address", "")
-    
-    search_query = build_search_query(name, rubric, address, query)
+    search_query = _state_search_query(state)
     
     try:
-        search_results = search_info(search_query, use_cache=use_cache)
-        search_results_cleaned = clean_search_results(search_results)
-        
-        state["org"]["search_info"] = search_results_cleaned
-        
-        if "log" not in state:
-            state["log"] = {}
-        state["log"]["search_query"] = search_query
-        state["log"]["search_results"] = search_results_cleaned
+        search_results, meta = search_info_meta(search_query, use_cache=use_cache)
+        record_search(state, meta)
+        _apply_search_results(state, search_query, search_results)
         
     except Exception as e:
-        logger.error(f"Ошибка в search_node: {e}")
-        if "log" not in state:
-            state["log"] = {}
-        state["log"]["search_error"] = str(e)
-        state["org"]["search_info"] = ""
+        _apply_search_error(state, e)
     
     return state
 
+async def asearch_node(state):
+    """
+    Асинхронная версия `search_node`: блокирующий поиск выполняется в отдельном потоке.
+    """
+    use_cache = state.get("use_cache", True)
+    search_query = _state_search_query(state)
+
+    try:
+        (search_results, meta), shared = await _shared_call(
+            "search", search_query, lambda: asyncio.to_thread(search_info_meta, search_query, use_cache=use_cache),
+        )
+        if shared:
+            _mark_shared(state, "search")
+        else:
+            record_search(state, meta)
+        _apply_search_results(state, search_query, search_results)
+
+    except Exception as e:
+        _apply_search_error(state, e)
+
+    return state
+
+def _build_classify_parts(state):
+    """
+    Формирует промт классификации релевантности.
+
+    Args:
+        state (dict): Состояние агента, включая `query`, `org`, `prompt_version`.
+
+    Returns:
+        tuple[str | None, str]: Статический префикс шаблона classify и заполненная переменная часть.
+    """
+    org = state["org"]
+    search_info = org.get("search_info", "")
+    reviews = org.get("reviews_summarized", "")
+    
+    if isinstance(search_info, str) and search_info.startswith("[ОШИБКА]"):
+        search_info = "" 
+    
+    return render_prompt_parts(
+        "classify",
+        state.get("classify_version") or state.get("prompt_version", "v1"),
+        query=state["query"],
+        name=org.get("name"),
+        address=org.get("address"),
+        rubric=org.get("normalized_main_rubric_name_ru"),
+        reviews=reviews,
+        search_info=search_info,
+    )
+
+def _apply_classification(state, prompt: str, response: str):
+    """
+    Записывает ответ классификации в состояние и лог.
+    """
+    if "log" not in state:
+        state["log"] = {}
+
+    log_prompt(state, "classification_prompt", prompt)
+    state["log"]["classification_response"] = response
+    state["response"] = response
+
+def _apply_classification_error(state, error: Exception):
+    logger.error(f"Ошибка в classify_node: {error}")
+    state["response"] = "ERROR"
+    if "log" not in state:
+        state["log"] = {}
+    state["log"]["classification_error"] = str(error)
+
 def classify_node(state):
     """
     Узел агента: классифицирует релевантность организации запросу.
@@ -186,47 +498,247 @@ def classify_node(state):
     Returns:
         dict: Обновлённое состояние с ответом (`response`) и логами.
     """
-    if not llm:
+    if not get_llm():
         logger.error("LLM не инициализирован")
         state["response"] = "ERROR"
         return state
     
-    org = state["org"]
-    query = state["query"]
-    version = state.get("prompt_version", "v1")
-    
     try:
-        prompt_template = load_prompt("classify", version)
-        search_info = org.get("search_info", "")
-        reviews = org.get("reviews_summarized", "")
-        
-        if isinstance(search_info, str) and search_info.startswith("[ОШИБКА]"):
-            search_info = "" 
-        
-        prompt = fill_prompt(
-            prompt_template,
-            query=query,
-            name=org.get("name"),
-            address=org.get("address"),
-            rubric=org.get("normalized_main_rubric_name_ru"),
-            reviews=reviews,
-            search_info=search_info,
-        )
-        
-        response = llm.call_gpt(prompt).strip()
-        
-        if "log" not in state:
-            state["log"] = {}
-        
-        state["log"]["classification_prompt"] = prompt
-        state["log"]["classification_response"] = response
-        state["response"] = response
+        parts = _build_classify_parts(state)
+        if state.get("scoring") == "logprob":
+            response = _score_llm(state, parts)
+        else:
+            response = _ask_llm(state, "classification", parts).strip()
+        _apply_classification(state, _join_parts(parts), response)
         
     except Exception as e:
-        logger.error(f"Ошибка в classify_node: {e}")
-        state["response"] = "ERROR"
-        if "log" not in state:
-            state["log"] = {}
-        state["log"]["classification_error"] = str(e)
+        _apply_classification_error(state, e)
     
     return state
+
+async def aclassify_node(state):
+    """
+    Асинхронная версия `classify_node`.
+    """
+    if not get_llm():
+        logger.error("LLM не инициализирован")
+        state["response"] = "ERROR"
+        return state
+
+    try:
+        parts = _build_classify_parts(state)
+        if state.get("scoring") == "logprob":
+            response = await _ascore_llm(state, parts)
+        else:
+            response = (await _aask_llm(state, "classification", parts)).strip()
+        _apply_classification(state, _join_parts(parts), response)
+
+    except Exception as e:
+        _apply_classification_error(state, e)
+
+    return state
+
+def _prepare_packed(states):
+    """
+    Строит промты classify для группы состояний.
+    Возвращает (parts, instructions, item_blocks); instructions = None, если упаковка невозможна
+    (разные версии промта или шаблон без PROMPT_SPLIT_MARKER — такие строки классифицируются по одной).
+    """
+    parts = [_build_classify_parts(state) for state in states]
+    instructions = {prefix for prefix, _ in parts}
+    if len(instructions) != 1 or None in instructions:
+        return parts, None, None
+    item_blocks = [strip_answer_tail(suffix.partition(PROMPT_SPLIT_MARKER)[2]) for _, suffix in parts]
+    return parts, instructions.pop(), item_blocks
+
+def _apply_packed_classification(states, parts, responses, fallbacks):
+    for state, prompt_parts, response, fallback in zip(states, parts, responses, fallbacks):
+        _apply_classification(state, _join_parts(prompt_parts), response.strip())
+        state["log"]["classification_packed"] = len(states)
+        state["log"]["classification_packed_fallback"] = fallback
+
+def classify_packed_states(states):
+    """
+    Пакетная классификация: строки группы оцениваются одним запросом к LLM
+    (см. `baseline.packed_prompts`), нераспознанные ответы — отдельными запросами.
+
+    Args:
+        states (list[dict]): Состояния агента после decide_need_search/search (граф с `defer_classify=True`).
+
+    Returns:
+        list[dict]: Те же состояния с `response` и логами (`classification_packed` — размер пакета,
+            `classification_packed_fallback` — ответ получен одиночным запросом).
+    """
+    if not get_llm():
+        logger.error("LLM не инициализирован")
+        for state in states:
+            state["response"] = "ERROR"
+        return states
+
+    try:
+        parts, instructions, item_blocks = _prepare_packed(states)
+        if instructions is None:
+            return [classify_node(state) for state in states]
+        responses, fallbacks = classify_packed(get_llm(), instructions, item_blocks, [suffix for _, suffix in parts])
+        _apply_packed_classification(states, parts, responses, fallbacks)
+
+    except Exception as e:
+        for state in states:
+            _apply_classification_error(state, e)
+
+    return states
+
+async def aclassify_packed_states(states):
+    """
+    Асинхронная версия `classify_packed_states`.
+    """
+    if not get_llm():
+        logger.error("LLM не инициализирован")
+        for state in states:
+            state["response"] = "ERROR"
+        return states
+
+    try:
+        parts, instructions, item_blocks = _prepare_packed(states)
+        if instructions is None:
+            return list(await asyncio.gather(*(aclassify_node(state) for state in states)))
+        responses, fallbacks = await aclassify_packed(get_llm(), instructions, item_blocks, [suffix for _, suffix in parts])
+        _apply_packed_classification(states, parts, responses, fallbacks)
+
+    except Exception as e:
+        for state in states:
+            _apply_classification_error(state, e)
+
+    return states
+
+def _apply_speculative_outcome(state, search_query: str, cache_hit: bool, started: float, search_results=None):
+    """
+    Применяет результат спекулятивного поиска (если решение YES) и записывает его стоимость в лог.
+
+    В логе:
+        speculative_search_cache_hit: результат был в кэше (поиск бесплатный);
+        speculative_search_wasted: решение NO, а поиск был оплачен (промах кэша) — потраченный впустую запрос;
+        speculative_search_time: время ожидания результата поиска после ответа LLM (с).
+    """
+    if "log" not in state:
+        state["log"] = {}
+    log = state["log"]
+    log["speculative_search"] = True
+    log["speculative_search_cache_hit"] = cache_hit
+
+    if state.get("next_action") == "search" and search_results is not None:
+        _apply_search_results(state, search_query, search_results)
+        log["speculative_search_wasted"] = False
+        log["speculative_search_time"] = round(time.perf_counter() - started, 4)
+        # Поиск уже выполнен — сразу к классификации
+        state["next_action"] = "classify"
+    else:
+        log["speculative_search_wasted"] = not cache_hit
+
+def _speculative_search(search_query: str, stats: dict) -> str:
+    """`search_remote` для спекулятивного поиска; в `stats` дописываются повторы и время запроса (`time`)."""
+    try:
+        return search_remote(search_query, stats=stats)
+    finally:
+        stats["time"] = time.perf_counter() - stats["started"]
+
+def _record_speculative_search(state, cached, stats: dict):
+    """
+    Записывает спекулятивный поиск в телеметрию (`record_search`), в том числе при решении NO,
+    когда результат отброшен, но запрос уже оплачен. `stats["started"]` есть только у вызова,
+    который сам запустил поиск (общий результат `call_sharing` не учитывается повторно).
+    """
+    if cached is not None:
+        record_search(state, {"cache_hit": True, "retries": 0, "time": 0.0})
+    elif "started" in stats:
+        # Незавершённый поиск учитывается со временем, прошедшим до отказа от результата
+        time_spent = stats.get("time", time.perf_counter() - stats["started"])
+        record_search(state, {"cache_hit": False, "retries": stats.get("retries", 0), "time": time_spent})
+
+def speculative_decide_need_search_node(state):
+    """
+    Узел агента (спекулятивный режим): решение о поиске и сам поиск выполняются параллельно.
+
+    Если результат поиска уже в кэше, он просто берётся из кэша. Иначе запрос к Tavily
+    запускается в фоновом потоке одновременно с LLM-вызовом need_search. При решении NO
+    результат не ждём и отбрасываем (он всё равно попадёт в кэш). Поиск записывается
+    в телеметрию (`record_search`) при любом решении.
+
+    Args:
+        state (dict): Состояние агента, включая `query`, `org`, `prompt_version`, `use_cache`.
+
+    Returns:
+        dict: Обновлённое состояние; при решении YES — уже с `search_info` и `next_action='classify'`.
+    """
+    if not get_llm():
+        logger.error("LLM не инициализирован")
+        state["next_action"] = "classify"
+        return state
+
+    search_query = _state_search_query(state)
+    cached = get_cached_results(search_query, state.get("use_cache", True))
+    stats = {"retries": 0}
+    future = None
+    if cached is None:
+        stats["started"] = time.perf_counter()
+        future = _speculative_executor.submit(_speculative_search, search_query, stats)
+
+    try:
+        parts = _build_need_search_parts(state)
+        decision = _ask_llm(state, "need_search", parts).strip().upper()
+        _apply_need_search_decision(state, _join_parts(parts), decision)
+
+        started = time.perf_counter()
+        search_results = cached
+        if state["next_action"] == "search" and future is not None:
+            search_results = future.result()
+        _apply_speculative_outcome(state, search_query, cached is not None, started, search_results)
+
+    except Exception as e:
+        logger.error(f"Ошибка в decide_need_search_node: {e}")
+        state["next_action"] = "classify"
+
+    _record_speculative_search(state, cached, stats)
+    return state
+
+async def aspeculative_decide_need_search_node(state):
+    """
+    Асинхронная версия `speculative_decide_need_search_node`.
+    """
+    if not get_llm():
+        logger.error("LLM не инициализирован")
+        state["next_action"] = "classify"
+        return state
+
+    search_query = _state_search_query(state)
+    cached = get_cached_results(search_query, state.get("use_cache", True))
+    stats = {"retries": 0}
+    task = None
+    if cached is None:
+        def make():
+            stats["started"] = time.perf_counter()
+            return asyncio.to_thread(_speculative_search, search_query, stats)
+
+        task = asyncio.create_task(_shared_call("speculative_search", search_query, make))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    try:
+        parts = _build_need_search_parts(state)
+        decision = (await _aask_llm(state, "need_search", parts)).strip().upper()
+        _apply_need_search_decision(state, _join_parts(parts), decision)
+
+        started = time.perf_counter()
+        search_results = cached
+        if state["next_action"] == "search" and task is not None:
+            search_results, shared = await task
+            if shared:
+                _mark_shared(state, "speculative_search")
+        _apply_speculative_outcome(state, search_query, cached is not None, started, search_results)
+
+    except Exception as e:
+        logger.error(f"Ошибка в decide_need_search_node: {e}")
+        state["next_action"] = "classify"
+
+    _record_speculative_search(state, cached, stats)
+    return state
@@ -1,12 +1,25 @@
 import os
 import time
-import pandas as pd
-try:
-    from tqdm.notebook import tqdm
-except ImportError:
-    from tqdm import tqdm
+import asyncio
+import numpy as np
 from agent.agent_graph import build_relevance_graph
-from utils.config import RELEVANCE_COL
+from agent.agent_nodes import classify_packed_states, aclassify_packed_states
+from agent.prompt_loader import get_prompt_registry
+from agent.prompt_log import LOG_MODES
+from agent.lexical_scorer import get_lexical_scorer
+from agent.search_postprocess import preload_tokenizer
+from baseline.logprob_scoring import SCORING_MODES
+from utils.config import (
+    RELEVANCE_COL, AGENT_LOG_MODE, SEARCH_GATE_ENABLED, CASCADE_ENABLED, DEDUP_ENABLED, LLM_SCORING,
+    SEARCH_TOKEN_BUDGET,
+)
+from utils.checkpoint import JsonlCheckpoint, pending_positions
+from utils.dedup import plan_dedup
+from utils.records import build_records, as_records
+from utils.metrics import responses_to_labels, accuracy
+from utils.progress import tqdm
+from utils.telemetry import add_node_time, summarize_logs, format_summary
+from agent import agent_nodes
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,6 +36,30 @@ RelevanceAgentEvaluator
     0.0 — нерелевантно (IRRELEVANT), 
     -1.0 — ошибка или неопознанный ответ.
 - Используется кеширование (`use_cache`) и указание версии промпта (`prompt_version`) для гибкости.
+- `speculative_search=True` запускает поиск одновременно с решением о его необходимости (см. `build_relevance_graph`).
+- При `max_concurrency > 1` строки обрабатываются конкурентно через `graph.ainvoke` (asyncio + AsyncOpenAI);
+  порядок предсказаний и логов совпадает с порядком строк. В Jupyter используйте `await arun_full_evaluation(...)`.
+- При `pack_size > 1` классификация выполняется пакетами: до `pack_size` строк в одном запросе к LLM
+  (общая инструкция промта отправляется один раз), нераспознанные ответы переспрашиваются по одной.
+  В синхронном режиме пакеты собираются внутри батча, поэтому `batch_size` должен быть не меньше `pack_size`.
+- `search_gate=True` ставит перед decide_need_search локальный фильтр (`agent.search_gate`):
+  очевидные решения о поиске принимаются без LLM.
+- `cascade=True` — каскад: локальный лексический оценщик (`agent.lexical_scorer`) сразу отвечает
+  на уверенные строки, агенту уходит только неуверенная середина; в лог пишутся `cascade_stage` и `lexical_prob`.
+- `dedup=True` (по умолчанию DEDUP_ENABLED, выключено) запускает граф один раз на группу строк с одинаковым
+  запросом и организацией (`utils.dedup`) в пределах одного прогона; результат копируется остальным строкам
+  группы, в их лог пишутся `dedup_reused=True` и `dedup_of` (ключ строки-представителя).
+- `scoring="logprob"` — классификация одним токеном с калиброванной вероятностью (`baseline.logprob_scoring`):
+  в результат добавляются `agent_prob_relevant` (для строк, решённых каскадом, — `lexical_prob`)
+  и `agent_relevance_logit`; пакетная классификация в этом режиме не используется (`pack_size=1`).
+- `search_budget=N` (по умолчанию SEARCH_TOKEN_BUDGET, 0 — выключено) сокращает выдачу поиска перед classify:
+  почти-дубликаты отбрасываются, остаются предложения, ближе всего к запросу и организации, в пределах N токенов
+  (`agent.search_postprocess`); степень сжатия пишется в лог и в сводку телеметрии. Токенизатор загружается
+  при создании оценщика.
+- `log_mode="slim"` хранит в `agent_log` вместо полных промтов ссылку на шаблон и хэш
+  (текст восстанавливается по требованию, см. `agent.prompt_log.expand_log` и `utils.inspector`).
+- `run_full_evaluation(..., checkpoint_path=...)` дописывает каждую завершённую строку (ответ, метка, лог)
+  в JSONL-файл и при повторном запуске пропускает уже оценённые строки (ключ — хэш permalink + text).
 
 Результаты включают предсказания агента, логгирование шагов внутри графа, метки релевантности и метрики качества.
 
@@ -34,15 +71,41 @@ RelevanceAgentEvaluator
 
 
 class RelevanceAgentEvaluator:
-    def __init__(self, use_cache=True, prompt_version="v1"):
+    def __init__(self, use_cache=True, prompt_version="v1", max_concurrency=1, speculative_search=False, pack_size=1,
+                 log_mode=AGENT_LOG_MODE, search_gate=SEARCH_GATE_ENABLED, cascade=CASCADE_ENABLED,
+                 dedup=DEDUP_ENABLED, scoring=LLM_SCORING, search_budget=SEARCH_TOKEN_BUDGET):
+        # Шаблоны промтов загружаются и проверяются один раз при старте
+        get_prompt_registry().validate(prompt_version)
+        if log_mode not in LOG_MODES:
+            raise ValueError(f"Неизвестный режим лога: {log_mode}. Допустимые: {', '.join(LOG_MODES)}")
+        if scoring not in SCORING_MODES:
+            raise ValueError(f"Неизвестный режим оценки: {scoring}. Допустимые: {', '.join(SCORING_MODES)}")
+        if scoring == "logprob" and pack_size > 1:
+            raise ValueError("Режим logprob классифицирует строки по одной: pack_size должен быть 1")
+        if search_budget < 0:
+            raise ValueError(f"Бюджет токенов поиска не может быть отрицательным: {search_budget}")
+
         try:
-            self.graph = build_relevance_graph()
+            self.graph = build_relevance_graph(
+                speculative_search=speculative_search, defer_classify=pack_size > 1, search_gate=search_gate,
+            )
         except Exception as e:
             logger.error(f"Ошибка при создании графа: {e}")
             raise
         
         self.use_cache = use_cache
         self.prompt_version = prompt_version
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.pack_size = max(1, int(pack_size))
+        self.log_mode = log_mode
+        self.scoring = scoring
+        self.search_budget = int(search_budget)
+        if self.search_budget:
+            preload_tokenizer()
+        # Первая ступень каскада: True — общий оценщик из LEXICAL_SCORER_PATH, либо готовый LexicalRelevanceScorer
+        self.cascade = get_lexical_scorer() if cascade is True else (cascade or None)
+        self.dedup = dedup
+        self.telemetry = None
     
     def map_response_to_label(self, response):
         """
@@ -58,78 +121,339 @@ class RelevanceAgentEvaluator:
         else:
             return -1.0
     
-    def evaluate_batch(self, batch):
+    def _build_inputs(self, record):
         """
-        Оценка батча данных
+        Начальное состояние графа для одной строки датасета (`EvalRecord`)
         """
-        results = []
-        logs = []
+        org = {
+            "name": record.name,
+            "address": record.address,
+            "normalized_main_rubric_name_ru": record.rubric,
+            "reviews_summarized": record.reviews,
+            "search_info": "",  # Будет заполнено в search_node
+        }
         
-        for _, row in batch.iterrows():
-            org = {
-                "name": row.get("name", "—"),
-                "address": row.get("address", "—"),
-                "normalized_main_rubric_name_ru": row.get("normalized_main_rubric_name_ru", "—"),
-                "reviews_summarized": row.get("reviews_summarized", "—"),
-                "search_info": "",  # Будет заполнено в search_node
-            }
-            
-            # Полная инициализация состояния
-            inputs = {
-                "query": row["text"],
-                "org": org,
-                "use_cache": self.use_cache,
-                "prompt_version": self.prompt_version,
-                "log": {},
-                "response": None,
-                "next_action": None
-            }
-            
+        # Полная инициализация состояния
+        return {
+            "query": record.query,
+            "org": org,
+            "use_cache": self.use_cache,
+            "prompt_version": self.prompt_version,
+            "log": {},
+            "response": None,
+            "next_action": None,
+            "log_mode": self.log_mode,
+            "scoring": self.scoring,
+            "search_budget": self.search_budget,
+        }
+
+    def _packs(self, items):
+        return [items[i:i + self.pack_size] for i in range(0, len(items), self.pack_size)]
+
+    @staticmethod
+    def _collect(outputs):
+        results = [output.get("response", "ERROR") for output in outputs]
+        logs = [output.get("log", {}) for output in outputs]
+        return results, logs
+
+    def _invoke_row(self, inputs):
+        try:
+            return self.graph.invoke(inputs)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке строки: {e}")
+            return {"response": "ERROR", "log": {"error": str(e)}, "failed": True}
+
+    def _classify_packed(self, outputs):
+        """
+        Пакетная классификация состояний, прошедших граф без узла classify (строки с ошибкой пропускаются).
+        """
+        pending = [output for output in outputs if not output.get("failed")]
+        for pack in self._packs(pending):
+            started = time.perf_counter()
+            classify_packed_states(pack)
+            for output in pack:
+                add_node_time(output, "classify_packed", time.perf_counter() - started)
+        return outputs
+
+    def evaluate_batch(self, batch):
+        """
+        Оценка батча данных: DataFrame или список `EvalRecord` (см. `utils.records`)
+        """
+        outputs = [self._invoke_row(self._build_inputs(record)) for record in as_records(batch)]
+        if self.pack_size > 1:
+            outputs = self._classify_packed(outputs)
+        return self._collect(outputs)
+
+    async def _ainvoke_row(self, inputs, semaphore):
+        async with semaphore:
             try:
-                output = self.graph.invoke(inputs)
-                results.append(output.get("response", "ERROR"))
-                logs.append(output.get("log", {}))
+                return await self.graph.ainvoke(inputs)
             except Exception as e:
                 logger.error(f"Ошибка при обработке строки: {e}")
-                results.append("ERROR")
-                logs.append({"error": str(e)})
-            
-            # Небольшая задержка для избежания rate limiting
-            time.sleep(0.1)
-        
-        return results, logs
+                return {"response": "ERROR", "log": {"error": str(e)}, "failed": True}
+
+    async def _aclassify_packed(self, outputs, semaphore, on_done=None):
+        pending = [(i, output) for i, output in enumerate(outputs) if not output.get("failed")]
+
+        async def run_pack(pack):
+            async with semaphore:
+                started = time.perf_counter()
+                await aclassify_packed_states([output for _, output in pack])
+                for _, output in pack:
+                    add_node_time(output, "classify_packed", time.perf_counter() - started)
+            if on_done is not None:
+                for i, output in pack:
+                    on_done(i, output)
+
+        if on_done is not None:
+            for i, output in enumerate(outputs):
+                if output.get("failed"):
+                    on_done(i, output)
+        await asyncio.gather(*(run_pack(pack) for pack in self._packs(pending)))
+        return outputs
+
+    async def aevaluate_batch(self, batch, progress=None, on_done=None):
+        """
+        Асинхронная оценка батча: не более `max_concurrency` строк (или пакетов классификации) одновременно.
+        Результаты возвращаются в порядке строк батча.
+
+        `on_done(position, output)` вызывается для каждой строки сразу после её завершения
+        (используется для записи контрольной точки).
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_row(i, inputs):
+            result = await self._ainvoke_row(inputs, semaphore)
+            if progress is not None:
+                progress.update(1)
+            if on_done is not None and self.pack_size == 1:
+                on_done(i, result)
+            return result
+
+        outputs = await asyncio.gather(*(run_row(i, self._build_inputs(record)) for i, record in enumerate(as_records(batch))))
+        if self.pack_size > 1:
+            outputs = await self._aclassify_packed(list(outputs), semaphore, on_done)
+        return self._collect(outputs)
+
+    def _resume(self, data_eval, checkpoint_path):
+        """
+        Открывает контрольную точку и отбирает строки, которых в ней ещё нет.
+
+        Из файла читаются только ключи завершённых строк; их записи подгружаются при сборке результата (`_assemble`).
+
+        Returns:
+            tuple: (checkpoint | None, ключи всех строк, список `EvalRecord` оставшихся строк).
+        """
+        checkpoint = JsonlCheckpoint(checkpoint_path) if checkpoint_path else None
+        done = checkpoint.finished_keys() if checkpoint else set()
+
+        # Записи строятся один раз по колонкам; дальше работаем со списком, без iloc на каждый батч
+        records = build_records(data_eval)
+        keys = [record.key for record in records]
+        pending = [records[pos] for pos in pending_positions(keys, done)]
+        if checkpoint:
+            print(f"Контрольная точка {checkpoint_path}: готово {len(records) - len(pending)}, осталось {len(pending)}")
+        return checkpoint, keys, pending
+
+    def _run_cascade(self, pending, records, checkpoint):
+        """
+        Первая ступень каскада: уверенные строки получают ответ лексического оценщика без вызова агента.
+
+        Returns:
+            tuple: (строки для агента, {key: лог каскада} — добавляется к логу строки агента).
+        """
+        if self.cascade is None or not pending:
+            return pending, {}
+        probs = self.cascade.predict_proba(pending)
+        remaining, decided, cascade_logs = [], [], {}
+        for record, prob in zip(pending, probs):
+            response = self.cascade.decide(prob)
+            if response is None:
+                remaining.append(record)
+                cascade_logs[record.key] = {"cascade_stage": "agent", "lexical_prob": round(float(prob), 4)}
+            else:
+                log = {"cascade_stage": "lexical", "lexical_prob": round(float(prob), 4)}
+                decided.append(self._record(record.key, response, log))
+        records.update((record["key"], record) for record in decided)
+        if checkpoint:
+            checkpoint.append(decided)
+        print(f"Каскад: без агента решено {len(decided)} из {len(pending)} строк")
+        return remaining, cascade_logs
+
+    def _plan_dedup(self, pending, records, checkpoint):
+        """
+        Оставляет по одной строке на группу одинаковых входов текущего прогона
+        (результаты между прогонами не переиспользуются).
+
+        Returns:
+            tuple: (строки для агента, {key представителя: остальные строки группы}).
+        """
+        if not self.dedup or not pending:
+            return pending, {}
+        unique, followers = [], {}
+        for group in plan_dedup(pending).values():
+            unique.append(group[0])
+            if len(group) > 1:
+                followers[group[0].key] = group[1:]
+        duplicates = len(pending) - len(unique)
+        if duplicates:
+            print(f"Дедупликация: уникальных входов {len(unique)} из {len(pending)} (повторов {duplicates})")
+        return unique, followers
+
+    def _fan_out(self, record, followers):
+        """Копирует результат представителя на остальные строки группы (с пометкой повтора в логе)."""
+        if record["key"] not in followers:
+            return [record]
+        copies = [
+            self._record(follower.key, record["response"], {**record["log"], "dedup_reused": True, "dedup_of": record["key"]})
+            for follower in followers[record["key"]]
+        ]
+        return [record, *copies]
+
+    def _record(self, key, response, log):
+        return {"key": key, "response": response, "label": self.map_response_to_label(response), "log": log}
+
+    @staticmethod
+    def _llm_usage():
+        """Счётчики токенов общего GPTInterface агента (None, если LLM не инициализирован)."""
+        usage_stats = getattr(agent_nodes.get_llm(), "usage_stats", None)
+        return usage_stats() if usage_stats is not None else None
+
+    def _assemble(self, data_eval, keys, records, checkpoint=None, usage_before=None):
+        if checkpoint:
+            # Строки, готовые до этого прогона, читаются из контрольной точки только сейчас
+            records.update(checkpoint.lookup(key for key in keys if key not in records))
+        all_preds = [records[key]["response"] for key in keys]
+        all_logs = [records[key]["log"] for key in keys]
+        usage_after = self._llm_usage()
+        usage = None
+        if usage_before is not None and usage_after is not None:
+            usage = {key: usage_after[key] - usage_before[key] for key in ("prompt_tokens", "cached_tokens", "completion_tokens")}
+        return self._finalize(data_eval, all_preds, all_logs, usage=usage)
+
+    async def arun_full_evaluation(self, data_eval, batch_size=5, checkpoint_path=None):
+        """
+        Полная асинхронная оценка на всем датасете.
+
+        Все строки отправляются сразу, параллелизм ограничен `max_concurrency`;
+        `batch_size` в этом режиме не используется. С `checkpoint_path` каждая строка
+        записывается в контрольную точку сразу после завершения.
+        """
+        usage_before = self._llm_usage()
+        checkpoint, keys, pending = self._resume(data_eval, checkpoint_path)
+        records = {}
+        pending, cascade_logs = self._run_cascade(pending, records, checkpoint)
+        pending, followers = self._plan_dedup(pending, records, checkpoint)
+
+        def on_done(i, output):
+            key = pending[i].key
+            record = self._record(key, output.get("response", "ERROR"), {**cascade_logs.get(key, {}), **output.get("log", {})})
+            finished = self._fan_out(record, followers)
+            records.update((record["key"], record) for record in finished)
+            if checkpoint:
+                checkpoint.append(finished)
+
+        with tqdm(total=len(pending), desc="Agent Evaluation (async)") as progress:
+            await self.aevaluate_batch(pending, progress=progress, on_done=on_done)
+        return self._assemble(data_eval, keys, records, checkpoint, usage_before)
     
-    def run_full_evaluation(self, data_eval, batch_size=5):  
+    async def _arun_and_close(self, data_eval, batch_size, checkpoint_path):
+        # Клиент AsyncOpenAI привязан к циклу `asyncio.run` и закрывается вместе с ним
+        try:
+            return await self.arun_full_evaluation(data_eval, batch_size=batch_size, checkpoint_path=checkpoint_path)
+        finally:
+            await agent_nodes.aclose_llm()
+
+    def run_full_evaluation(self, data_eval, batch_size=5, checkpoint_path=None):
         """
-        Полная оценка на всем датасете
+        Полная оценка на всем датасете.
+        При `max_concurrency > 1` запускает асинхронный режим (`arun_full_evaluation`).
+
+        Параметры:
+            checkpoint_path (str, optional): JSONL-файл контрольной точки. Завершённые строки дописываются
+                в него после каждого батча; строки, уже записанные ранее, не пересчитываются.
         """
-        all_preds = []
-        all_logs = []
-        
-        for start in tqdm(range(0, len(data_eval), batch_size), desc="Agent Evaluation"):
-            batch = data_eval.iloc[start:start + batch_size]
+        if self.max_concurrency > 1:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(self._arun_and_close(data_eval, batch_size, checkpoint_path))
+            raise RuntimeError(
+                "Обнаружен запущенный event loop (Jupyter): используйте `await evaluator.arun_full_evaluation(...)`"
+            )
+
+        usage_before = self._llm_usage()
+        checkpoint, keys, pending = self._resume(data_eval, checkpoint_path)
+        records = {}
+        pending, cascade_logs = self._run_cascade(pending, records, checkpoint)
+        pending, followers = self._plan_dedup(pending, records, checkpoint)
+
+        for start in tqdm(range(0, len(pending), batch_size), desc="Agent Evaluation"):
+            batch = pending[start:start + batch_size]
             preds, logs = self.evaluate_batch(batch)
-            all_preds.extend(preds)
-            all_logs.extend(logs)
-        
+            batch_records = [
+                self._record(record.key, pred, {**cascade_logs.get(record.key, {}), **log})
+                for record, pred, log in zip(batch, preds, logs)
+            ]
+            batch_records = [finished for record in batch_records for finished in self._fan_out(record, followers)]
+            records.update((record["key"], record) for record in batch_records)
+            if checkpoint:
+                checkpoint.append(batch_records)
+
+        return self._assemble(data_eval, keys, records, checkpoint, usage_before)
+
+    def _finalize(self, data_eval, all_preds, all_logs, usage=None):
+        """
+        Добавляет предсказания и логи в DataFrame и печатает статистику.
+        Сводка телеметрии последнего прогона сохраняется в `self.telemetry` (см. `utils.telemetry`).
+        """
+        self.telemetry = summarize_logs(all_logs, usage=usage)
         # Создаем копию для безопасности
         data_eval = data_eval.copy()
         data_eval["agent_response"] = all_preds
         data_eval["agent_log"] = all_logs
-        data_eval["agent_pred_relevance"] = data_eval["agent_response"].apply(self.map_response_to_label)
+        data_eval["agent_pred_relevance"] = responses_to_labels(all_preds)
+        if self.scoring == "logprob":
+            data_eval["agent_prob_relevant"] = [log.get("classification_prob", log.get("lexical_prob")) for log in all_logs]
+            data_eval["agent_relevance_logit"] = [log.get("classification_logit") for log in all_logs]
         
         # Более детальная статистика
-        valid = data_eval[data_eval["agent_pred_relevance"] != -1.0]
-        error_count = len(data_eval[data_eval["agent_pred_relevance"] == -1.0])
+        acc, n_valid = accuracy(data_eval[RELEVANCE_COL].to_numpy(), data_eval["agent_pred_relevance"].to_numpy())
+        error_count = len(data_eval) - n_valid
         
         # Статистика по использованию поиска
         search_used = sum(1 for log in all_logs if log.get("need_search_decision") == "YES")
         
-        if len(valid) > 0:
-            acc = (valid[RELEVANCE_COL] == valid["agent_pred_relevance"]).mean()
-            print(f"Accuracy (по {len(valid)} валидным примерам): {acc:.4f}")
+        if n_valid > 0:
+            print(f"Accuracy (по {n_valid} валидным примерам): {acc:.4f}")
             print(f"Ошибок обработки: {error_count}")
             print(f"Поиск использован в {search_used} из {len(data_eval)} случаев ({search_used/len(data_eval)*100:.1f}%)")
+            gated = [log["need_search_gate"] for log in all_logs if "need_search_gate" in log]
+            if gated:
+                local = sum(1 for gate in gated if gate["decision"] is not None)
+                llm_calls = sum(1 for log in all_logs if "need_search_prompt_tokens" in log)
+                print(f"Фильтр поиска: решено без LLM {local} из {len(gated)} ({local/len(gated)*100:.1f}%), "
+                      f"LLM-вызовов на строку ≈ {1 + llm_calls/len(data_eval):.2f}")
+            wasted = sum(1 for log in all_logs if log.get("speculative_search_wasted"))
+            if any(log.get("speculative_search") for log in all_logs):
+                print(f"Спекулятивный поиск: оплачено впустую {wasted} запросов к поиску")
+            prompt_tokens = sum(log.get(f"{stage}_prompt_tokens", 0) for log in all_logs for stage in ("need_search", "classification"))
+            cached_tokens = sum(log.get(f"{stage}_cached_tokens", 0) for log in all_logs for stage in ("need_search", "classification"))
+            if prompt_tokens:
+                print(f"Входные токены: {prompt_tokens}, из кэша префикса провайдера: {cached_tokens} ({cached_tokens/prompt_tokens*100:.1f}%)")
+            stages = np.array([log.get("cascade_stage", "") for log in all_logs])
+            if (stages != "").any():
+                labels = data_eval[RELEVANCE_COL].to_numpy()
+                preds = data_eval["agent_pred_relevance"].to_numpy()
+                for stage, title in (("lexical", "лексический оценщик"), ("agent", "агент")):
+                    mask = stages == stage
+                    stage_acc, _ = accuracy(labels[mask], preds[mask])
+                    print(f"Каскад, {title}: {mask.sum()} строк ({mask.mean()*100:.1f}%), accuracy {stage_acc:.4f}")
+            packed = [log for log in all_logs if "classification_packed" in log]
+            if packed:
+                fallback = sum(1 for log in packed if log["classification_packed_fallback"])
+                print(f"Пакетная классификация: {len(packed)} строк, переспрошено по одной {fallback}")
+            print(format_summary(self.telemetry))
         else:
             acc = 0.0
             print("Нет валидных предсказаний для вычисления accuracy")
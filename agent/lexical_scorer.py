@@ -0,0 +1,250 @@
+# llm_relevance_agent/agent/lexical_scorer.py
+"""
+lexical_scorer.py
+
+Локальный (CPU, без API) оценщик релевантности — первая ступень каскада.
+
+Признаки пары (запрос, организация) строятся по `utils.text_features`:
+покрытие слов запроса рубрикой / названием / отзывами / адресом, TF-IDF косинус запроса и карточки
+(название + рубрика), доля релевантных пар (слово запроса, рубрика) и релевантность рубрики в train.
+Поверх признаков — логистическая регрессия, обученная на train-части `load_dataset`
+(статистики пар для обучения считаются вне фолда, чтобы модель не переобучалась на собственных метках).
+
+В каскаде (`RelevanceAgentEvaluator(cascade=True)`) строки с вероятностью >= high сразу получают
+RELEVANT_PLUS, <= low — IRRELEVANT; агенту (LLM) уходит только неуверенная середина.
+
+Обучение, подбор порогов на val и сохранение модели (LEXICAL_SCORER_PATH):
+    python -m agent.lexical_scorer
+"""
+
+import os
+import math
+import logging
+import argparse
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+from utils.config import (
+    RELEVANCE_COL, RANDOM_STATE, LEXICAL_SCORER_PATH, CASCADE_LOW_THRESHOLD, CASCADE_HIGH_THRESHOLD,
+)
+from utils.text_features import tokenize, coverage, LogisticModel
+from utils.records import build_records
+
+logger = logging.getLogger(__name__)
+
+FEATURE_NAMES = (
+    "rubric_coverage", "name_coverage", "reviews_coverage", "address_coverage",
+    "card_tfidf_cosine", "pair_rate", "rubric_rate", "query_tokens", "has_reviews",
+)
+
+# Сглаживание долей релевантности (псевдо-наблюдений с общей долей)
+_SMOOTHING = 2.0
+_FOLDS = 5
+
+
+def _rubric_key(rubric) -> str:
+    return rubric.strip().lower() if isinstance(rubric, str) else ""
+
+
+class _PairStats:
+    """Счётчики релевантности по рубрикам и парам (слово запроса, рубрика)."""
+
+    def __init__(self, prior=0.5, rubrics=None, pairs=None):
+        self.prior = prior
+        self.rubrics = rubrics or {}
+        self.pairs = pairs or {}
+
+    @classmethod
+    def fit(cls, query_tokens, rubrics, labels):
+        rubric_counts = defaultdict(lambda: [0, 0])
+        pair_counts = defaultdict(lambda: [0, 0])
+        for tokens, rubric, label in zip(query_tokens, rubrics, labels):
+            rubric_counts[rubric][0] += 1
+            rubric_counts[rubric][1] += int(label)
+            for token in set(tokens):
+                pair_counts[f"{token}\x1f{rubric}"][0] += 1
+                pair_counts[f"{token}\x1f{rubric}"][1] += int(label)
+        prior = float(np.mean(labels)) if len(labels) else 0.5
+        return cls(prior, dict(rubric_counts), dict(pair_counts))
+
+    def _rate(self, counts) -> float:
+        n, positive = counts if counts else (0, 0)
+        return (positive + _SMOOTHING * self.prior) / (n + _SMOOTHING)
+
+    def rubric_rate(self, rubric) -> float:
+        return self._rate(self.rubrics.get(rubric))
+
+    def pair_rate(self, tokens, rubric) -> float:
+        if not tokens:
+            return self.rubric_rate(rubric)
+        return float(np.mean([self._rate(self.pairs.get(f"{t}\x1f{rubric}")) for t in tokens]))
+
+    def to_dict(self) -> dict:
+        return {"prior": self.prior, "rubrics": self.rubrics, "pairs": self.pairs}
+
+
+class LexicalRelevanceScorer:
+    """
+    Оценщик релевантности по лексическим признакам.
+
+    Параметры:
+        low, high (float): Пороги каскада — ниже `low` IRRELEVANT, выше `high` RELEVANT_PLUS.
+    """
+
+    def __init__(self, model=None, idf=None, stats=None, low=CASCADE_LOW_THRESHOLD, high=CASCADE_HIGH_THRESHOLD):
+        self.model = model
+        self.idf = idf or {}
+        self.stats = stats or _PairStats()
+        self.low = low
+        self.high = high
+
+    @staticmethod
+    def _tokens(record):
+        return (
+            tokenize(record.query), tokenize(record.name), tokenize(record.rubric),
+            tokenize(record.reviews), tokenize(record.address),
+        )
+
+    def _tfidf(self, tokens) -> dict:
+        counts = Counter(tokens)
+        # Слова, не встречавшиеся в train, получают максимальный вес
+        default = max(self.idf.values()) if self.idf else 1.0
+        return {t: c * self.idf.get(t, default) for t, c in counts.items()}
+
+    def _cosine(self, a, b) -> float:
+        va, vb = self._tfidf(a), self._tfidf(b)
+        dot = sum(w * vb.get(t, 0.0) for t, w in va.items())
+        norm = math.sqrt(sum(w * w for w in va.values())) * math.sqrt(sum(w * w for w in vb.values()))
+        return dot / norm if norm else 0.0
+
+    def _features(self, tokens, rubric_key, stats):
+        query, name, rubric, reviews, address = tokens
+        return [
+            coverage(query, rubric),
+            coverage(query, name),
+            coverage(query, reviews),
+            coverage(query, address),
+            self._cosine(query, name + rubric),
+            stats.pair_rate(query, rubric_key),
+            stats.rubric_rate(rubric_key),
+            len(query),
+            float(bool(reviews)),
+        ]
+
+    def fit(self, records, labels):
+        labels = np.asarray(labels, dtype=float)
+        tokens = [self._tokens(record) for record in records]
+        rubric_keys = [_rubric_key(record.rubric) for record in records]
+
+        # IDF по карточкам организаций (название + рубрика)
+        document_freq = Counter(t for name_rubric in (set(tk[1] + tk[2]) for tk in tokens) for t in name_rubric)
+        n_docs = len(tokens)
+        self.idf = {t: math.log((1 + n_docs) / (1 + df)) + 1.0 for t, df in document_freq.items()}
+
+        # Статистики пар для обучающих признаков — вне фолда
+        folds = np.random.RandomState(RANDOM_STATE).permutation(n_docs) % _FOLDS
+        X = np.zeros((n_docs, len(FEATURE_NAMES)))
+        query_tokens = [tk[0] for tk in tokens]
+        for fold in range(_FOLDS):
+            train_idx = np.flatnonzero(folds != fold)
+            stats = _PairStats.fit(
+                [query_tokens[i] for i in train_idx], [rubric_keys[i] for i in train_idx], labels[train_idx],
+            )
+            for i in np.flatnonzero(folds == fold):
+                X[i] = self._features(tokens[i], rubric_keys[i], stats)
+
+        self.stats = _PairStats.fit(query_tokens, rubric_keys, labels)
+        self.model = LogisticModel(FEATURE_NAMES).fit(X, labels)
+        return self
+
+    def predict_proba(self, records) -> np.ndarray:
+        """Вероятность релевантности для списка `EvalRecord`."""
+        if not records:
+            return np.zeros(0)
+        X = [self._features(self._tokens(record), _rubric_key(record.rubric), self.stats) for record in records]
+        return self.model.predict_proba(np.array(X))
+
+    def decide(self, prob):
+        """Ответ первой ступени каскада: "RELEVANT_PLUS", "IRRELEVANT" или None (решает агент)."""
+        if prob >= self.high:
+            return "RELEVANT_PLUS"
+        if prob <= self.low:
+            return "IRRELEVANT"
+        return None
+
+    def save(self, path: str, **meta):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.model.save(
+            path, idf=self.idf, stats=self.stats.to_dict(), low=self.low, high=self.high, **meta,
+        )
+
+    @classmethod
+    def load(cls, path: str, low=None, high=None) -> "LexicalRelevanceScorer":
+        model, meta = LogisticModel.load(path)
+        return cls(
+            model, meta["idf"], _PairStats(**meta["stats"]),
+            low=meta.get("low", CASCADE_LOW_THRESHOLD) if low is None else low,
+            high=meta.get("high", CASCADE_HIGH_THRESHOLD) if high is None else high,
+        )
+
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+
+def get_lexical_scorer() -> LexicalRelevanceScorer:
+    """Общий оценщик, загруженный из LEXICAL_SCORER_PATH (модель обучается командой `python -m agent.lexical_scorer`)."""
+    global _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            if not os.path.exists(LEXICAL_SCORER_PATH):
+                raise FileNotFoundError(
+                    f"Модель каскада не найдена: {LEXICAL_SCORER_PATH}. Обучите её: python -m agent.lexical_scorer"
+                )
+            _scorer = LexicalRelevanceScorer.load(LEXICAL_SCORER_PATH)
+        return _scorer
+
+
+def band_report(probs, labels, low, high) -> dict:
+    """
+    Доля строк, решённых первой ступенью при порогах (low, high), и их accuracy.
+    """
+    probs = np.asarray(probs, dtype=float)
+    labels = np.asarray(labels, dtype=float)
+    confident = (probs >= high) | (probs <= low)
+    preds = (probs >= high).astype(float)
+    n = int(confident.sum())
+    return {
+        "low": low,
+        "high": high,
+        "share": n / len(probs) if len(probs) else 0.0,
+        "accuracy": float((preds[confident] == labels[confident]).mean()) if n else 0.0,
+    }
+
+
+def main(args):
+    from utils.config import DATA_PATH, setup_logging
+    from utils.data_loader import load_dataset, EVAL_COLUMNS
+
+    setup_logging()
+
+    train_data, val_data, _ = load_dataset(DATA_PATH, drop_uncertain=True, val_frac=0.01, columns=EVAL_COLUMNS)
+    scorer = LexicalRelevanceScorer(low=args.low, high=args.high)
+    scorer.fit(build_records(train_data), train_data[RELEVANCE_COL].to_numpy())
+    scorer.save(args.output, train_rows=len(train_data))
+    print(f"Модель каскада обучена на {len(train_data)} строках и сохранена в {args.output}")
+
+    probs = scorer.predict_proba(build_records(val_data))
+    labels = val_data[RELEVANCE_COL].to_numpy()
+    print("Пороги (low, high): доля строк без LLM, accuracy на них (val)")
+    for low, high in sorted({(args.low, args.high), (0.05, 0.95), (0.1, 0.9), (0.2, 0.8), (0.3, 0.7)}):
+        report = band_report(probs, labels, low, high)
+        print(f"  ({low:.2f}, {high:.2f}): {report['share']*100:.1f}% строк, accuracy {report['accuracy']:.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обучение локального оценщика релевантности (первая ступень каскада).")
+    parser.add_argument("--low", type=float, default=CASCADE_LOW_THRESHOLD, help="Порог IRRELEVANT")
+    parser.add_argument("--high", type=float, default=CASCADE_HIGH_THRESHOLD, help="Порог RELEVANT_PLUS")
+    parser.add_argument("--output", type=str, default=LEXICAL_SCORER_PATH, help="Куда сохранить модель")
+    main(parser.parse_args())
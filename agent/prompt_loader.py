@@ -1,7 +1,216 @@
 # llm_relevance_agent\agent\prompt_loader.py
+"""
+prompt_loader.py
+
+Реестр шаблонов промтов агента.
+
+Все файлы `{prompt_type}_{version}.txt` из AGENT_PROMPT_DIR читаются и проверяются один раз
+при первом обращении: плейсхолдеры каждого шаблона сверяются с полями, которые передают узлы графа
+(`PROMPT_FIELDS`), а сами шаблоны хранятся в памяти в разобранном виде. Поэтому узлы не обращаются
+к файловой системе на каждой строке, а ошибка в шаблоне обнаруживается при старте, а не как
+"ERROR" в каждой строке.
+
+Шаблоны с маркером PROMPT_SPLIT_MARKER делятся на статический префикс (правила и few-shot примеры,
+без плейсхолдеров) и переменный суффикс (`render_parts`) — это нужно для раскладки сообщений
+с кэшированием префикса (`PROMPT_PREFIX_LAYOUT`) и для пакетной классификации.
+
+Опционально (`PROMPT_HOT_RELOAD=true` или `PromptRegistry(watch=True)`) реестр раз в секунду
+проверяет время изменения файла и перечитывает изменённый шаблон.
+"""
 
 import os
-from utils.config import AGENT_PROMPT_DIR, PROMPT_VERSION
+import glob
+import time
+import string
+import logging
+import threading
+from utils.config import AGENT_PROMPT_DIR, PROMPT_VERSION, PROMPT_HOT_RELOAD
+from baseline.prompt_templates import PROMPT_SPLIT_MARKER
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые узлы графа передают в шаблоны каждого типа
+PROMPT_FIELDS = {
+    "need_search": frozenset({"query", "name", "address", "rubric", "reviews"}),
+    "classify": frozenset({"query", "name", "address", "rubric", "reviews", "search_info"}),
+}
+
+# Как часто (в секундах) проверять изменение файлов в режиме hot reload
+_RELOAD_CHECK_INTERVAL = 1.0
+
+
+def format_field(value) -> str:
+    """Текст значения поля в промте: пустые значения (None, "") — '—', остальные — `str(value)` (NaN — "nan")."""
+    return str(value) if value else "—"
+
+
+class PromptTemplate:
+    """
+    Разобранный шаблон промта.
+
+    Атрибуты:
+        prompt_type (str): Тип промта ("classify", "need_search").
+        version (str): Версия ("v1", "v2", ...).
+        text (str): Исходный текст шаблона.
+        fields (frozenset): Имена плейсхолдеров.
+        path (str): Путь к файлу.
+        mtime (float): Время изменения файла на момент загрузки.
+        prefix (str | None): Статическая часть до PROMPT_SPLIT_MARKER или None, если маркера нет
+            или до него встречаются плейсхолдеры.
+    """
+
+    __slots__ = ("prompt_type", "version", "text", "fields", "path", "mtime", "prefix", "_pieces", "_checked_at")
+
+    def __init__(self, prompt_type: str, version: str, text: str, path: str = None, mtime: float = 0.0):
+        self.prompt_type = prompt_type
+        self.version = version
+        self.text = text
+        self.path = path
+        self.mtime = mtime
+        self._checked_at = time.monotonic()
+
+        pieces = []
+        fields = set()
+        for literal, field, spec, conversion in string.Formatter().parse(text):
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                raise ValueError(
+                    f"Шаблон {prompt_type}_{version}: поддерживаются только простые плейсхолдеры {{name}}, найдено {{{field}}}"
+                )
+            pieces.append((literal, field))
+            if field is not None:
+                fields.add(field)
+        self._pieces = tuple(pieces)
+        self.fields = frozenset(fields)
+
+        prefix, marker, _ = text.partition(PROMPT_SPLIT_MARKER)
+        static = marker and "{" not in prefix and "}" not in prefix
+        self.prefix = prefix if static else None
+
+    @property
+    def template_id(self) -> str:
+        return f"{self.prompt_type}_{self.version}"
+
+    def render(self, **kwargs) -> str:
+        """
+        Подставляет значения в шаблон. Пустые значения заменяются на '—', лишние аргументы игнорируются.
+        """
+        parts = []
+        for literal, field in self._pieces:
+            parts.append(literal)
+            if field is not None:
+                parts.append(format_field(kwargs.get(field)))
+        return "".join(parts)
+
+    def render_parts(self, **kwargs):
+        """
+        Возвращает (prefix, suffix): статический префикс и заполненную переменную часть.
+        `prefix + suffix` совпадает с `render(**kwargs)`; без префикса возвращается (None, render(...)).
+        """
+        rendered = self.render(**kwargs)
+        if self.prefix is None:
+            return None, rendered
+        return self.prefix, rendered[len(self.prefix):]
+
+
+class PromptRegistry:
+    """
+    Реестр шаблонов промтов: загрузка и проверка всех файлов директории при создании.
+
+    Параметры:
+        prompt_dir (str): Директория с шаблонами (по умолчанию AGENT_PROMPT_DIR).
+        watch (bool): Перечитывать изменённые файлы (hot reload).
+    """
+
+    def __init__(self, prompt_dir: str = AGENT_PROMPT_DIR, watch: bool = False):
+        self.prompt_dir = prompt_dir
+        self.watch = watch
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.load_all()
+
+    def _load_file(self, prompt_type: str, version: str, path: str) -> PromptTemplate:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        template = PromptTemplate(prompt_type, version, text, path=path, mtime=os.path.getmtime(path))
+
+        allowed = PROMPT_FIELDS.get(prompt_type)
+        if allowed is not None and not template.fields <= allowed:
+            unknown = ", ".join(sorted(template.fields - allowed))
+            raise ValueError(
+                f"Шаблон {path} содержит плейсхолдеры, которые узлы не передают: {unknown}. "
+                f"Допустимые поля: {', '.join(sorted(allowed))}"
+            )
+        return template
+
+    def load_all(self):
+        """Загружает и проверяет все шаблоны `{prompt_type}_{version}.txt` директории."""
+        templates = {}
+        for path in sorted(glob.glob(os.path.join(self.prompt_dir, "*.txt"))):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            prompt_type, sep, version = stem.rpartition("_")
+            if not sep:
+                continue
+            templates[(prompt_type, version)] = self._load_file(prompt_type, version, path)
+        with self._lock:
+            self._templates = templates
+
+    def _maybe_reload(self, template: PromptTemplate) -> PromptTemplate:
+        now = time.monotonic()
+        if now - template._checked_at < _RELOAD_CHECK_INTERVAL:
+            return template
+        template._checked_at = now
+        try:
+            if os.path.getmtime(template.path) == template.mtime:
+                return template
+            reloaded = self._load_file(template.prompt_type, template.version, template.path)
+        except (OSError, ValueError) as e:
+            # Битый или удалённый файл не ломает запущенный процесс — остаётся прежняя версия
+            logger.error(f"Не удалось перечитать промт {template.path}: {e}")
+            return template
+        with self._lock:
+            self._templates[(template.prompt_type, template.version)] = reloaded
+        return reloaded
+
+    def get(self, prompt_type: str, version: str = None) -> PromptTemplate:
+        """
+        Возвращает шаблон по типу и версии (по умолчанию PROMPT_VERSION).
+
+        Исключения:
+            FileNotFoundError: Если шаблон не найден.
+        """
+        version = version or PROMPT_VERSION
+        template = self._templates.get((prompt_type, version))
+        if template is None:
+            path = os.path.join(self.prompt_dir, f"{prompt_type}_{version}.txt")
+            raise FileNotFoundError(f"Prompt not found: {path}")
+        if self.watch:
+            template = self._maybe_reload(template)
+        return template
+
+    def validate(self, version: str = None):
+        """
+        Проверяет, что для версии есть все шаблоны, используемые графом (need_search и classify).
+
+        Исключения:
+            FileNotFoundError: Если какого-то шаблона нет.
+        """
+        for prompt_type in PROMPT_FIELDS:
+            self.get(prompt_type, version)
+
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """Возвращает общий реестр промтов (создаётся при первом обращении)."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                _REGISTRY = PromptRegistry(AGENT_PROMPT_DIR, watch=PROMPT_HOT_RELOAD)
+    return _REGISTRY
+
 
 def load_prompt(prompt_type: str, version: str = None) -> str:
     """
@@ -13,7 +222,7 @@ def load_prompt(prompt_type: str, version: str = None) -> str:
             Если не указано, используется значение PROMPT_VERSION из конфигурации.
 
     Возвращает:
-        str: Содержимое текстового файла с промтом.
+        str: Содержимое текстового файла с промтом (из реестра, без обращения к диску).
 
     Исключения:
         FileNotFoundError: Если соответствующий файл не найден по ожидаемому пути.
@@ -28,12 +237,18 @@ def load_prompt(prompt_type: str, version: str = None) -> str:
     Расположение:
         Файлы промтов должны находиться в директории, указанной в AGENT_PROMPT_DIR (config.py).
     """
-    
-    version = version or PROMPT_VERSION
-    path = os.path.join(AGENT_PROMPT_DIR, f"{prompt_type}_{version}.txt")
+    return get_prompt_registry().get(prompt_type, version).text
 
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"Prompt not found: {path}")
 
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+def render_prompt(prompt_type: str, version: str = None, **fields) -> str:
+    """
+    Заполняет шаблон из реестра значениями полей (пустые значения заменяются на '—').
+    """
+    return get_prompt_registry().get(prompt_type, version).render(**fields)
+
+
+def render_prompt_parts(prompt_type: str, version: str = None, **fields):
+    """
+    Как `render_prompt`, но возвращает (prefix, suffix) — см. `PromptTemplate.render_parts`.
+    """
+    return get_prompt_registry().get(prompt_type, version).render_parts(**fields)
@@ -0,0 +1,113 @@
+# llm_relevance_agent/agent/prompt_log.py
+"""
+prompt_log.py
+
+Компактное логирование промтов агента.
+
+В режиме "full" узлы кладут в `state["log"]` полный текст промта (`search_prompt`, `classification_prompt`).
+В режиме "slim" вместо текста сохраняется ссылка `{key}_ref = {"template": "classify_v3", "sha1": ...}`:
+все переменные поля промта уже есть в строке датасета (запрос, название, адрес, рубрика, отзывы)
+и в самом логе (`search_results`), поэтому полный текст восстанавливается по требованию
+(`expand_log`, используется `utils.inspector`). Хэш позволяет проверить, что восстановленный промт
+совпадает с отправленным.
+
+Режим задаётся AGENT_LOG_MODE в `utils.config` или параметром `log_mode` оценщика.
+"""
+
+import ast
+import hashlib
+import logging
+from agent.prompt_loader import get_prompt_registry, format_field
+
+logger = logging.getLogger(__name__)
+
+LOG_MODES = ("full", "slim")
+
+# Ключ лога -> тип шаблона
+PROMPT_LOG_KEYS = {
+    "search_prompt": "need_search",
+    "classification_prompt": "classify",
+}
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+def log_prompt(state, key: str, prompt: str):
+    """
+    Записывает промт в лог состояния согласно `state["log_mode"]` ("full" по умолчанию).
+    """
+    if "log" not in state:
+        state["log"] = {}
+    if state.get("log_mode", "full") != "slim":
+        state["log"][key] = prompt
+        return
+    version = state.get("prompt_version", "v1")
+    if key == "classification_prompt":
+        version = state.get("classify_version") or version
+    state["log"][f"{key}_ref"] = {"template": f"{PROMPT_LOG_KEYS[key]}_{version}", "sha1": prompt_hash(prompt)}
+
+
+def parse_log(log) -> dict:
+    """Лог строки как dict (после CSV колонка `agent_log` хранится строкой repr)."""
+    if isinstance(log, dict):
+        return log
+    if isinstance(log, str) and log.strip():
+        try:
+            return ast.literal_eval(log)
+        except (ValueError, SyntaxError):
+            logger.error("Не удалось разобрать agent_log")
+    return {}
+
+
+def _value(row, column):
+    # Значение форматируется так же, как при отправке (`format_field`): NaN из датасета
+    # попал в промт как "nan", и при восстановлении должен дать тот же текст и тот же хэш
+    return format_field(row.get(column))
+
+
+def render_logged_prompt(row, log: dict, key: str):
+    """
+    Восстанавливает промт по ссылке `{key}_ref` из лога и данным строки.
+
+    Returns:
+        tuple[str | None, bool]: (текст промта или None, совпал ли хэш с отправленным).
+    """
+    ref = log.get(f"{key}_ref")
+    if not ref:
+        return log.get(key), True
+
+    prompt_type, _, version = ref["template"].rpartition("_")
+    fields = dict(
+        query=_value(row, "text"),
+        name=_value(row, "name"),
+        address=_value(row, "address"),
+        rubric=_value(row, "normalized_main_rubric_name_ru"),
+        reviews=_value(row, "reviews_summarized"),
+    )
+    if prompt_type == "classify":
+        search_info = log.get("search_results", "")
+        fields["search_info"] = "" if str(search_info).startswith("[ОШИБКА]") else search_info
+
+    try:
+        prompt = get_prompt_registry().get(prompt_type, version).render(**fields)
+    except FileNotFoundError as e:
+        logger.error(f"Шаблон для восстановления промта не найден: {e}")
+        return None, False
+    return prompt, prompt_hash(prompt) == ref.get("sha1")
+
+
+def expand_log(row, log=None) -> dict:
+    """
+    Возвращает копию лога строки, в которой ссылки на промты заменены полными текстами.
+    Если восстановленный текст не совпал с хэшем (например, шаблон изменён), к ключу добавляется пометка.
+    """
+    log = dict(parse_log(row.get("agent_log") if log is None else log))
+    for key in PROMPT_LOG_KEYS:
+        if f"{key}_ref" not in log:
+            continue
+        prompt, exact = render_logged_prompt(row, log, key)
+        log.pop(f"{key}_ref")
+        log[key if exact else f"{key} (не совпадает с отправленным)"] = prompt
+    return log
@@ -0,0 +1,277 @@
+# llm_relevance_agent/agent/ranking.py
+"""
+ranking.py
+
+Режим ранжирования: один запрос пользователя и список организаций-кандидатов.
+
+`RelevanceAgentEvaluator` оценивает каждую строку отдельно, поэтому для N кандидатов одного запроса
+решение о поиске и сам поиск повторяются N раз. `CandidateRanker.score_candidates(query, orgs, top_k)`
+выполняет работу уровня запроса один раз:
+
+1. Анализ запроса: токены запроса и априорная оценка кандидатов лексическим оценщиком каскада
+   (`agent.lexical_scorer`; без обученной модели — покрытие слов запроса названием и рубрикой).
+   Кандидаты классифицируются в порядке убывания априорной оценки.
+2. Общий контекст поиска (`search="shared"`): один поисковый запрос по тексту запроса пользователя,
+   результат подставляется в промт classify всех кандидатов. `search="per_org"` — прежний путь агента
+   (need_search и поиск по каждой организации), `search="none"` — без поиска.
+3. Классификация волнами по `max_concurrency` кандидатов (или пакетов при `pack_size > 1`); после каждой
+   волны при `top_k` проверяется, найдено ли уже `top_k` релевантных, — тогда остальные кандидаты
+   не классифицируются (stage = "skipped") и ранжируются по априорной оценке.
+
+Результат — кандидаты в порядке убывания релевантности: подтверждённые релевантные (по вероятности
+в режиме logprob, затем по априорной оценке), пропущенные, затем нерелевантные.
+
+Синхронный `score_candidates` выполняет все вызовы в одном долгоживущем цикле событий ранжировщика (как фоновый
+цикл `service.app`): клиент AsyncOpenAI и его пул соединений создаются один раз, а не на каждый запрос.
+Вызовы из нескольких потоков выполняются по очереди. `close()` закрывает клиент и цикл.
+
+Пример:
+    from agent.ranking import CandidateRanker
+    ranker = CandidateRanker(prompt_version="v3", max_concurrency=8)
+    ranked = ranker.score_candidates("шиномонтаж 24", [{"name": ..., "rubric": ..., "address": ...}, ...], top_k=3)
+    ranker.close()
+"""
+
+import asyncio
+import logging
+import threading
+import numpy as np
+from agent import agent_nodes
+from agent.agent_graph import build_relevance_graph
+from agent.agent_nodes import aclassify_node, aclassify_packed_states, clean_search_results
+from agent.search_tools import search_info_meta
+from agent.search_postprocess import postprocess_search_results, preload_tokenizer
+from agent.lexical_scorer import get_lexical_scorer
+from agent.prompt_loader import get_prompt_registry
+from baseline.logprob_scoring import SCORING_MODES
+from utils.config import AGENT_LOG_MODE, LLM_SCORING, PROMPT_VERSION, SEARCH_TOKEN_BUDGET
+from utils.records import record_from_dict
+from utils.metrics import responses_to_labels
+from utils.text_features import tokenize, coverage
+from utils.telemetry import record_search
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MODES = ("shared", "per_org", "none")
+
+
+class CandidateRanker:
+    """
+    Параметры:
+        prompt_version (str): Версия промтов агента.
+        use_cache (bool): Использовать кэш поиска.
+        max_concurrency (int): Кандидатов (или пакетов) в одной волне классификации.
+        pack_size (int): Кандидатов в одном запросе классификации (1 — по одному).
+        scoring (str): "text" или "logprob" (вероятность релевантности для упорядочивания).
+        search (str): "shared", "per_org" или "none" (см. описание модуля).
+        search_budget (int): Бюджет токенов контекста поиска (`agent.search_postprocess`, 0 — без сокращения);
+            общий контекст сокращается по словам запроса.
+    """
+
+    def __init__(self, prompt_version=PROMPT_VERSION, use_cache=True, max_concurrency=8, pack_size=1,
+                 scoring=LLM_SCORING, search="shared", log_mode=AGENT_LOG_MODE, search_budget=SEARCH_TOKEN_BUDGET):
+        get_prompt_registry().validate(prompt_version)
+        if scoring not in SCORING_MODES:
+            raise ValueError(f"Неизвестный режим оценки: {scoring}. Допустимые: {', '.join(SCORING_MODES)}")
+        if scoring == "logprob" and pack_size > 1:
+            raise ValueError("Режим logprob классифицирует кандидатов по одному: pack_size должен быть 1")
+        if search not in SEARCH_MODES:
+            raise ValueError(f"Неизвестный режим поиска: {search}. Допустимые: {', '.join(SEARCH_MODES)}")
+
+        self.prompt_version = prompt_version
+        self.use_cache = use_cache
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.pack_size = max(1, int(pack_size))
+        self.scoring = scoring
+        self.search = search
+        self.log_mode = log_mode
+        self.search_budget = int(search_budget)
+        if self.search_budget:
+            preload_tokenizer()
+        # Для per_org граф выполняет need_search и поиск, классификация — здесь, волнами
+        self.graph = build_relevance_graph(defer_classify=True) if search == "per_org" else None
+        # Цикл событий синхронного `score_candidates` (создаётся при первом вызове)
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def _state(self, record, search_info=""):
+        return {
+            "query": record.query,
+            "org": {
+                "name": record.name,
+                "address": record.address,
+                "normalized_main_rubric_name_ru": record.rubric,
+                "reviews_summarized": record.reviews,
+                "search_info": search_info,
+            },
+            "use_cache": self.use_cache,
+            "prompt_version": self.prompt_version,
+            "log": {},
+            "response": None,
+            "next_action": None,
+            "log_mode": self.log_mode,
+            "scoring": self.scoring,
+            "search_budget": self.search_budget,
+        }
+
+    @staticmethod
+    def _priors(query, records) -> np.ndarray:
+        """Априорная вероятность релевантности кандидатов (без вызовов API)."""
+        try:
+            return get_lexical_scorer().predict_proba(records)
+        except FileNotFoundError:
+            query_tokens = tokenize(query)
+            return np.array([
+                coverage(query_tokens, tokenize(record.name) + tokenize(record.rubric)) for record in records
+            ])
+
+    async def _shared_context(self, query, query_state):
+        """Один поиск по запросу пользователя для всех кандидатов (статистика — в `query_state["log"]`)."""
+        try:
+            results, meta = await asyncio.to_thread(search_info_meta, query, use_cache=self.use_cache)
+            record_search(query_state, meta)
+            results = clean_search_results(results)
+            if self.search_budget:
+                context = postprocess_search_results(results, query, budget=self.search_budget)
+                query_state["log"].update(context.as_log())
+                results = context.text
+            return results
+        except Exception as e:
+            logger.error(f"Ошибка общего поиска для ранжирования: {e}")
+            return ""
+
+    async def _prepare(self, state):
+        if self.graph is None:
+            return state
+        try:
+            return await self.graph.ainvoke(state)
+        except Exception as e:
+            logger.error(f"Ошибка при подготовке кандидата: {e}")
+            return {**state, "failed": True}
+
+    async def _classify_wave(self, states):
+        states = list(await asyncio.gather(*(self._prepare(state) for state in states)))
+        pending = [state for state in states if not state.get("failed")]
+        if self.pack_size > 1:
+            packs = [pending[i:i + self.pack_size] for i in range(0, len(pending), self.pack_size)]
+            await asyncio.gather(*(aclassify_packed_states(pack) for pack in packs))
+        else:
+            await asyncio.gather(*(aclassify_node(state) for state in pending))
+        return states
+
+    async def ascore_candidates(self, query: str, orgs, top_k: int = None):
+        """
+        Асинхронная версия `score_candidates`.
+        """
+        records = [record_from_dict(query, org, key=str(i)) for i, org in enumerate(orgs)]
+        if not records:
+            return []
+        priors = self._priors(query, records)
+        order = np.argsort(-priors, kind="stable")
+
+        query_state = {"log": {}}
+        search_info = await self._shared_context(query, query_state) if self.search == "shared" else ""
+
+        outputs = {}
+        wave_size = self.max_concurrency * self.pack_size
+        relevant = 0
+        for start in range(0, len(order), wave_size):
+            wave = [int(i) for i in order[start:start + wave_size]]
+            states = await self._classify_wave([self._state(records[i], search_info) for i in wave])
+            for i, state in zip(wave, states):
+                outputs[i] = state
+            relevant += int((responses_to_labels([s.get("response") or "ERROR" for s in states]) == 1.0).sum())
+            if top_k is not None and relevant >= top_k:
+                break
+
+        return self._rank(orgs, priors, outputs, query_state["log"])
+
+    def _rank(self, orgs, priors, outputs, query_log):
+        ranked = []
+        for i, org in enumerate(orgs):
+            state = outputs.get(i)
+            if state is None:
+                ranked.append({"index": i, "org": org, "response": None, "label": None, "prob": None,
+                               "prior": round(float(priors[i]), 4), "stage": "skipped", "log": {}})
+                continue
+            response = state.get("response") or "ERROR"
+            log = state.get("log", {})
+            if self.search == "shared":
+                log["shared_search"] = True
+            ranked.append({
+                "index": i, "org": org, "response": response,
+                "label": float(responses_to_labels([response])[0]),
+                "prob": log.get("classification_prob"),
+                "prior": round(float(priors[i]), 4), "stage": "llm", "log": log,
+            })
+
+        def sort_key(item):
+            # Подтверждённые релевантные > пропущенные > нерелевантные и ошибки
+            bucket = 1 if item["stage"] == "skipped" else (2 if item["label"] == 1.0 else 0)
+            prob = item["prob"] if item["prob"] is not None else (item["label"] if item["label"] is not None else 0.0)
+            return (-bucket, -prob, -item["prior"])
+
+        ranked.sort(key=sort_key)
+        for rank, item in enumerate(ranked, start=1):
+            item["rank"] = rank
+        # Общий поиск выполнен один раз — его статистика пишется в лог первого кандидата
+        if ranked and query_log:
+            ranked[0]["log"] = {**ranked[0]["log"], **query_log}
+        return ranked
+
+    def score_candidates(self, query: str, orgs, top_k: int = None):
+        """
+        Оценивает кандидатов одного запроса.
+
+        Args:
+            query (str): Запрос пользователя.
+            orgs (list[dict]): Организации (name, address, rubric, reviews или имена колонок датасета).
+            top_k (int, optional): Остановиться, когда найдено top_k релевантных.
+
+        Returns:
+            list[dict]: Кандидаты по убыванию релевантности: index (позиция в `orgs`), org, response, label,
+                prob (режим logprob), prior, stage ("llm" или "skipped"), rank, log.
+        """
+        if not agent_nodes.get_llm():
+            raise RuntimeError("LLM не инициализирован")
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            with self._loop_lock:
+                if self._loop is None:
+                    self._loop = asyncio.new_event_loop()
+                return self._loop.run_until_complete(self.ascore_candidates(query, orgs, top_k))
+        raise RuntimeError("Обнаружен запущенный event loop (Jupyter): используйте `await ranker.ascore_candidates(...)`")
+
+    def close(self):
+        """Закрывает клиент LLM цикла ранжировщика и сам цикл (следующий вызов создаст новый)."""
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+            if loop is None:
+                return
+            try:
+                loop.run_until_complete(agent_nodes.aclose_llm())
+                loop.run_until_complete(loop.shutdown_asyncgens())
+                loop.run_until_complete(loop.shutdown_default_executor())
+            finally:
+                loop.close()
+
+
+_default_ranker = None
+
+
+def score_candidates(query: str, orgs, top_k: int = None, **kwargs):
+    """
+    Ранжирование кандидатов с настройками по умолчанию (ранжировщик создаётся один раз).
+    С аргументами `kwargs` (параметры `CandidateRanker`) создаётся отдельный ранжировщик, закрываемый после вызова.
+    """
+    global _default_ranker
+    if kwargs:
+        ranker = CandidateRanker(**kwargs)
+        try:
+            return ranker.score_candidates(query, orgs, top_k)
+        finally:
+            ranker.close()
+    if _default_ranker is None:
+        _default_ranker = CandidateRanker()
+    return _default_ranker.score_candidates(query, orgs, top_k)
@@ -0,0 +1,222 @@
+# llm_relevance_agent/agent/search_cache.py
+"""
+search_cache.py
+
+Подключаемые бэкенды кэша результатов поиска (Tavily) для `search_info`.
+
+Бэкенды:
+- `SQLiteSearchCache` (по умолчанию): один файл SQLite с индексом по ключу, атомарные записи,
+  безопасен для нескольких процессов (WAL), поддерживает TTL и LRU-вытеснение.
+  При промахе может дочитывать старый JSON-кэш (`fallback_dirs`) и сразу импортировать запись.
+- `JsonDirSearchCache`: прежний формат — один файл `{md5(query)}.json` с ключом "results" на запрос.
+  Запись теперь атомарная (временный файл + os.replace).
+
+Ключ кэша в обоих бэкендах — md5 от текста запроса, поэтому старые директории переносятся без потерь.
+
+Миграция существующих директорий в SQLite (однократно):
+    python -m agent.search_cache --migrate experiments/agent/search_cache \
+        experiments/agent/search_cache_v1 experiments/agent/search_cache_v3
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.kv_store import SQLiteKVStore
+from utils.config import (
+    SEARCH_CACHE_DIR, SEARCH_CACHE_BACKEND, SEARCH_CACHE_PATH,
+    SEARCH_CACHE_TTL_DAYS, SEARCH_CACHE_MAX_ENTRIES, setup_logging,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(query: str) -> str:
+    """md5-хэш запроса — совпадает с именем файла в старом JSON-кэше."""
+    return hashlib.md5(query.encode("utf-8")).hexdigest()
+
+
+class SearchCache(ABC):
+    """Интерфейс кэша поиска: `get(query)` -> str | None, `set(query, results)`."""
+
+    @abstractmethod
+    def get(self, query: str):
+        """Результаты поиска по запросу или None при промахе."""
+
+    @abstractmethod
+    def set(self, query: str, results: str):
+        """Сохраняет результаты поиска по запросу."""
+
+    def stats(self) -> dict:
+        return {}
+
+
+class JsonDirSearchCache(SearchCache):
+    """
+    Кэш «один JSON-файл на запрос» в директории `cache_dir`.
+    """
+
+    def __init__(self, cache_dir: str = SEARCH_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except Exception as e:
+            logger.error(f"Не удалось создать директорию кэша: {e}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get_by_key(self, key: str):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("results", "")
+        except Exception as e:
+            logger.error(f"Ошибка при чтении кэша: {e}")
+            return None
+
+    def get(self, query: str):
+        result = self.get_by_key(make_cache_key(query))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def set(self, query: str, results: str):
+        path = self._path(make_cache_key(query))
+        try:
+            # Атомарная запись: конкурентный читатель видит либо старый, либо полный новый файл
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"results": results}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении в кэш: {e}")
+
+    def iter_items(self):
+        """Перебирает пары (key, results) всех файлов директории."""
+        for filename in sorted(os.listdir(self.cache_dir)):
+            if not filename.endswith(".json"):
+                continue
+            key = filename[:-len(".json")]
+            results = self.get_by_key(key)
+            if results is not None:
+                yield key, results
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+class SQLiteSearchCache(SearchCache):
+    """
+    Кэш поиска в одном файле SQLite.
+
+    Параметры:
+        path (str): Путь к файлу базы.
+        ttl_seconds (float, optional): Время жизни записи.
+        max_entries (int, optional): Максимальное число записей (LRU-вытеснение).
+        fallback_dirs (list[str], optional): Директории старого JSON-кэша, которые читаются при промахе.
+    """
+
+    def __init__(self, path: str = SEARCH_CACHE_PATH, ttl_seconds: float = None,
+                 max_entries: int = None, fallback_dirs=None):
+        self.store = SQLiteKVStore(path, table="search_results", ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self.fallbacks = [JsonDirSearchCache(d) for d in (fallback_dirs or []) if os.path.isdir(d)]
+
+    def get(self, query: str):
+        key = make_cache_key(query)
+        result = self.store.get(key)
+        if result is not None:
+            return result
+        for fallback in self.fallbacks:
+            result = fallback.get_by_key(key)
+            if result is not None:
+                # Ленивая миграция: запись из старого кэша переносится в SQLite
+                self.store.set(key, result)
+                return result
+        return None
+
+    def set(self, query: str, results: str):
+        try:
+            self.store.set(make_cache_key(query), results)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении в кэш: {e}")
+
+    def import_items(self, items) -> int:
+        """Импортирует пары (key, results) одной транзакцией, не перезаписывая существующие ключи."""
+        new_items = [(key, results) for key, results in items if key not in self.store]
+        if new_items:
+            self.store.set_many(new_items)
+        return len(new_items)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+def migrate_json_dirs(source_dirs, target: SQLiteSearchCache) -> int:
+    """
+    Переносит записи из директорий JSON-кэша в SQLite-кэш.
+
+    Возвращает:
+        int: Число импортированных (новых) записей.
+    """
+    imported = 0
+    for source_dir in source_dirs:
+        if not os.path.isdir(source_dir):
+            logger.warning(f"Директория кэша не найдена: {source_dir}")
+            continue
+        count = target.import_items(JsonDirSearchCache(source_dir).iter_items())
+        print(f"{source_dir}: импортировано {count} записей")
+        imported += count
+    return imported
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    """
+    Возвращает общий для процесса кэш поиска согласно SEARCH_CACHE_BACKEND ("sqlite" или "json").
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            if SEARCH_CACHE_BACKEND == "json":
+                _CACHE = JsonDirSearchCache(SEARCH_CACHE_DIR)
+            elif SEARCH_CACHE_BACKEND == "sqlite":
+                _CACHE = SQLiteSearchCache(
+                    SEARCH_CACHE_PATH,
+                    ttl_seconds=SEARCH_CACHE_TTL_DAYS * 24 * 3600 if SEARCH_CACHE_TTL_DAYS else None,
+                    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+                    fallback_dirs=[SEARCH_CACHE_DIR],
+                )
+            else:
+                raise ValueError(f"Неизвестный бэкенд кэша поиска: {SEARCH_CACHE_BACKEND}")
+        return _CACHE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграция JSON-кэша поиска в SQLite.")
+    parser.add_argument("--migrate", nargs="+", required=True, help="Директории со старым JSON-кэшем")
+    parser.add_argument("--db", type=str, default=SEARCH_CACHE_PATH, help="Путь к файлу SQLite-кэша")
+    args = parser.parse_args()
+
+    setup_logging()
+    total = migrate_json_dirs(args.migrate, SQLiteSearchCache(args.db))
+    print(f"Готово: импортировано {total} записей в {args.db}")
@@ -0,0 +1,275 @@
+# llm_relevance_agent/agent/search_gate.py
+"""
+search_gate.py
+
+Локальный фильтр перед узлом decide_need_search: очевидные решения о поиске принимаются без вызова LLM.
+
+Решение строится в два этапа:
+1. Правила:
+   - в запросе есть признак, которого обычно нет в карточке организации (круглосуточно, цены, доставка, ...),
+     и он не упомянут ни в названии, ни в рубрике, ни в отзывах -> YES;
+   - все слова запроса покрыты названием и рубрикой -> NO.
+2. Логистическая регрессия на лексических признаках (`utils.text_features`), обученная на залогированных
+   решениях `need_search_decision` (CSV с предсказаниями агента, колонка `agent_log`):
+   вероятность YES >= threshold -> YES, <= 1 - threshold -> NO.
+
+Остальные строки (неуверенные) уходят в LLM. Решение фильтра пишется в лог строки:
+`need_search_gate = {"decision": "YES" | "NO" | None, "prob": ..., "source": "rule" | "model" | None}`.
+
+Модель хранится по версии промта: SEARCH_GATE_DIR/search_gate_{version}.json; без файла работают только правила.
+
+Обучение и оценка согласия с LLM на отложенных логах:
+    python -m agent.search_gate --version v3 \\
+        --train experiments/agent/agent_val_predictions_v3.csv \\
+        --evaluate experiments/agent/agent_test_predictions_v3.csv
+"""
+
+import os
+import math
+import logging
+import argparse
+import threading
+from typing import TYPE_CHECKING
+import numpy as np
+from utils.config import SEARCH_GATE_DIR, SEARCH_GATE_THRESHOLD, setup_logging
+from utils.text_features import tokenize, stem, coverage, uncovered, LogisticModel
+from agent.prompt_log import parse_log
+
+if TYPE_CHECKING:
+    # pandas нужен только для обучения фильтра и импортируется там же (узлы агента его не загружают)
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Начала слов-признаков, которые редко проверяются по карточке организации. Токены запроса обрезаны
+# до STEM_LENGTH символов (`tokenize`), поэтому маркеры проходят через тот же стемминг: иначе длинный маркер
+# ("бесплат") не совпал бы ни с одним токеном ("беспл"). Формы "цена"/"цены" вместо "цен" — чтобы не ловить "центр".
+ATTRIBUTE_MARKERS = tuple(dict.fromkeys(stem(marker) for marker in (
+    "кругл", "24", "ночн", "ночью", "дешев", "недор", "цена", "цены", "цене", "цену", "стоим", "прайс", "достав",
+    "рабоч", "открыт", "выход", "запис", "онлайн", "бесплат", "скидк", "акци", "парков", "wifi",
+)))
+
+FEATURE_NAMES = (
+    "rubric_coverage", "name_coverage", "reviews_coverage", "card_coverage",
+    "query_tokens", "reviews_length", "has_reviews", "has_attribute", "has_digits",
+)
+
+
+def _is_attribute(token: str) -> bool:
+    return token.startswith(ATTRIBUTE_MARKERS)
+
+
+def _tokens(query, org):
+    return (
+        tokenize(query),
+        tokenize(org.get("name")),
+        tokenize(org.get("normalized_main_rubric_name_ru")),
+        tokenize(org.get("reviews_summarized")),
+    )
+
+
+def gate_features(query, org) -> list:
+    """Вектор признаков (в порядке FEATURE_NAMES) для запроса и полей организации."""
+    query_tokens, name, rubric, reviews = _tokens(query, org)
+    reviews_text = org.get("reviews_summarized")
+    reviews_length = len(reviews_text) if isinstance(reviews_text, str) else 0
+    return [
+        coverage(query_tokens, rubric),
+        coverage(query_tokens, name),
+        coverage(query_tokens, reviews),
+        coverage(query_tokens, name + rubric + reviews),
+        len(query_tokens),
+        math.log1p(reviews_length),
+        float(reviews_length > 0),
+        float(any(_is_attribute(t) for t in query_tokens)),
+        float(any(t.isdigit() for t in query_tokens)),
+    ]
+
+
+def rule_decision(query, org):
+    """Решение по правилам: "YES", "NO" или None (правила не сработали)."""
+    query_tokens, name, rubric, reviews = _tokens(query, org)
+    if not query_tokens:
+        return None
+    missing = uncovered(query_tokens, name, rubric, reviews)
+    if any(_is_attribute(t) for t in missing):
+        return "YES"
+    if not uncovered(query_tokens, name, rubric):
+        return "NO"
+    return None
+
+
+class SearchGate:
+    """
+    Фильтр решения о поиске.
+
+    Параметры:
+        model (LogisticModel | None): Обученная модель (None — только правила).
+        threshold (float): Минимальная уверенность модели для решения без LLM.
+        use_rules (bool): Применять правила до модели.
+    """
+
+    def __init__(self, model=None, threshold=SEARCH_GATE_THRESHOLD, use_rules=True):
+        self.model = model
+        self.threshold = threshold
+        self.use_rules = use_rules
+
+    def decide(self, query, org):
+        """
+        Returns:
+            tuple[str | None, float | None, str | None]: (решение, вероятность YES по модели, источник).
+            Решение None — строка неуверенная, нужен вызов LLM.
+        """
+        if self.use_rules:
+            decision = rule_decision(query, org)
+            if decision is not None:
+                return decision, None, "rule"
+        if self.model is None:
+            return None, None, None
+
+        prob = float(self.model.predict_proba(gate_features(query, org))[0])
+        if prob >= self.threshold:
+            return "YES", prob, "model"
+        if prob <= 1.0 - self.threshold:
+            return "NO", prob, "model"
+        return None, prob, None
+
+    def save(self, path: str, **meta):
+        self.model.save(path, threshold=self.threshold, **meta)
+
+
+def gate_model_path(version: str) -> str:
+    return os.path.join(SEARCH_GATE_DIR, f"search_gate_{version}.json")
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+def get_search_gate(version: str = "v1") -> SearchGate:
+    """
+    Общий фильтр для версии промта (модель и её порог загружаются один раз; без файла модели — только правила).
+    """
+    with _gates_lock:
+        if version not in _gates:
+            path = gate_model_path(version)
+            model, threshold = None, SEARCH_GATE_THRESHOLD
+            if os.path.exists(path):
+                try:
+                    model, meta = LogisticModel.load(path)
+                    # Порог, с которым модель сохранена при обучении (`--threshold`)
+                    threshold = meta.get("threshold", SEARCH_GATE_THRESHOLD)
+                except Exception as e:
+                    logger.error(f"Не удалось загрузить модель фильтра поиска {path}: {e}")
+            else:
+                logger.info(f"Модель фильтра поиска не найдена ({path}), используются только правила")
+            _gates[version] = SearchGate(model, threshold=threshold)
+        return _gates[version]
+
+
+def load_logged_decisions(paths) -> "pd.DataFrame":
+    """
+    Читает CSV с предсказаниями агента и оставляет строки с решением LLM о поиске.
+
+    Returns:
+        pd.DataFrame: Исходные колонки + `need_search` (1 — YES, 0 — NO).
+    """
+    import pandas as pd
+
+    frames = []
+    for path in paths:
+        data = pd.read_csv(path)
+        if "agent_log" not in data.columns:
+            logger.error(f"В {path} нет колонки agent_log")
+            continue
+        logs = [parse_log(log) for log in data["agent_log"]]
+        # Решения, принятые самим фильтром, в обучение не попадают
+        decisions = [
+            log.get("need_search_decision") if not (log.get("need_search_gate") or {}).get("source") else None
+            for log in logs
+        ]
+        data = data.assign(need_search=[1 if d and "YES" in d else 0 if d else -1 for d in decisions])
+        frames.append(data[data["need_search"] != -1])
+    if not frames:
+        return pd.DataFrame(columns=["text", "need_search"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _orgs(data: "pd.DataFrame"):
+    columns = ["name", "address", "normalized_main_rubric_name_ru", "reviews_summarized"]
+    present = [c for c in columns if c in data.columns]
+    return [dict(zip(present, values)) for values in zip(*(data[c].tolist() for c in present))]
+
+
+def train_search_gate(data: "pd.DataFrame", threshold=SEARCH_GATE_THRESHOLD) -> SearchGate:
+    """Обучает модель фильтра на залогированных решениях (`load_logged_decisions`)."""
+    X = np.array([gate_features(q, org) for q, org in zip(data["text"], _orgs(data))])
+    model = LogisticModel(FEATURE_NAMES).fit(X, data["need_search"].to_numpy())
+    return SearchGate(model, threshold=threshold)
+
+
+def evaluate_search_gate(gate: SearchGate, data: "pd.DataFrame") -> dict:
+    """
+    Согласие фильтра с решениями LLM.
+
+    Returns:
+        dict: rows, coverage (доля строк, решённых без LLM), agreement (согласие на них),
+            agreement по источникам (rule / model) и ожидаемое число LLM-вызовов на строку
+            (classify + оставшиеся need_search).
+    """
+    decided = {"rule": [0, 0], "model": [0, 0]}
+    for query, org, label in zip(data["text"], _orgs(data), data["need_search"]):
+        decision, _, source = gate.decide(query, org)
+        if decision is None:
+            continue
+        decided[source][0] += 1
+        decided[source][1] += int((decision == "YES") == bool(label))
+
+    rows = len(data)
+    covered = sum(n for n, _ in decided.values())
+    agreed = sum(a for _, a in decided.values())
+    return {
+        "rows": rows,
+        "coverage": covered / rows if rows else 0.0,
+        "agreement": agreed / covered if covered else 0.0,
+        **{f"{source}_rows": n for source, (n, _) in decided.items()},
+        **{f"{source}_agreement": (a / n if n else 0.0) for source, (n, a) in decided.items()},
+        "llm_calls_per_row": 1.0 + (1.0 - covered / rows if rows else 1.0),
+    }
+
+
+def main(args):
+    setup_logging()
+    if args.train:
+        data = load_logged_decisions(args.train)
+        if data.empty:
+            raise ValueError("Нет строк с решением need_search для обучения")
+        gate = train_search_gate(data, threshold=SEARCH_GATE_THRESHOLD if args.threshold is None else args.threshold)
+        path = args.output or gate_model_path(args.version)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        gate.save(path, prompt_version=args.version, train_rows=len(data))
+        print(f"Модель фильтра обучена на {len(data)} строках и сохранена в {path}")
+    else:
+        # Порог, сохранённый с моделью, заменяется только явным --threshold
+        gate = get_search_gate(args.version)
+        if args.threshold is not None:
+            gate.threshold = args.threshold
+
+    if args.evaluate:
+        stats = evaluate_search_gate(gate, load_logged_decisions(args.evaluate))
+        print(f"Строк: {stats['rows']}")
+        print(f"Решено без LLM: {stats['coverage']*100:.1f}% (правила {stats['rule_rows']}, модель {stats['model_rows']})")
+        print(f"Согласие с LLM: {stats['agreement']*100:.1f}% "
+              f"(правила {stats['rule_agreement']*100:.1f}%, модель {stats['model_agreement']*100:.1f}%)")
+        print(f"LLM-вызовов на строку: {stats['llm_calls_per_row']:.2f} (без фильтра 2.00)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обучение и оценка локального фильтра решения о поиске.")
+    parser.add_argument("--version", type=str, default="v1", help="Версия промта need_search")
+    parser.add_argument("--train", nargs="+", default=None, help="CSV с предсказаниями агента (колонка agent_log)")
+    parser.add_argument("--evaluate", nargs="+", default=None, help="CSV для оценки согласия с LLM")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Порог уверенности модели (по умолчанию — сохранённый с моделью, при обучении — SEARCH_GATE_THRESHOLD)")
+    parser.add_argument("--output", type=str, default=None, help="Куда сохранить модель (по умолчанию SEARCH_GATE_DIR)")
+    main(parser.parse_args())
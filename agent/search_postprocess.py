@@ -0,0 +1,245 @@
+# llm_relevance_agent/agent/search_postprocess.py
+"""
+search_postprocess.py
+
+Постобработка результатов поиска перед подстановкой в промт classify (слот `{search_info}`).
+
+`search_remote` склеивает полный `content` до трёх результатов Tavily, и в промт попадает длинный, зашумлённый
+и часто повторяющийся текст. `postprocess_search_results(text, query, org, budget)` сокращает его:
+
+1. Дедупликация: результат поиска (фрагмент, разделённый пустой строкой) или предложение, почти совпадающее
+   с уже принятым (коэффициент Жаккара по токенам `utils.text_features.tokenize` не ниже SEARCH_DEDUP_THRESHOLD),
+   отбрасывается.
+2. Оценка предложений: сумма весов токенов предложения, встречающихся в запросе (2), названии и рубрике (1)
+   и адресе (0.5) организации.
+3. Бюджет: если текст длиннее `budget` токенов, предложения берутся по убыванию оценки (при равенстве — в порядке
+   выдачи), пока помещаются в бюджет, и выводятся в исходном порядке. Если не помещается ни одно предложение,
+   лучшее обрезается по словам (слово длиннее бюджета — по символам).
+
+Токены считаются токенизатором модели (`tiktoken`, кодировка SEARCH_TOKENIZER_ENCODING); если tiktoken
+не установлен или кодировка недоступна, — оценкой `utils.rate_limiter.estimate_tokens`. Файл кодировки
+скачивается tiktoken при первом использовании, поэтому оценщик загружает его при создании (`preload_tokenizer`),
+а не на первой строке с поиском.
+
+Результат (`SearchContext`) содержит текст и статистику; `as_log()` — поля лога строки:
+search_tokens_raw, search_tokens_kept и search_compression (доля оставленных токенов).
+
+Пример:
+    from agent.search_postprocess import postprocess_search_results
+    context = postprocess_search_results(text, "шиномонтаж 24", {"name": ..., "address": ...}, budget=300)
+    context.text, context.compression
+"""
+
+import re
+import logging
+import threading
+from typing import NamedTuple
+from utils.config import SEARCH_TOKEN_BUDGET, SEARCH_DEDUP_THRESHOLD, SEARCH_TOKENIZER_ENCODING
+from utils.rate_limiter import estimate_tokens
+from utils.text_features import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Вес совпадения токена предложения с полем строки (для токена, встречающегося в нескольких полях, — наибольший)
+FIELD_WEIGHTS = (
+    ("query", 2.0),
+    ("name", 1.0),
+    ("rubric", 1.0),
+    ("address", 0.5),
+)
+
+_SNIPPET_BREAK = re.compile(r"\n\s*\n")
+# Конец предложения перед заглавной буквой, цифрой или кавычкой, либо перевод строки
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?…])\s+(?=[«\"A-ZА-ЯЁ0-9])|\s*\n\s*")
+
+_encoder = None
+_encoder_failed = False
+_encoder_lock = threading.Lock()
+
+
+def _get_encoder():
+    """Кодировка tiktoken (создаётся один раз) или None, если токенизатор недоступен."""
+    global _encoder, _encoder_failed
+    if _encoder is not None or _encoder_failed:
+        return _encoder
+    with _encoder_lock:
+        if _encoder is None and not _encoder_failed:
+            try:
+                import tiktoken
+
+                _encoder = tiktoken.get_encoding(SEARCH_TOKENIZER_ENCODING)
+            except Exception as e:
+                logger.warning(f"Токенизатор tiktoken недоступен, токены поиска оцениваются по длине текста: {e}")
+                _encoder_failed = True
+    return _encoder
+
+
+def preload_tokenizer() -> bool:
+    """Загружает кодировку tiktoken заранее (при старте оценщика). Returns: True, если токенизатор доступен."""
+    return _get_encoder() is not None
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов текста."""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return estimate_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+class SearchContext(NamedTuple):
+    """Текст контекста поиска после постобработки и статистика сжатия."""
+    text: str
+    tokens_raw: int = 0
+    tokens_kept: int = 0
+    duplicates: int = 0  # отброшено почти-дубликатов (фрагментов и предложений)
+    truncated: bool = False  # сработал бюджет токенов
+
+    @property
+    def compression(self) -> float:
+        return self.tokens_kept / self.tokens_raw if self.tokens_raw else 1.0
+
+    def as_log(self) -> dict:
+        return {
+            "search_tokens_raw": self.tokens_raw,
+            "search_tokens_kept": self.tokens_kept,
+            "search_compression": round(self.compression, 4),
+        }
+
+
+class _Sentence(NamedTuple):
+    snippet: int
+    text: str
+    tokens: frozenset
+
+
+def _jaccard(a, b) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _is_duplicate(tokens, seen, threshold) -> bool:
+    return any(_jaccard(tokens, other) >= threshold for other in seen)
+
+
+def split_sentences(text: str, dedup_threshold: float = SEARCH_DEDUP_THRESHOLD):
+    """
+    Предложения выдачи без почти-дубликатов.
+
+    Returns:
+        tuple[list, int]: Предложения (номер фрагмента, текст, токены) и число отброшенных дубликатов.
+    """
+    sentences, seen_snippets, seen_sentences = [], [], []
+    duplicates = 0
+    for index, snippet in enumerate(part for part in _SNIPPET_BREAK.split(text) if part.strip()):
+        snippet_tokens = frozenset(tokenize(snippet))
+        if _is_duplicate(snippet_tokens, seen_snippets, dedup_threshold):
+            duplicates += 1
+            continue
+        seen_snippets.append(snippet_tokens)
+        for sentence in _SENTENCE_BREAK.split(snippet):
+            sentence = sentence.strip()
+            tokens = frozenset(tokenize(sentence))
+            if not tokens:
+                continue
+            if _is_duplicate(tokens, seen_sentences, dedup_threshold):
+                duplicates += 1
+                continue
+            seen_sentences.append(tokens)
+            sentences.append(_Sentence(index, sentence, tokens))
+    return sentences, duplicates
+
+
+def field_weights(query: str = "", org: dict = None) -> dict:
+    """Токен -> вес по полям строки (FIELD_WEIGHTS); рубрика — `rubric` или столбец датасета."""
+    org = org or {}
+    fields = {
+        "query": query,
+        "name": org.get("name"),
+        "rubric": org.get("rubric") or org.get("normalized_main_rubric_name_ru"),
+        "address": org.get("address"),
+    }
+    weights = {}
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(fields[field]):
+            weights[token] = max(weights.get(token, 0.0), weight)
+    return weights
+
+
+def _join(sentences) -> str:
+    snippets = {}
+    for sentence in sentences:
+        snippets.setdefault(sentence.snippet, []).append(sentence.text)
+    return "\n\n".join(" ".join(texts) for texts in snippets.values())
+
+
+def _longest_prefix(size: int, fits) -> int:
+    """Наибольшее n <= size, для которого fits(n) (fits монотонна, fits(0) истинно)."""
+    low, high = 0, size
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _truncate(text: str, budget: int) -> str:
+    """
+    Наибольшее начало текста по словам, укладывающееся в бюджет; если не помещается даже первое слово
+    (длинная строка без пробелов), текст обрезается по символам.
+    """
+    words = text.split()
+    count = _longest_prefix(len(words), lambda n: count_tokens(" ".join(words[:n])) <= budget)
+    if count:
+        return " ".join(words[:count])
+    text = text.strip()
+    return text[:_longest_prefix(len(text), lambda n: count_tokens(text[:n]) <= budget)]
+
+
+def _select(sentences, weights, budget):
+    def score(sentence):
+        return sum(weights.get(token, 0.0) for token in sentence.tokens)
+
+    ranked = sorted(range(len(sentences)), key=lambda i: (-score(sentences[i]), i))
+    chosen, used = [], 0
+    for i in ranked:
+        cost = count_tokens(sentences[i].text) + 1  # + разделитель
+        if used + cost <= budget:
+            chosen.append(i)
+            used += cost
+    if not chosen and ranked:
+        best = sentences[ranked[0]]
+        return [best._replace(text=_truncate(best.text, budget))]
+    return [sentences[i] for i in sorted(chosen)]
+
+
+def postprocess_search_results(text: str, query: str = "", org: dict = None, budget: int = SEARCH_TOKEN_BUDGET,
+                               dedup_threshold: float = SEARCH_DEDUP_THRESHOLD) -> SearchContext:
+    """
+    Дедупликация, оценка предложений и бюджет токенов для очищенного текста выдачи (`clean_search_results`).
+
+    Args:
+        text (str): Текст выдачи.
+        query (str): Запрос пользователя.
+        org (dict, optional): Организация (name, address и rubric или normalized_main_rubric_name_ru);
+            без неё предложения оцениваются только по запросу.
+        budget (int): Лимит токенов результата (0 — без лимита, только дедупликация).
+        dedup_threshold (float): Порог сходства почти-дубликатов.
+
+    Returns:
+        SearchContext: Текст и статистика сжатия.
+    """
+    if not text:
+        return SearchContext("")
+    tokens_raw = count_tokens(text)
+    sentences, duplicates = split_sentences(text, dedup_threshold)
+    result = _join(sentences)
+    truncated = bool(budget) and count_tokens(result) > budget
+    if truncated:
+        result = _join(_select(sentences, field_weights(query, org), budget))
+    return SearchContext(result, tokens_raw, count_tokens(result), duplicates, truncated)
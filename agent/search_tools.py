@@ -1,29 +1,141 @@
 # llm_relevance_agent\agent\search_tools.py
 import os
-import json
-import hashlib
+import time
 import logging
-from dotenv import load_dotenv
-from utils.config import SEARCH_CACHE_DIR
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from agent.search_cache import get_search_cache
+from utils.config import ENV_PATH, TAVILY_BASE_URL, SEARCH_POOL_SIZE
+from utils.rate_limiter import get_limiter, call_with_retries
+
+# ✅ ДОБАВЛЕНО: Безопасный импорт HTTP-клиента для Tavily
+# (requests — явная зависимость в requirements.txt; TavilyClient открывал новое соединение на каждый запрос,
+# поэтому ходим в тот же REST API через общую сессию с пулом keep-alive соединений).
+# Сам requests импортируется при создании клиента: импорт модуля проверяет только наличие пакета
+TAVILY_AVAILABLE = importlib.util.find_spec("requests") is not None
+if not TAVILY_AVAILABLE:
+    logging.warning("requests не установлен. Поиск будет возвращать заглушку.")
 
-# ✅ ДОБАВЛЕНО: Безопасный импорт Tavily
-try:
-    from tavily import TavilyClient
-    TAVILY_AVAILABLE = True
-except ImportError:
-    TAVILY_AVAILABLE = False
-    logging.warning("Tavily не установлен. Поиск будет возвращать заглушку.")
+logger = logging.getLogger(__name__)
 
-# Убедимся, что .env загружен
-load_dotenv()
 
-logger = logging.getLogger(__name__)
+class TavilySearchClient:
+    """
+    Клиент Tavily Search API поверх `requests.Session` с пулом keep-alive соединений.
+
+    Один экземпляр безопасно использовать из нескольких потоков: TLS-рукопожатие
+    выполняется один раз на соединение пула, а не на каждый запрос.
+
+    Параметры:
+        api_key (str): Ключ Tavily (TAVILY_API_KEY).
+        base_url (str): Адрес API (по умолчанию TAVILY_BASE_URL из config.py).
+        pool_size (int): Максимальное число одновременно открытых соединений.
+        timeout (float): Таймаут запроса в секундах.
+    """
+
+    def __init__(self, api_key: str, base_url: str = TAVILY_BASE_URL, pool_size: int = SEARCH_POOL_SIZE, timeout: float = 60):
+        self.base_url = base_url.rstrip("/")
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        })
+
+    def search(self, query: str, max_results: int = 3) -> dict:
+        """
+        Выполняет поиск. При ошибке HTTP выбрасывает `requests.HTTPError`
+        (в нём есть статус и заголовки ответа — их использует `call_with_retries`, включая Retry-After).
+        """
+        response = self.session.post(
+            f"{self.base_url}/search",
+            json={"query": query, "max_results": max_results},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+_CLIENT = None
+_CLIENT_FAILED = False
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_search_client():
+    """
+    Лениво создаёт общий для процесса `TavilySearchClient`.
+    Отсутствие TAVILY_API_KEY запоминается: .env не перечитывается при каждом поиске.
+
+    Возвращает:
+        TavilySearchClient | None: Клиент или None, если HTTP-клиент не установлен или не найден TAVILY_API_KEY.
+    """
+    global _CLIENT, _CLIENT_FAILED
+    if _CLIENT is not None or _CLIENT_FAILED or not TAVILY_AVAILABLE:
+        return _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None and not _CLIENT_FAILED:
+            # .env загружается при первом обращении к поиску, а не при импорте модуля
+            from dotenv import load_dotenv
+
+            load_dotenv(ENV_PATH)
+            tavily_api_key = os.getenv("TAVILY_API_KEY")
+            if tavily_api_key:
+                _CLIENT = TavilySearchClient(api_key=tavily_api_key)
+            else:
+                _CLIENT_FAILED = True
+        return _CLIENT
+
+
+def get_cached_results(query: str, use_cache: bool = True):
+    """
+    Возвращает результат из кэша поиска или None (промах, пустой запрос или `use_cache=False`).
+    """
+    if not use_cache or not query.strip():
+        return None
+    try:
+        return get_search_cache().get(query)
+    except Exception as e:
+        logger.error(f"Ошибка при чтении кэша: {e}")
+        return None
+
+
+def search_remote(query: str, stats: dict = None) -> str:
+    """
+    Запрос к Tavily (без чтения кэша); успешный результат сохраняется в кэш.
+    В `stats` (если передан) записывается число повторов запроса (`retries`).
+    """
+    # ✅ ДОБАВЛЕНО: Проверка доступности Tavily
+    if not TAVILY_AVAILABLE:
+        logger.warning("Tavily недоступен, возвращаем заглушку")
+        return f"[ЗАГЛУШКА] Результаты поиска для: {query}"
+
+    client = get_search_client()
+    if client is None:
+        logger.error("TAVILY_API_KEY не найден в .env файле")
+        return f"[ОШИБКА] Не найден API ключ для поиска по запросу: {query}"
+
+    try:
+        result = call_with_retries(
+            lambda: client.search(query=query, max_results=3), get_limiter("search"), stats=stats,
+        )
+        snippets = "\n\n".join([r.get("content", "") for r in result.get("results", [])])
+
+        # Кэш сам логгирует ошибки записи
+        get_search_cache().set(query, snippets)
+
+        return snippets
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении поиска: {e}")
+        return f"[ОШИБКА] Не удалось выполнить поиск по запросу: {query}"
 
-# ✅ ДОБАВЛЕНО: Создание директории с обработкой ошибок
-try:
-    os.makedirs(SEARCH_CACHE_DIR, exist_ok=True)
-except Exception as e:
-    logger.error(f"Не удалось создать директорию кэша: {e}")
 
 def search_info(query: str, use_cache: bool = True) -> str:
     """
@@ -41,60 +153,86 @@ def search_info(query: str, use_cache: bool = True) -> str:
              Если используется кэш — из кэша. Если нет Tavily или API недоступен — возвращается заглушка/ошибка.
 
     Кэширование:
-        - Использует md5-хэш от запроса как имя файла.
-        - Кэш хранится в директории, указанной в `SEARCH_CACHE_DIR` из `config.py`.
-        - Результаты сохраняются как JSON с ключом "results".
+        - Использует md5-хэш от запроса как ключ.
+        - Бэкенд выбирается `SEARCH_CACHE_BACKEND` из `config.py` (см. `agent.search_cache`):
+          "sqlite" — один индексированный файл `SEARCH_CACHE_PATH` (по умолчанию),
+          "json" — прежний формат, один JSON-файл на запрос в `SEARCH_CACHE_DIR`.
 
     Обработка ошибок:
         - Безопасная загрузка `.env` и API ключа.
         - Логгируются ошибки чтения/записи кэша и обращения к API.
+        - Запросы к Tavily идут через общий лимитер "search"; 429 и таймауты повторяются
+          с экспоненциальной задержкой (см. `utils.rate_limiter`).
+
+    Соединения:
+        - Используется один общий клиент (`get_search_client`) с пулом keep-alive соединений.
 
     Пример:
         >>> search_info("кафе с завтраками на арбате")
         "Заведение X предлагает завтраки ежедневно с 8:00...\\n\\nЗаведение Y находится недалеко от Арбата..."
 
     Зависимости:
-        - Требуется TavilyClient и переменная окружения TAVILY_API_KEY.
+        - Требуется requests и переменная окружения TAVILY_API_KEY.
     """
     if not query.strip():
         return ""
-    
-    cache_key = hashlib.md5(query.encode("utf-8")).hexdigest()
-    cache_path = os.path.join(SEARCH_CACHE_DIR, f"{cache_key}.json")
-
-    # ✅ ДОБАВЛЕНО: Обработка ошибок при чтении кэша
-    if use_cache and os.path.exists(cache_path):
-        try:
-            with open(cache_path, "r", encoding="utf-8") as f:
-                cached_data = json.load(f)
-                return cached_data.get("results", "")
-        except Exception as e:
-            logger.error(f"Ошибка при чтении кэша: {e}")
 
-    # ✅ ДОБАВЛЕНО: Проверка доступности Tavily
-    if not TAVILY_AVAILABLE:
-        logger.warning("Tavily недоступен, возвращаем заглушку")
-        return f"[ЗАГЛУШКА] Результаты поиска для: {query}"
+    cached = get_cached_results(query, use_cache)
+    if cached is not None:
+        return cached
 
-    tavily_api_key = os.getenv("TAVILY_API_KEY")
-    if not tavily_api_key:
-        logger.error("TAVILY_API_KEY не найден в .env файле")
-        return f"[ОШИБКА] Не найден API ключ для поиска по запросу: {query}"
+    return search_remote(query)
 
-    try:
-        tavily = TavilyClient(api_key=tavily_api_key)
-        result = tavily.search(query=query, max_results=3)
-        snippets = "\n\n".join([r.get("content", "") for r in result.get("results", [])])
-        
-        # ✅ ДОБАВЛЕНО: Обработка ошибок при сохранении кэша
-        try:
-            with open(cache_path, "w", encoding="utf-8") as f:
-                json.dump({"results": snippets}, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Ошибка при сохранении в кэш: {e}")
-        
-        return snippets
-        
-    except Exception as e:
-        logger.error(f"Ошибка при выполнении поиска: {e}")
-        return f"[ОШИБКА] Не удалось выполнить поиск по запросу: {query}"
\ No newline at end of file
+
+def search_info_meta(query: str, use_cache: bool = True):
+    """
+    `search_info` со статистикой вызова для телеметрии.
+
+    Возвращает:
+        tuple[str, dict]: Результат и {"cache_hit": bool, "retries": int, "time": секунды}.
+    """
+    started = time.perf_counter()
+    stats = {"retries": 0}
+    if not query.strip():
+        return "", {"cache_hit": False, "retries": 0, "time": 0.0}
+
+    result = get_cached_results(query, use_cache)
+    cache_hit = result is not None
+    if not cache_hit:
+        result = search_remote(query, stats=stats)
+    return result, {"cache_hit": cache_hit, "retries": stats["retries"], "time": time.perf_counter() - started}
+
+
+def search_many(queries, use_cache: bool = True, max_workers: int = SEARCH_POOL_SIZE) -> list:
+    """
+    Пакетная версия `search_info`: промахи кэша отправляются в Tavily параллельно.
+
+    Одинаковые запросы выполняются один раз. Параллелизм ограничен `max_workers`
+    и общим лимитером "search".
+
+    Параметры:
+        queries (list[str]): Список запросов.
+        use_cache (bool, optional): Использовать ли кэш.
+        max_workers (int, optional): Максимум одновременных запросов к API.
+
+    Возвращает:
+        list[str]: Результаты в порядке `queries`.
+    """
+    results = {}
+    misses = []
+    for query in dict.fromkeys(queries):
+        if not query.strip():
+            results[query] = ""
+            continue
+        cached = get_cached_results(query, use_cache)
+        if cached is not None:
+            results[query] = cached
+        else:
+            misses.append(query)
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(misses)))) as executor:
+            for query, snippets in zip(misses, executor.map(search_remote, misses)):
+                results[query] = snippets
+
+    return [results[query] for query in queries]
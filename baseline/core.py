@@ -1,16 +1,19 @@
-import time
-import pandas as pd
-from tqdm.notebook import tqdm  
-from sklearn.metrics import accuracy_score
+import logging
 from baseline.llm_interface import GPTInterface
-from baseline.prompt_templates import build_relevance_prompt
-from utils.config import RELEVANCE_COL
+from baseline.prompt_templates import build_relevance_parts, build_relevance_item, RELEVANCE_INSTRUCTIONS
+from baseline.packed_prompts import classify_packed, strip_answer_tail
+from baseline.logprob_scoring import SCORING_MODES, score_prompt
+from utils.config import RELEVANCE_COL, LLM_SCORING
+from utils.checkpoint import JsonlCheckpoint, pending_positions
+from utils.records import build_records, as_records
+from utils.metrics import responses_to_labels, accuracy
+from utils.progress import tqdm
 
 """
 RelevanceBaseline
 
 Этот модуль реализует базовый метод оценки релевантности организации текстовому запросу с помощью LLM.
-Бейзлайн использует фиксированный шаблон промпта (`build_relevance_prompt`) без дополнительных механизмов поиска или логики.
+Бейзлайн использует фиксированный шаблон промпта (`build_relevance_prompt`, по частям — `build_relevance_parts`) без дополнительных механизмов поиска или логики.
 
 Класс `RelevanceBaseline` предоставляет следующие возможности:
 - `evaluate_batch`: вызывает LLM для небольшого батча данных, генерируя ответы на основе входных полей (название, адрес, рубрика, отзывы).
@@ -19,9 +22,16 @@ RelevanceBaseline
     - 0.0 — "IRRELEVANT"
     - -1.0 — ошибка или неизвестный ответ
 - `run_full_evaluation`: запускает оценку на всем датасете, собирает предсказания, сохраняет ошибки и считает accuracy по валидным примерам.
+  С `checkpoint_path` результаты по мере готовности дописываются в JSONL, и прерванный прогон продолжается с места остановки.
 
 Параметры:
 - `llm_interface`: объект интерфейса LLM (по умолчанию — `GPTInterface`)
+- `pack_size`: сколько строк батча оценивать одним запросом к LLM (1 — по одной, как раньше).
+  При `pack_size > 1` инструкция с примерами отправляется один раз на пакет, а ответы, которые
+  не удалось разобрать, переспрашиваются одиночными запросами (см. `baseline.packed_prompts`).
+- `scoring`: "text" — текстовый ответ модели; "logprob" — один токен ответа и калиброванная вероятность
+  релевантности (см. `baseline.logprob_scoring`), в результат добавляются столбцы `gpt_prob_relevant`
+  и `gpt_relevance_logit`. Режим logprob оценивает строки по одной (`pack_size=1`).
 
 Требования:
 - `GPTInterface` из `baseline.llm_interface`
@@ -29,9 +39,21 @@ RelevanceBaseline
 - `RELEVANCE_COL` из `utils.config`
 """
 
+logger = logging.getLogger(__name__)
+
+
 class RelevanceBaseline:
-    def __init__(self, llm_interface=None):
+    def __init__(self, llm_interface=None, pack_size=1, scoring=LLM_SCORING):
+        if scoring not in SCORING_MODES:
+            raise ValueError(f"Неизвестный режим оценки: {scoring}. Допустимые: {', '.join(SCORING_MODES)}")
+        if scoring == "logprob" and pack_size > 1:
+            raise ValueError("Режим logprob оценивает строки по одной: pack_size должен быть 1")
         self.llm = llm_interface or GPTInterface()
+        self.pack_size = max(1, int(pack_size))
+        self.scoring = scoring
+        self.packed_stats = {"packed_requests": 0, "packed_items": 0, "fallback_items": 0}
+        # key строки -> (вероятность релевантности, логит) в режиме logprob
+        self.scores = {}
 
     def map_response_to_label(self, response):
         if "RELEVANT_PLUS" in response:
@@ -41,48 +63,128 @@ class RelevanceBaseline:
         else:
             return -1.0  # ошибка или непонятный ответ
 
+    @staticmethod
+    def _row_fields(record):
+        return dict(
+            query=record.query,
+            name=record.name,
+            address=record.address,
+            rubric=record.rubric,
+            reviews=record.reviews
+        )
+
+    def _evaluate_packed(self, rows):
+        results = []
+        for start in range(0, len(rows), self.pack_size):
+            pack = rows[start:start + self.pack_size]
+            suffixes = [build_relevance_parts(**self._row_fields(row))[1] for row in pack]
+            item_blocks = [strip_answer_tail(build_relevance_item(**self._row_fields(row))) for row in pack]
+            responses, fallbacks = classify_packed(self.llm, RELEVANCE_INSTRUCTIONS, item_blocks, suffixes)
+            if len(pack) > 1:
+                self.packed_stats["packed_requests"] += 1
+                self.packed_stats["packed_items"] += len(pack)
+                self.packed_stats["fallback_items"] += sum(fallbacks)
+            results.extend(responses)
+        return results
+
+    def _evaluate_logprob(self, rows):
+        results = []
+        for record in rows:
+            prefix, suffix = build_relevance_parts(**self._row_fields(record))
+            try:
+                response, prob, logit, _ = score_prompt(self.llm, suffix, prefix=prefix)
+            except Exception as e:
+                # Ошибка оценки одной строки не прерывает батч: строка пересчитается при возобновлении
+                logger.error(f"Ошибка оценки по logprobs: {e}")
+                response, prob, logit = "ERROR", None, None
+            self.scores[record.key] = (prob, logit)
+            results.append(response)
+        return results
+
     def evaluate_batch(self, batch):
+        """
+        Оценивает батч: DataFrame или список `EvalRecord` (см. `utils.records`).
+        """
+        records = as_records(batch)
+        if self.scoring == "logprob":
+            return self._evaluate_logprob(records)
+        if self.pack_size > 1:
+            return self._evaluate_packed(records)
+
         results = []
-        for _, row in batch.iterrows():
-            prompt = build_relevance_prompt(
-                query=row["text"],
-                name=row.get("name", "—"),
-                address=row.get("address", "—"),
-                rubric=row.get("normalized_main_rubric_name_ru", "—"),
-                reviews=row.get("reviews_summarized", "—")
-            )
-            response = self.llm.call_gpt(prompt)
+        for record in records:
+            prefix, suffix = build_relevance_parts(**self._row_fields(record))
+            response = self.llm.call_gpt(suffix, prefix=prefix)
             results.append(response)
-            time.sleep(0.1)  # задержка для API
         return results
 
-    def run_full_evaluation(self, data_eval, batch_size=5):
-        all_preds = []
+    def _score_fields(self, key) -> dict:
+        if self.scoring != "logprob":
+            return {}
+        prob, logit = self.scores.get(key, (None, None))
+        return {"prob": prob, "logit": logit}
+
+    def run_full_evaluation(self, data_eval, batch_size=5, checkpoint_path=None):
+        """
+        Оценка всего датасета.
+
+        При `checkpoint_path` каждый обработанный батч сразу дописывается в JSONL-файл
+        (см. `utils.checkpoint`), а строки, уже сохранённые там ранее, не пересчитываются.
+        """
         all_errors = []
-        
-        n_batches = (len(data_eval) + batch_size - 1) // batch_size
+        checkpoint = JsonlCheckpoint(checkpoint_path) if checkpoint_path else None
+        done = checkpoint.finished_keys() if checkpoint else set()
+        responses = {}
+
+        # Записи строятся один раз по колонкам; дальше работаем со списком, без iloc на каждый батч
+        records = build_records(data_eval)
+        keys = [record.key for record in records]
+        positions = pending_positions(keys, done)
+        pending = [records[pos] for pos in positions]
+        if checkpoint:
+            print(f"Контрольная точка {checkpoint_path}: готово {len(records) - len(pending)}, осталось {len(pending)}")
 
-        for start in tqdm(range(0, len(data_eval), batch_size), desc="Evaluating batches"):
-            batch = data_eval.iloc[start:start + batch_size]
-            responses = self.evaluate_batch(batch)
-            all_preds.extend(responses)
+        for start in tqdm(range(0, len(pending), batch_size), desc="Evaluating batches"):
+            batch = pending[start:start + batch_size]
+            batch_responses = self.evaluate_batch(batch)
+            responses.update((record.key, r) for record, r in zip(batch, batch_responses))
+            if checkpoint:
+                labels = responses_to_labels(batch_responses)
+                checkpoint.append(
+                    {"key": record.key, "response": r, "label": float(label), **self._score_fields(record.key)}
+                    for record, r, label in zip(batch, batch_responses, labels)
+                )
 
-            for i, r in enumerate(responses):
+            for i, r in enumerate(batch_responses):
                 if isinstance(r, str) and r.startswith("ERROR"):
-                    error_row = batch.iloc[i].copy()
+                    error_row = data_eval.iloc[positions[start + i]].copy()
                     error_row["error_message"] = r
                     all_errors.append(error_row)
 
+        if checkpoint:
+            # Ответы строк, готовых до этого прогона, читаются из контрольной точки только сейчас
+            done = checkpoint.lookup(key for key in keys if key not in responses)
+            responses.update((key, record["response"]) for key, record in done.items())
+            self.scores.update((key, (record.get("prob"), record.get("logit"))) for key, record in done.items() if "prob" in record)
+        all_preds = [responses[key] for key in keys]
+
         # Сохраняем ошибки
         if all_errors:
+            import pandas as pd
+
             pd.DataFrame(all_errors).to_csv("errors.csv", index=False)
             print(f"Сохранено ошибок: {len(all_errors)}")
 
         data_eval["gpt_response"] = all_preds
-        data_eval["gpt_pred_relevance"] = data_eval["gpt_response"].apply(self.map_response_to_label)
+        data_eval["gpt_pred_relevance"] = responses_to_labels(all_preds)
+        if self.scoring == "logprob":
+            scores = [self.scores.get(key, (None, None)) for key in keys]
+            data_eval["gpt_prob_relevant"] = [prob for prob, _ in scores]
+            data_eval["gpt_relevance_logit"] = [logit for _, logit in scores]
 
-        valid = data_eval[data_eval["gpt_pred_relevance"] != -1.0]
-        acc = accuracy_score(valid[RELEVANCE_COL], valid["gpt_pred_relevance"])
-        print(f"Accuracy (по {len(valid)} примерам): {acc:.4f}")
+        acc, n_valid = accuracy(data_eval[RELEVANCE_COL].to_numpy(), data_eval["gpt_pred_relevance"].to_numpy())
+        print(f"Accuracy (по {n_valid} примерам): {acc:.4f}")
+        if self.packed_stats["packed_requests"]:
+            print(f"Пакетная классификация: {self.packed_stats}")
 
         return data_eval, acc
@@ -1,36 +1,277 @@
-## Обёртка над OpenAI, простой вызов GPT 
+## Обёртка над OpenAI, простой вызов GPT
 import os
-from openai import OpenAI
+import json
+import time
+import asyncio
+import threading
+import weakref
+from typing import NamedTuple
+from utils.rate_limiter import get_limiter, estimate_tokens, call_with_retries, acall_with_retries
+from utils.llm_cache import LLMResponseCache, get_llm_cache
+from utils.config import PROMPT_PREFIX_LAYOUT, LLM_BASE_URL
 """
-    Интерфейс для взаимодействия с моделью GPT через API (по умолчанию — https://api.vsegpt.ru/v1).
+    Интерфейс для взаимодействия с моделью GPT через API (по умолчанию — LLM_BASE_URL, https://api.vsegpt.ru/v1).
 
     Атрибуты:
         api_key (str): Ключ API OpenAI. Может быть передан напрямую или считан из переменной окружения OPENAI_API_KEY.
         model_name (str): Название модели, используемой для генерации (по умолчанию "gpt-4o-mini").
         client (OpenAI): Клиент OpenAI для отправки запросов к модели.
+        Асинхронные клиенты AsyncOpenAI создаются по одному на цикл событий (`_loop_client`): соединения пула
+            привязаны к циклу, в котором открыты, а `asyncio.run` каждый раз создаёт новый. Владелец цикла закрывает
+            клиент перед завершением цикла (`await aclose()`); если этого не сделали, клиент закрывается
+            при остановке цикла (`loop.shutdown_asyncgens`, его вызывает `asyncio.run`).
+        limiter (RateLimiter): Общий лимитер "llm" (RPS + TPM); 429 и таймауты повторяются
+            с экспоненциальной задержкой, "ERROR" возвращается только после исчерпания повторов.
+        cache (LLMResponseCache | None): Персистентный кэш ответов (по умолчанию общий из `get_llm_cache()`,
+            False — отключить). Ключ — хэш модели, сообщений и параметров декодирования; ошибки не кэшируются.
+        prefix_layout (bool): Раскладка для кэширования префикса провайдером (по умолчанию PROMPT_PREFIX_LAYOUT):
+            статическая часть промта (`prefix`) уходит в system-сообщение, переменная — в user-сообщение.
+            При False `prefix + prompt` отправляется одним user-сообщением (как раньше, ключи кэша не меняются).
 
     Методы:
-        call_gpt(prompt): Отправляет запрос к модели с заданным промтом и возвращает сгенерированный ответ.
+        call_gpt(prompt, max_tokens=5, prefix=None): Отправляет запрос к модели с заданным промтом и возвращает сгенерированный ответ.
+        acall_gpt(prompt, max_tokens=5, prefix=None): Асинхронная версия call_gpt (для графа агента через ainvoke/abatch).
+        complete / acomplete: То же, но возвращают `LLMResult` с числом токенов (в т.ч. взятых из кэша провайдера),
+            временем вызова и числом повторов. С `top_logprobs=k` запрашивается один токен ответа
+            и k самых вероятных вариантов первого токена (`LLMResult.logprobs`, см. `baseline.logprob_scoring`).
+        usage_stats(): Суммарные токены по всем запросам и доля закэшированных провайдером.
     """
 
+SYSTEM_MESSAGE = "Ты классификатор релевантности."
+
+
+class LLMResult(NamedTuple):
+    """Ответ модели и статистика токенов одного вызова (нули для ответов из локального кэша и ошибок)."""
+    text: str
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    cache_hit: bool = False
+    latency: float = 0.0  # с, включая ожидание лимитера и повторы
+    retries: int = 0
+    logprobs: tuple = ()  # ((токен, logprob), ...) для первого токена ответа при top_logprobs > 0
+
+
+async def _close_on_loop_shutdown(client, forget):
+    """
+    Страж клиента цикла событий: асинхронный генератор, остановленный на `yield`. При остановке цикла
+    `shutdown_asyncgens` закрывает все незавершённые генераторы — и блок finally закрывает клиент,
+    пока цикл ещё работает (иначе соединения пула закрываются сборщиком мусора уже после закрытия цикла).
+    `forget()` убирает клиент из реестра: сам клиент держит ссылки на свой цикл, и слабый ключ не освободился бы.
+    """
+    try:
+        yield
+    finally:
+        forget()
+        await client.close()
+
+
+async def _start_guard(guard):
+    try:
+        await guard.__anext__()
+    except StopAsyncIteration:
+        pass  # клиент уже закрыт через `aclose()`
+
+
 class GPTInterface:
-    def __init__(self, api_key=None, model_name="gpt-4o-mini"):
+    def __init__(self, api_key=None, model_name="gpt-4o-mini", cache=None, prefix_layout=None, base_url=None):
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         self.model_name = model_name
-        self.client = OpenAI(api_key=self.api_key, base_url="https://api.vsegpt.ru/v1")
+        self.base_url = base_url or LLM_BASE_URL
+        # openai импортируется при создании первого клиента: импорт модуля не тянет SDK (~0.5 с)
+        from openai import OpenAI
+
+        # Повторы выполняет общий лимитер, встроенные повторы клиента отключены
+        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        self._async_clients = weakref.WeakKeyDictionary()  # цикл событий -> (AsyncOpenAI, страж закрытия)
+        self._async_lock = threading.Lock()
+        self.limiter = get_limiter("llm")
+        if cache is None:
+            cache = get_llm_cache()
+        self.cache = cache if cache is not False else None
+        self.prefix_layout = PROMPT_PREFIX_LAYOUT if prefix_layout is None else prefix_layout
+        self._usage = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        self._usage_lock = threading.Lock()
+
+    def _messages(self, prompt, prefix=None):
+        if prefix and self.prefix_layout:
+            # Одинаковый для всех строк префикс идёт первым: провайдер переиспользует его KV-кэш
+            return [
+                {"role": "system", "content": f"{SYSTEM_MESSAGE}\n\n{prefix}"},
+                {"role": "user", "content": prompt},
+            ]
+        return [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": f"{prefix}{prompt}" if prefix else prompt},
+        ]
+
+    def _loop_client(self):
+        """AsyncOpenAI текущего цикла событий (создаётся при первом вызове в цикле)."""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            entry = self._async_clients.get(loop)
+            if entry is None:
+                from openai import AsyncOpenAI
+
+                client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+                guard = _close_on_loop_shutdown(client, lambda: self._forget_loop(loop))
+                loop.create_task(_start_guard(guard))
+                entry = self._async_clients[loop] = (client, guard)
+        return entry[0]
+
+    def _forget_loop(self, loop):
+        with self._async_lock:
+            self._async_clients.pop(loop, None)
+
+    async def aclose(self):
+        """Закрывает пул соединений асинхронного клиента текущего цикла событий."""
+        with self._async_lock:
+            entry = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            client, guard = entry
+            await guard.aclose()
+            await client.close()  # страж мог ещё не стартовать; повторное закрытие безопасно
+
+    def _request_params(self, prompt, max_tokens=5, prefix=None, top_logprobs=0):
+        params = dict(
+            model=self.model_name,
+            messages=self._messages(prompt, prefix),
+            temperature=0,
+            max_tokens=max_tokens,
+        )
+        if top_logprobs:
+            # Для оценки по вероятностям нужен только первый токен ответа
+            params.update(max_tokens=1, logprobs=True, top_logprobs=top_logprobs)
+        return params
 
-    def call_gpt(self, prompt):
+    @staticmethod
+    def _params_text(params):
+        return "".join(message["content"] for message in params["messages"])
+
+    @staticmethod
+    def _top_logprobs(choice) -> tuple:
+        content = getattr(getattr(choice, "logprobs", None), "content", None)
+        if not content:
+            return ()
+        return tuple((item.token, item.logprob) for item in content[0].top_logprobs)
+
+    def _result_from_response(self, response, estimated):
+        choice = response.choices[0]
+        text = (choice.message.content or "").strip()
+        logprobs = self._top_logprobs(choice)
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return LLMResult(text, logprobs=logprobs)
+
+        self.limiter.reconcile_tokens(estimated, getattr(usage, "total_tokens", 0))
+        details = getattr(usage, "prompt_tokens_details", None)
+        result = LLMResult(
+            text,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            cached_tokens=(getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            logprobs=logprobs,
+        )
+        with self._usage_lock:
+            self._usage["requests"] += 1
+            self._usage["prompt_tokens"] += result.prompt_tokens
+            self._usage["cached_tokens"] += result.cached_tokens
+            self._usage["completion_tokens"] += result.completion_tokens
+        return result
+
+    def _cache_get(self, params):
+        if self.cache is None:
+            return None, None
+        key = LLMResponseCache.make_key(params)
+        return key, self.cache.get(key)
+
+    def _cache_set(self, key, params, result):
+        if key is None or not result.text:
+            return
+        if params.get("logprobs"):
+            # В режиме logprobs в кэш всегда пишется JSON с текстом и вариантами первого токена;
+            # ответ без вариантов оценить нельзя (см. `score_result`), поэтому он, как и ошибки, не кэшируется
+            if not result.logprobs:
+                return
+            self.cache.set(key, json.dumps({"text": result.text, "logprobs": result.logprobs}))
+            return
+        self.cache.set(key, result.text)
+
+    @staticmethod
+    def _cached_result(params, cached, started):
+        """
+        LLMResult из записи кэша или None (промах). В режиме logprobs запись без вариантов первого токена
+        (старый формат — только текст) считается промахом: запрос повторяется и запись перезаписывается.
+        """
+        if cached is None:
+            return None
+        latency = time.perf_counter() - started
+        if params.get("logprobs"):
+            try:
+                payload = json.loads(cached)
+            except json.JSONDecodeError:
+                return None
+            if not isinstance(payload, dict) or not payload.get("logprobs"):
+                return None
+            logprobs = tuple((token, logprob) for token, logprob in payload["logprobs"])
+            return LLMResult(payload["text"], cache_hit=True, latency=latency, logprobs=logprobs)
+        return LLMResult(cached, cache_hit=True, latency=latency)
+
+    def cache_stats(self):
+        """Статистика кэша ответов (hits, misses, hit_rate, size) или None, если кэш отключён."""
+        return self.cache.stats() if self.cache is not None else None
+
+    def usage_stats(self):
+        """Суммарные токены запросов к API и доля входных токенов, взятых из кэша префикса провайдера."""
+        with self._usage_lock:
+            stats = dict(self._usage)
+        stats["cached_share"] = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        return stats
+
+    def complete(self, prompt, max_tokens=5, prefix=None, top_logprobs=0) -> LLMResult:
+        started = time.perf_counter()
+        params = self._request_params(prompt, max_tokens, prefix, top_logprobs)
+        stats = {}
+        try:
+            key, cached = self._cache_get(params)
+            cached_result = self._cached_result(params, cached, started)
+            if cached_result is not None:
+                return cached_result
+            estimated = estimate_tokens(self._params_text(params), params["max_tokens"])
+            response = call_with_retries(
+                lambda: self.client.chat.completions.create(**params),
+                self.limiter, tokens=estimated, stats=stats,
+            )
+            result = self._result_from_response(response, estimated)
+            self._cache_set(key, params, result)
+            return result._replace(latency=time.perf_counter() - started, retries=stats.get("retries", 0))
+        except Exception as e:
+            print("Ошибка запроса:", e)
+            return LLMResult("ERROR", latency=time.perf_counter() - started, retries=stats.get("retries", 0))
+
+    async def acomplete(self, prompt, max_tokens=5, prefix=None, top_logprobs=0) -> LLMResult:
+        started = time.perf_counter()
+        params = self._request_params(prompt, max_tokens, prefix, top_logprobs)
+        stats = {}
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": "Ты классификатор релевантности."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                max_tokens=5,
+            key, cached = self._cache_get(params)
+            cached_result = self._cached_result(params, cached, started)
+            if cached_result is not None:
+                return cached_result
+            estimated = estimate_tokens(self._params_text(params), params["max_tokens"])
+            response = await acall_with_retries(
+                lambda: self._loop_client().chat.completions.create(**params),
+                self.limiter, tokens=estimated, stats=stats,
             )
-            return response.choices[0].message.content.strip()
+            result = self._result_from_response(response, estimated)
+            self._cache_set(key, params, result)
+            return result._replace(latency=time.perf_counter() - started, retries=stats.get("retries", 0))
         except Exception as e:
             print("Ошибка запроса:", e)
-            return "ERROR"
+            return LLMResult("ERROR", latency=time.perf_counter() - started, retries=stats.get("retries", 0))
+
+    def call_gpt(self, prompt, max_tokens=5, prefix=None):
+        return self.complete(prompt, max_tokens, prefix).text
+
+    async def acall_gpt(self, prompt, max_tokens=5, prefix=None):
+        return (await self.acomplete(prompt, max_tokens, prefix)).text
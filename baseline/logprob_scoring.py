@@ -0,0 +1,206 @@
+# Оценка релевантности по logprobs первого токена ответа
+"""
+logprob_scoring.py
+
+Режим оценки "logprob": вместо текстового ответа (до 5 токенов, разбор подстрок RELEVANT_PLUS / IRRELEVANT)
+модель генерирует один токен, а API возвращает LOGPROB_TOP_K самых вероятных вариантов этого токена.
+
+- Варианты сопоставляются меткам по префиксу: "REL", "RELEVANT" -> RELEVANT_PLUS; "IR", "IRRE" -> IRRELEVANT
+  (`label_masses`). Логит релевантности — log P(RELEVANT_PLUS) - log P(IRRELEVANT); метка, которой нет среди
+  вариантов, получает вероятность не выше самого маловероятного из них (`relevance_logit`).
+- Логит переводится в вероятность калибровкой Платта (`LogprobCalibrator`: логистическая регрессия по логиту,
+  обучается на размеченном прогоне); без обученной калибровки используется sigmoid(логит).
+- Ответ — RELEVANT_PLUS при вероятности >= 0.5, иначе IRRELEVANT, поэтому нераспознанных ответов нет.
+  "ERROR" — для ошибок API и ответов без logprobs (провайдер их не вернул): такой ответ нельзя оценить,
+  и нейтральная вероятность 0.5 молча превратилась бы в RELEVANT_PLUS.
+
+Калибровка по предсказаниям размеченного прогона (столбец `*_relevance_logit`), сохраняется в LOGPROB_CALIBRATION_PATH:
+    python -m baseline.logprob_scoring --calibrate experiments/baseline_val_predictions.csv
+"""
+
+import os
+import math
+import logging
+import argparse
+import threading
+import numpy as np
+from utils.config import LOGPROB_TOP_K, LOGPROB_CALIBRATION_PATH, RELEVANCE_COL, setup_logging
+from utils.text_features import LogisticModel
+
+logger = logging.getLogger(__name__)
+
+SCORING_MODES = ("text", "logprob")
+
+RELEVANT, IRRELEVANT = "RELEVANT_PLUS", "IRRELEVANT"
+
+# Логит при отсутствии обеих меток среди вариантов (вероятность 0.5)
+_NEUTRAL_LOGIT = 0.0
+_MAX_LOGIT = 30.0
+
+
+def _token_label(token: str):
+    """Метка, началом которой является токен (без пробелов, кавычек и регистра), или None."""
+    text = token.strip().strip("\"'`«»*").upper()
+    if not text:
+        return None
+    if RELEVANT.startswith(text):
+        return RELEVANT
+    if IRRELEVANT.startswith(text):
+        return IRRELEVANT
+    return None
+
+
+def label_masses(top_logprobs):
+    """
+    Суммарные вероятности меток среди вариантов первого токена.
+
+    Returns:
+        tuple[float, float]: (P(RELEVANT_PLUS), P(IRRELEVANT)).
+    """
+    masses = {RELEVANT: 0.0, IRRELEVANT: 0.0}
+    for token, logprob in top_logprobs:
+        label = _token_label(token)
+        if label is not None:
+            masses[label] += math.exp(logprob)
+    return masses[RELEVANT], masses[IRRELEVANT]
+
+
+def relevance_logit(top_logprobs):
+    """log P(RELEVANT_PLUS) - log P(IRRELEVANT) по вариантам первого токена; None, если вариантов нет."""
+    if not top_logprobs:
+        return None
+    relevant, irrelevant = label_masses(top_logprobs)
+    if not relevant and not irrelevant:
+        return _NEUTRAL_LOGIT
+    # Метка вне top-k вероятна не больше, чем последний из возвращённых вариантов
+    floor = min(math.exp(logprob) for _, logprob in top_logprobs)
+    logit = math.log(max(relevant, floor)) - math.log(max(irrelevant, floor))
+    return max(-_MAX_LOGIT, min(_MAX_LOGIT, logit))
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-np.asarray(x, dtype=float)))
+
+
+class LogprobCalibrator:
+    """
+    Калибровка Платта: P(релевантно) = sigmoid(a * логит + b).
+
+    Параметры:
+        model (LogisticModel | None): Обученная модель по признаку "logit"; None — без калибровки (sigmoid(логит)).
+    """
+
+    def __init__(self, model=None):
+        self.model = model
+
+    @property
+    def fitted(self) -> bool:
+        return self.model is not None and self.model.fitted
+
+    def fit(self, logits, labels):
+        self.model = LogisticModel(("logit",)).fit(np.asarray(logits, dtype=float).reshape(-1, 1), labels)
+        return self
+
+    def predict(self, logits) -> np.ndarray:
+        logits = np.asarray(logits, dtype=float)
+        if not self.fitted:
+            return _sigmoid(logits)
+        return self.model.predict_proba(logits.reshape(-1, 1))
+
+    def save(self, path: str, **meta):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.model.save(path, **meta)
+
+    @classmethod
+    def load(cls, path: str) -> "LogprobCalibrator":
+        model, _ = LogisticModel.load(path)
+        return cls(model)
+
+
+_calibrator = None
+_calibrator_lock = threading.Lock()
+
+
+def get_calibrator() -> LogprobCalibrator:
+    """Общая калибровка из LOGPROB_CALIBRATION_PATH (без файла — некалиброванная вероятность)."""
+    global _calibrator
+    with _calibrator_lock:
+        if _calibrator is None:
+            if os.path.exists(LOGPROB_CALIBRATION_PATH):
+                _calibrator = LogprobCalibrator.load(LOGPROB_CALIBRATION_PATH)
+            else:
+                logger.warning(f"Калибровка logprobs не найдена ({LOGPROB_CALIBRATION_PATH}), вероятности не калиброваны")
+                _calibrator = LogprobCalibrator()
+        return _calibrator
+
+
+def response_from_prob(prob: float) -> str:
+    return RELEVANT if prob >= 0.5 else IRRELEVANT
+
+
+def score_result(result, calibrator=None):
+    """
+    Ответ, вероятность релевантности и логит по `LLMResult` с logprobs.
+
+    Returns:
+        tuple[str, float | None, float | None]: ("ERROR", None, None) для ошибки API или ответа без logprobs.
+    """
+    if result.text == "ERROR":
+        return "ERROR", None, None
+    logit = relevance_logit(result.logprobs)
+    if logit is None:
+        logger.error("Ответ LLM без logprobs: оценка вероятности невозможна")
+        return "ERROR", None, None
+    prob = float((calibrator or get_calibrator()).predict([logit])[0])
+    return response_from_prob(prob), prob, logit
+
+
+def score_prompt(llm, prompt, prefix=None):
+    """
+    Синхронная оценка одного промта. Returns: (ответ, вероятность, логит, LLMResult).
+    """
+    result = llm.complete(prompt, prefix=prefix, top_logprobs=LOGPROB_TOP_K)
+    return (*score_result(result), result)
+
+
+async def ascore_prompt(llm, prompt, prefix=None):
+    """Асинхронная версия `score_prompt`."""
+    result = await llm.acomplete(prompt, prefix=prefix, top_logprobs=LOGPROB_TOP_K)
+    return (*score_result(result), result)
+
+
+def calibration_report(probs, labels) -> dict:
+    """Brier score и log loss вероятностей."""
+    probs = np.clip(np.asarray(probs, dtype=float), 1e-6, 1 - 1e-6)
+    labels = np.asarray(labels, dtype=float)
+    return {
+        "brier": float(np.mean((probs - labels) ** 2)),
+        "log_loss": float(-np.mean(labels * np.log(probs) + (1 - labels) * np.log(1 - probs))),
+    }
+
+
+def main(args):
+    import pandas as pd
+
+    setup_logging()
+    data = pd.read_csv(args.calibrate)
+    column = args.column or next((c for c in data.columns if c.endswith("_relevance_logit")), None)
+    if column is None:
+        raise ValueError(f"В {args.calibrate} нет столбца *_relevance_logit: запустите прогон с --scoring logprob")
+    data = data[data[column].notna() & data[RELEVANCE_COL].isin([0.0, 1.0])]
+    logits, labels = data[column].to_numpy(), data[RELEVANCE_COL].to_numpy()
+
+    calibrator = LogprobCalibrator().fit(logits, labels)
+    calibrator.save(args.output, rows=len(data), source=os.path.basename(args.calibrate))
+    print(f"Калибровка обучена на {len(data)} строках и сохранена в {args.output}")
+    for title, probs in (("без калибровки", _sigmoid(logits)), ("с калибровкой", calibrator.predict(logits))):
+        report = calibration_report(probs, labels)
+        print(f"  {title}: Brier {report['brier']:.4f}, log loss {report['log_loss']:.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Калибровка вероятностей режима logprob по размеченному прогону.")
+    parser.add_argument("--calibrate", type=str, required=True, help="CSV предсказаний со столбцом *_relevance_logit")
+    parser.add_argument("--column", type=str, default=None, help="Столбец логита (по умолчанию — найти автоматически)")
+    parser.add_argument("--output", type=str, default=LOGPROB_CALIBRATION_PATH, help="Куда сохранить калибровку")
+    main(parser.parse_args())
@@ -0,0 +1,140 @@
+# Пакетная классификация: несколько пар (запрос, организация) в одном запросе к LLM
+"""
+packed_prompts.py
+
+Упаковка N примеров в один промт с нумерацией и разбор списка меток из ответа.
+
+Инструкция с few-shot примерами (одинаковая для всех строк) отправляется один раз на пакет,
+поэтому число входных токенов и запросов падает примерно в N раз.
+Если ответ по какому-то примеру не распознан (нет строки с его номером, неизвестная метка,
+противоречивые строки), этот пример переклассифицируется отдельным обычным запросом.
+
+Функции:
+- `strip_answer_tail(item_block)`: убирает завершающее "Ответ:" из блока примера.
+- `build_packed_parts` / `build_packed_prompt`: собирают пакетный промт (префикс + переменная часть / целиком).
+- `parse_packed_response(response, n_items)`: разбирает ответ "1: RELEVANT_PLUS\\n2: IRRELEVANT...".
+- `classify_packed` / `aclassify_packed`: пакетный вызов LLM с откатом к одиночным запросам.
+"""
+
+import re
+import asyncio
+
+LABELS = ("RELEVANT_PLUS", "IRRELEVANT")
+
+# Токенов ответа на один пример пакета ("12: RELEVANT_PLUS\n" ≈ 6–7 токенов)
+TOKENS_PER_ITEM = 8
+
+_ANSWER_LINE = re.compile(r"^[^\w\n]*(\d+)[^\w\n]*(RELEVANT_PLUS|IRRELEVANT)\b", re.MULTILINE)
+
+
+def strip_answer_tail(item_block: str) -> str:
+    """Удаляет последнюю строку «Ответ:» (и всё после неё) из блока одного примера."""
+    idx = item_block.rfind("Ответ:")
+    return (item_block[:idx] if idx != -1 else item_block).strip()
+
+
+def build_packed_parts(instructions: str, item_blocks):
+    """
+    Собирает пакетный промт: инструкция + пронумерованные примеры + требование к формату ответа.
+
+    Args:
+        instructions (str): Статическая часть промта (правила и few-shot примеры).
+        item_blocks (list[str]): Блоки примеров (без «Ответ:»).
+
+    Returns:
+        tuple[str, str]: (prefix, suffix) — неизменная инструкция (общий префикс с одиночными промтами,
+            см. `GPTInterface.prefix_layout`) и переменная часть с примерами.
+    """
+    parts = [f"### Теперь оцени следующие примеры ({len(item_blocks)} шт.):", ""]
+    for i, block in enumerate(item_blocks, start=1):
+        parts.append(f"Пример {i}:")
+        parts.append(block)
+        parts.append("")
+    parts.append(
+        "Ответь строго по одной строке на каждый пример, в порядке номеров, в формате "
+        "\"<номер>: RELEVANT_PLUS\" или \"<номер>: IRRELEVANT\". Без пояснений."
+    )
+    parts.append("Ответ:")
+    return instructions, "\n".join(parts)
+
+
+def build_packed_prompt(instructions: str, item_blocks) -> str:
+    """Пакетный промт одной строкой (`prefix + suffix` из `build_packed_parts`)."""
+    prefix, suffix = build_packed_parts(instructions, item_blocks)
+    return prefix + suffix
+
+
+def parse_packed_response(response: str, n_items: int):
+    """
+    Разбирает ответ на пакетный промт.
+
+    Returns:
+        list[str | None]: Метка для каждого примера; None — ответ не найден или противоречив.
+    """
+    labels = [None] * n_items
+    conflicts = set()
+    for match in _ANSWER_LINE.finditer(response or ""):
+        idx = int(match.group(1)) - 1
+        if not 0 <= idx < n_items:
+            continue
+        label = match.group(2)
+        if labels[idx] is not None and labels[idx] != label:
+            conflicts.add(idx)
+        labels[idx] = label
+    for idx in conflicts:
+        labels[idx] = None
+    return labels
+
+
+def packed_max_tokens(n_items: int) -> int:
+    return n_items * TOKENS_PER_ITEM + 8
+
+
+def classify_packed(llm, instructions: str, item_blocks, single_suffixes):
+    """
+    Классифицирует пакет примеров одним запросом, нераспознанные — отдельными запросами.
+
+    Args:
+        llm (GPTInterface): Интерфейс LLM.
+        instructions (str): Статическая часть промта.
+        item_blocks (list[str]): Блоки примеров.
+        single_suffixes (list[str]): Переменные части одиночных промтов тех же примеров (для отката);
+            одиночный промт = `instructions + suffix`.
+
+    Returns:
+        tuple[list[str], list[bool]]: Ответы по примерам и флаги «получен одиночным запросом».
+    """
+    if len(item_blocks) == 1:
+        return [llm.call_gpt(single_suffixes[0], prefix=instructions)], [True]
+
+    prefix, suffix = build_packed_parts(instructions, item_blocks)
+    response = llm.call_gpt(suffix, max_tokens=packed_max_tokens(len(item_blocks)), prefix=prefix)
+    labels = parse_packed_response(response, len(item_blocks))
+
+    results, fallbacks = [], []
+    for label, single_suffix in zip(labels, single_suffixes):
+        if label is None:
+            results.append(llm.call_gpt(single_suffix, prefix=instructions))
+            fallbacks.append(True)
+        else:
+            results.append(label)
+            fallbacks.append(False)
+    return results, fallbacks
+
+
+async def aclassify_packed(llm, instructions: str, item_blocks, single_suffixes):
+    """Асинхронная версия `classify_packed` (откатные одиночные запросы выполняются параллельно)."""
+    if len(item_blocks) == 1:
+        return [await llm.acall_gpt(single_suffixes[0], prefix=instructions)], [True]
+
+    prefix, suffix = build_packed_parts(instructions, item_blocks)
+    response = await llm.acall_gpt(suffix, max_tokens=packed_max_tokens(len(item_blocks)), prefix=prefix)
+    labels = parse_packed_response(response, len(item_blocks))
+
+    missing = [i for i, label in enumerate(labels) if label is None]
+    singles = await asyncio.gather(*(llm.acall_gpt(single_suffixes[i], prefix=instructions) for i in missing))
+    results = list(labels)
+    for i, single in zip(missing, singles):
+        results[i] = single
+    fallbacks = [label is None for label in labels]
+    return results, fallbacks
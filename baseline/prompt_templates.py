@@ -1,11 +1,8 @@
 # Промт для бейзлайна
-def build_relevance_prompt(query, name, address, rubric, reviews):
-    name = name or "—"
-    address = address or "—"
-    rubric = rubric or "—"
-    reviews = reviews or "—"
+# Разделён на статическую инструкцию с примерами (общая для всех строк) и блок конкретного примера,
+# чтобы инструкцию можно было переиспользовать (пакетная классификация, кэширование префикса).
 
-    return f"""\
+RELEVANCE_INSTRUCTIONS = """\
 Ты — интеллектуальная система, которая определяет, насколько организация соответствует пользовательскому запросу.
 Ответь строго одним из двух вариантов: "RELEVANT_PLUS" или "IRRELEVANT".
 
@@ -33,7 +30,11 @@ def build_relevance_prompt(query, name, address, rubric, reviews):
 Отзывы: Организация занимается доставкой продуктов и еды, работает в формате даркстора.
 Ответ: IRRELEVANT
 
-### Теперь оцени следующий пример:
+"""
+
+PROMPT_SPLIT_MARKER = "### Теперь оцени следующий пример:"
+
+RELEVANCE_ITEM_TEMPLATE = """\
 
 Пользовательский запрос: "{query}"
 Организация:
@@ -42,3 +43,31 @@ def build_relevance_prompt(query, name, address, rubric, reviews):
 Рубрика: {rubric}
 Отзывы: {reviews}
 Ответ:"""
+
+
+def _fill_fields(query, name, address, rubric, reviews):
+    return dict(
+        query=query,
+        name=name or "—",
+        address=address or "—",
+        rubric=rubric or "—",
+        reviews=reviews or "—",
+    )
+
+
+def build_relevance_item(query, name, address, rubric, reviews):
+    """Блок одного примера (запрос + организация), без инструкции."""
+    return RELEVANCE_ITEM_TEMPLATE.format(**_fill_fields(query, name, address, rubric, reviews))
+
+
+def build_relevance_parts(query, name, address, rubric, reviews):
+    """
+    Промт по частям: (статическая инструкция, переменная часть с примером).
+    Инструкция одинакова для всех строк и может кэшироваться провайдером как префикс.
+    """
+    return RELEVANCE_INSTRUCTIONS, f"{PROMPT_SPLIT_MARKER}\n{build_relevance_item(query, name, address, rubric, reviews)}"
+
+
+def build_relevance_prompt(query, name, address, rubric, reviews):
+    prefix, suffix = build_relevance_parts(query, name, address, rubric, reviews)
+    return prefix + suffix
@@ -3,7 +3,6 @@
 import os
 import sys
 import argparse
-import pandas as pd
 from dotenv import load_dotenv
 
 """
@@ -22,9 +21,15 @@ run_baseline.py
 --batch_size:     размер батча для LLM-инференса (по умолчанию 5)
 --data_path:      путь к входному CSV-файлу (если не указан, используется дефолтный из `config.py`)
 --output_prefix:  префикс для файлов с результатами (по умолчанию: "baseline")
+--pack_size:      сколько строк оценивать одним запросом к LLM (по умолчанию 1 — по одной)
+--compare_with:   префикс сохранённого прогона для сравнения предсказаний (например, "baseline")
+--checkpoint_dir: директория контрольных точек (JSONL); прерванный прогон продолжается с места остановки
+--scoring:        "text" — текстовый ответ, "logprob" — один токен и калиброванная вероятность (по умолчанию LLM_SCORING)
 
 Пример запуска:
 python run_baseline.py --batch_size 10 --data_path data/dataset.csv --output_prefix gpt4_baseline
+python run_baseline.py --batch_size 10 --pack_size 10 --output_prefix packed10 --compare_with baseline
+python run_baseline.py --scoring logprob --output_prefix logprob --compare_with baseline
 """
 
 def main(args):
@@ -39,10 +44,13 @@ def main(args):
         sys.path.insert(0, BASE_DIR)
 
     from utils.data_loader import load_dataset
-    from utils.config import DATA_PATH, EXPERIMENTS_DIR, ENV_PATH
+    from utils.config import DATA_PATH, EXPERIMENTS_DIR, ENV_PATH, CHECKPOINT_DIR, LLM_SCORING, setup_logging
     from baseline.core import RelevanceBaseline
+    from utils.compare import compare_predictions
+    from utils.telemetry import estimate_cost
 
     # --- 2. Загрузка API ключа ---
+    setup_logging()
     load_dotenv(ENV_PATH)
     openai_key = os.getenv("OPENAI_API_KEY")
     if openai_key is None:
@@ -59,18 +67,35 @@ def main(args):
     print(f"Данные загружены. Train: {len(train_data)}, Val: {len(val_data)}, Test: {len(test_data)}")
 
     # --- 4. Инициализация бейзлайна ---
-    baseline = RelevanceBaseline()
+    baseline = RelevanceBaseline(pack_size=args.pack_size, scoring=args.scoring or LLM_SCORING)
 
     # --- 5. Валидация ---
     print("Запуск на валидации...")
-    val_preds, val_acc = baseline.run_full_evaluation(val_data, batch_size=args.batch_size)
+    checkpoint_dir = CHECKPOINT_DIR if args.checkpoint_dir == "" else args.checkpoint_dir
+
+    def checkpoint_path(split):
+        return os.path.join(checkpoint_dir, f"{args.output_prefix}_{split}.jsonl") if checkpoint_dir else None
+
+    val_preds, val_acc = baseline.run_full_evaluation(
+        val_data, batch_size=args.batch_size, checkpoint_path=checkpoint_path("val"),
+    )
     print(f"Validation accuracy: {val_acc:.4f}")
 
     # --- 6. Тест ---
     print("Запуск на тесте...")
-    test_preds, test_acc = baseline.run_full_evaluation(test_data, batch_size=args.batch_size)
+    test_preds, test_acc = baseline.run_full_evaluation(
+        test_data, batch_size=args.batch_size, checkpoint_path=checkpoint_path("test"),
+    )
     print(f"Test accuracy: {test_acc:.4f}")
 
+    cache_stats = baseline.llm.cache_stats()
+    if cache_stats is not None:
+        print(f"Кэш LLM: {cache_stats}")
+    usage = baseline.llm.usage_stats()
+    print(f"Токены LLM: {usage}")
+    cost = estimate_cost(usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"])
+    print(f"Стоимость LLM: ${cost:.4f}")
+
     # --- 7. Сохранение ---
     os.makedirs(EXPERIMENTS_DIR, exist_ok=True)
     val_file = os.path.join(EXPERIMENTS_DIR, f"{args.output_prefix}_val_predictions.csv")
@@ -79,10 +104,25 @@ def main(args):
     test_preds.to_csv(test_file, index=False)
     print(f"Результаты сохранены: {val_file}, {test_file}")
 
+    # --- 8. Сравнение с сохранённым прогоном ---
+    if args.compare_with:
+        for split, preds in (("val", val_preds), ("test", test_preds)):
+            reference_file = os.path.join(EXPERIMENTS_DIR, f"{args.compare_with}_{split}_predictions.csv")
+            if os.path.exists(reference_file):
+                compare_predictions(preds, reference_file)
+            else:
+                print(f"Файл для сравнения не найден: {reference_file}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Запуск бейзлайна для оценки релевантности.")
     parser.add_argument("--batch_size", type=int, default=5, help="Размер батча для инференса")
     parser.add_argument("--data_path", type=str, default=None, help="Путь к CSV с датасетом")
     parser.add_argument("--output_prefix", type=str, default="baseline", help="Префикс для сохранённых файлов")
+    parser.add_argument("--pack_size", type=int, default=1, help="Число строк в одном запросе к LLM (пакетная классификация)")
+    parser.add_argument("--compare_with", type=str, default=None, help="Префикс сохранённого прогона для сравнения")
+    parser.add_argument("--checkpoint_dir", type=str, nargs="?", const="", default=None,
+                        help="Директория контрольных точек (JSONL, без значения — experiments/checkpoints)")
+    parser.add_argument("--scoring", type=str, choices=["text", "logprob"], default=None,
+                        help="Режим оценки: текстовый ответ или вероятность по logprobs (по умолчанию LLM_SCORING)")
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,156 @@
+# benchmarks/import_time.py
+"""
+import_time.py
+
+Бенчмарк холодного старта: время импорта модулей проекта и запуска точек входа (`--help`).
+
+Каждый модуль импортируется в отдельном процессе с `python -X importtime` (холодный интерпретатор,
+байткод уже скомпилирован), из нескольких повторов берётся минимум. Для модуля сообщается:
+- время импорта (кумулятивное, по `-X importtime`) и полное время процесса;
+- самые тяжёлые пакеты верхнего уровня среди его импортов;
+- тяжёлые зависимости (openai, langgraph, pandas, IPython, ...), которые не должны загружаться при импорте:
+  они нужны только при первом вызове LLM, сборке графа или работе с датасетом.
+
+Проверка для CI: код выхода 1, если импорт модуля дольше `--max_seconds` или загружена тяжёлая зависимость.
+
+Примеры:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --modules agent.eval_agent service.app --max_seconds 0.5 --repeat 5
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    "agent.eval_agent", "agent.ranking", "agent.ab_runner", "baseline.core", "service.app",
+    "main_runner", "baseline.run_baseline", "shard_runner",
+]
+# Точки входа: время `--help` (разбор аргументов без запуска прогона)
+DEFAULT_ENTRY_POINTS = [
+    ["main_runner.py"], ["-m", "baseline.run_baseline"], ["-m", "agent.ab_runner"], ["-m", "service.app"],
+]
+# Загружаются лениво, при первом использовании
+HEAVY_MODULES = ("openai", "langgraph", "langchain_core", "langsmith", "pandas", "IPython", "ipywidgets", "requests")
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Кумулятивное время импорта (с) по модулям из вывода `-X importtime`."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        try:
+            times[name.strip()] = int(cumulative) / 1e6
+        except ValueError:
+            continue  # заголовок "self [us] | cumulative | imported package"
+    return times
+
+
+def startup_modules() -> set:
+    """Модули, которые интерпретатор загружает до пользовательского кода (site, .pth-файлы)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], cwd=BASE_DIR, capture_output=True, text=True)
+    return set(parse_importtime(proc.stderr))
+
+
+def measure_import(module: str, repeat: int = 3, exclude=()) -> dict:
+    """Лучший из `repeat` холодных импортов модуля в отдельном процессе."""
+    best = None
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=BASE_DIR, capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - started
+        if proc.returncode != 0:
+            errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+            return {"module": module, "error": "\n".join(errors[-3:])}
+        times = parse_importtime(proc.stderr)
+        if best is None or times.get(module, wall) < best["import_s"]:
+            best = {"module": module, "import_s": times.get(module, wall), "process_s": wall, "times": times}
+
+    times = best.pop("times")
+    packages = {
+        name: seconds for name, seconds in times.items() if "." not in name and name != module and name not in exclude
+    }
+    best["top"] = sorted(packages.items(), key=lambda item: -item[1])[:5]
+    best["heavy"] = sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES and "." not in name)
+    return best
+
+
+def measure_entry_point(args, repeat: int = 3) -> dict:
+    """Лучшее время `python <args> --help`."""
+    best = None
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, *args, "--help"], cwd=BASE_DIR, capture_output=True, text=True)
+        wall = time.perf_counter() - started
+        if proc.returncode != 0:
+            return {"entry_point": " ".join(args), "error": proc.stderr.strip().splitlines()[-1:]}
+        best = wall if best is None else min(best, wall)
+    return {"entry_point": " ".join(args), "process_s": best}
+
+
+def main(args):
+    failures = []
+    report = {"modules": [], "entry_points": []}
+
+    startup = startup_modules()
+    print(f"{'модуль':<24} {'импорт, с':>10} {'процесс, с':>11}  самые тяжёлые пакеты")
+    for module in args.modules:
+        result = measure_import(module, args.repeat, exclude=startup)
+        report["modules"].append(result)
+        if "error" in result:
+            print(f"{module:<24} ошибка импорта: {result['error']}")
+            failures.append(f"{module}: ошибка импорта")
+            continue
+        top = ", ".join(f"{name} {seconds:.3f}" for name, seconds in result["top"])
+        print(f"{module:<24} {result['import_s']:>10.3f} {result['process_s']:>11.3f}  {top}")
+        if result["heavy"]:
+            print(f"{'':<24} загружены при импорте: {', '.join(result['heavy'])}")
+            failures.append(f"{module}: загружены {', '.join(result['heavy'])}")
+        if args.max_seconds and result["import_s"] > args.max_seconds:
+            failures.append(f"{module}: импорт {result['import_s']:.3f} с > {args.max_seconds} с")
+
+    if not args.skip_entry_points:
+        print(f"\n{'точка входа (--help)':<36} {'процесс, с':>11}")
+        for entry_point in DEFAULT_ENTRY_POINTS:
+            result = measure_entry_point(entry_point, args.repeat)
+            report["entry_points"].append(result)
+            if "error" in result:
+                print(f"{result['entry_point']:<36} ошибка: {result['error']}")
+                failures.append(f"{result['entry_point']} --help: ошибка")
+                continue
+            print(f"{result['entry_point']:<36} {result['process_s']:>11.3f}")
+            if args.max_seconds and result["process_s"] > args.max_seconds:
+                failures.append(f"{result['entry_point']} --help: {result['process_s']:.3f} с > {args.max_seconds} с")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nОтчёт сохранён в {args.output}")
+
+    if failures:
+        print("\nПроблемы холодного старта:")
+        for line in failures:
+            print(f"  {line}")
+        return 1
+    print(f"\nХолодный старт в норме (порог {args.max_seconds} с)")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Время импорта модулей и холодного старта точек входа.")
+    parser.add_argument("--modules", nargs="*", default=DEFAULT_MODULES, help="Модули для импорта")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов на модуль (берётся минимум)")
+    parser.add_argument("--max_seconds", type=float, default=1.0, help="Порог времени импорта (0 — без проверки)")
+    parser.add_argument("--skip_entry_points", action="store_true", help="Не измерять `--help` точек входа")
+    parser.add_argument("--output", type=str, default=None, help="JSON-отчёт")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,290 @@
+# benchmarks/mock_servers.py
+"""
+mock_servers.py
+
+Локальные заглушки внешних API для бенчмарков (без сети и без расходов):
+
+- `MockLLMServer`: OpenAI-совместимый `POST {url}/chat/completions` — подставляется в `GPTInterface`
+  через LLM_BASE_URL. Отвечает по типу промта: YES/NO на need_search, RELEVANT_PLUS/IRRELEVANT на
+  классификацию, нумерованный список на пакетный промт. Ответ детерминирован хэшем промта,
+  `usage` содержит оценку токенов и `prompt_tokens_details.cached_tokens` для уже виденного system-сообщения
+  (как кэш префикса у провайдера). С `logprobs=true` отвечает одним токеном ("REL" / "IR")
+  и `top_logprobs` первого токена.
+- `MockTavilyServer`: `POST {url}/search` в формате Tavily — подставляется через TAVILY_BASE_URL.
+
+Поведение задаётся `ServerProfile`: распределение задержки (логнормальное с медианой и sigma),
+доля ответов 500 и доля 429 с заголовком Retry-After. Серверы считают запросы и ошибки (`stats()`).
+
+Запуск отдельно (например, для ручной проверки приложения):
+    python -m benchmarks.mock_servers --llm_port 8001 --tavily_port 8002 --latency_ms 300
+"""
+
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+_PACKED_ITEM = re.compile(r"^Пример (\d+):", re.MULTILINE)
+
+
+@dataclass
+class ServerProfile:
+    """
+    Профиль заглушки.
+
+    Параметры:
+        latency_ms (float): Медиана задержки ответа.
+        latency_sigma (float): sigma логнормального распределения (0 — постоянная задержка).
+        error_rate (float): Доля ответов 500.
+        rate_limit_rate (float): Доля ответов 429.
+        retry_after (float): Значение заголовка Retry-After для 429 (секунды).
+        seed (int): Зерно генератора (задержки и ошибки воспроизводимы).
+    """
+    latency_ms: float = 0.0
+    latency_sigma: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 0.1
+    seed: int = 0
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _stable_fraction(text: str) -> float:
+    """Детерминированное число в [0, 1) по тексту (одинаковый промт — одинаковый ответ)."""
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16) / 0x100000000
+
+
+class _MockServer:
+    """Базовый сервер: профиль, счётчики и запуск в фоновом потоке."""
+
+    def __init__(self, profile: ServerProfile = None, host: str = "127.0.0.1", port: int = 0):
+        self.profile = profile or ServerProfile()
+        self._random = random.Random(self.profile.seed)
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+    def _draw(self):
+        """Задержка и исход запроса: "ok", "error" или "rate_limited"."""
+        profile = self.profile
+        with self._lock:
+            self._counts["requests"] += 1
+            delay = profile.latency_ms / 1000.0
+            if profile.latency_sigma > 0 and delay > 0:
+                delay *= self._random.lognormvariate(0.0, profile.latency_sigma)
+            roll = self._random.random()
+            if roll < profile.rate_limit_rate:
+                outcome = "rate_limited"
+            elif roll < profile.rate_limit_rate + profile.error_rate:
+                outcome = "errors"
+            else:
+                outcome = "ok"
+            self._counts[outcome] += 1
+        return delay, outcome
+
+    def respond(self, path: str, body: dict) -> dict:
+        raise NotImplementedError
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                delay, outcome = server._draw()
+                if delay:
+                    time.sleep(delay)
+                if outcome == "rate_limited":
+                    self._send(429, {"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit"}},
+                               {"Retry-After": str(server.profile.retry_after)})
+                    return
+                if outcome == "errors":
+                    self._send(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+                    return
+                try:
+                    self._send(200, server.respond(self.path, body))
+                except KeyError as e:
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}: {e}"}})
+
+        return Handler
+
+
+class MockLLMServer(_MockServer):
+    """
+    OpenAI-совместимая заглушка chat completions.
+
+    Параметры:
+        yes_rate (float): Доля ответов YES на промт need_search.
+        relevant_rate (float): Доля ответов RELEVANT_PLUS на промт классификации.
+    """
+
+    def __init__(self, profile: ServerProfile = None, yes_rate: float = 0.6, relevant_rate: float = 0.5, **kwargs):
+        super().__init__(profile, **kwargs)
+        self.yes_rate = yes_rate
+        self.relevant_rate = relevant_rate
+        self._seen_prefixes = set()
+
+    def _label(self, text: str) -> str:
+        return "RELEVANT_PLUS" if _stable_fraction(text) < self.relevant_rate else "IRRELEVANT"
+
+    def _answer(self, text: str) -> str:
+        items = _PACKED_ITEM.findall(text)
+        if items:
+            blocks = _PACKED_ITEM.split(text)
+            return "\n".join(f"{number}: {self._label(blocks[2 * i + 2])}" for i, number in enumerate(items))
+        if '"YES"' in text:
+            return "YES" if _stable_fraction(text) < self.yes_rate else "NO"
+        return self._label(text)
+
+    def _relevant_prob(self, text: str) -> float:
+        """Вероятность RELEVANT_PLUS, согласованная с `_label` (больше 0.5 ровно для релевантных ответов)."""
+        fraction, rate = _stable_fraction(text), self.relevant_rate
+        if fraction < rate:
+            return 0.5 + 0.49 * (rate - fraction) / rate
+        return 0.5 - 0.49 * (fraction - rate) / (1.0 - rate)
+
+    def _logprobs(self, text: str, top_k: int):
+        prob = self._relevant_prob(text)
+        candidates = sorted(
+            [("REL", 0.97 * prob), ("IR", 0.97 * (1 - prob)), ("RE", 0.03 * prob), ("I", 0.03 * (1 - prob))],
+            key=lambda item: -item[1],
+        )
+        top = [{"token": token, "logprob": math.log(p), "bytes": None} for token, p in candidates[:max(1, top_k)]]
+        return top[0]["token"], {"content": [{**top[0], "top_logprobs": top}]}
+
+    def respond(self, path: str, body: dict) -> dict:
+        if not path.rstrip("/").endswith("/chat/completions"):
+            raise KeyError(path)
+        messages = body.get("messages", [])
+        text = "\n".join(message.get("content", "") for message in messages)
+        system = messages[0].get("content", "") if messages and messages[0].get("role") == "system" else ""
+
+        with self._lock:
+            cached = _estimate_tokens(system) if system in self._seen_prefixes else 0
+            self._seen_prefixes.add(system)
+
+        logprobs = None
+        if body.get("logprobs"):
+            content, logprobs = self._logprobs(text, int(body.get("top_logprobs") or 1))
+        else:
+            content = self._answer(text)
+        prompt_tokens = _estimate_tokens(text)
+        completion_tokens = min(_estimate_tokens(content), body.get("max_tokens") or 1000)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0, "message": {"role": "assistant", "content": content},
+                "logprobs": logprobs, "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached},
+            },
+        }
+
+
+class MockTavilyServer(_MockServer):
+    """
+    Заглушка Tavily Search API.
+
+    Параметры:
+        snippet_chars (int): Длина одного сниппета.
+    """
+
+    def __init__(self, profile: ServerProfile = None, snippet_chars: int = 600, **kwargs):
+        super().__init__(profile, **kwargs)
+        self.snippet_chars = snippet_chars
+
+    def respond(self, path: str, body: dict) -> dict:
+        if not path.rstrip("/").endswith("/search"):
+            raise KeyError(path)
+        query = body.get("query", "")
+        results = []
+        for i in range(int(body.get("max_results", 3))):
+            sentence = f"Результат {i + 1} по запросу «{query}»: организация работает ежедневно, есть отзывы и цены. "
+            results.append({
+                "title": f"{query} — {i + 1}",
+                "url": f"https://example.com/{i + 1}",
+                "content": (sentence * (self.snippet_chars // len(sentence) + 1))[:self.snippet_chars],
+                "score": 1.0 - i * 0.1,
+            })
+        return {"query": query, "results": results, "response_time": 0.0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальные заглушки OpenAI и Tavily.")
+    parser.add_argument("--llm_port", type=int, default=8001)
+    parser.add_argument("--tavily_port", type=int, default=8002)
+    parser.add_argument("--latency_ms", type=float, default=0.0, help="Медиана задержки")
+    parser.add_argument("--latency_sigma", type=float, default=0.0, help="sigma логнормальной задержки")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Доля ответов 429")
+    args = parser.parse_args()
+
+    profile = ServerProfile(args.latency_ms, args.latency_sigma, args.error_rate, args.rate_limit_rate)
+    llm_server = MockLLMServer(profile, port=args.llm_port).start()
+    tavily_server = MockTavilyServer(profile, port=args.tavily_port).start()
+    print(f"LLM_BASE_URL={llm_server.url}/v1")
+    print(f"TAVILY_BASE_URL={tavily_server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        llm_server.stop()
+        tavily_server.stop()
@@ -0,0 +1,323 @@
+# benchmarks/run_benchmark.py
+"""
+run_benchmark.py
+
+Бенчмарк пропускной способности и задержек бейзлайна и агента на локальных заглушках API
+(`benchmarks.mock_servers`): сеть и ключи не нужны, поэтому подходит для CI.
+
+Для каждой цели (baseline и каждая версия агента) сообщает:
+- rows/sec и общее время;
+- p50 / p95 / p99 задержки по узлам графа (decide_need_search, search, classify, ...) и по вызовам LLM бейзлайна;
+- LLM- и поисковых запросов на строку (по счётчикам заглушек, включая повторы после 429/500);
+- число строк с ERROR.
+
+Кэши LLM и поиска отключены (каждый прогон ходит в заглушки), лимитеры подняты до `--rps`.
+
+Примеры:
+    python -m benchmarks.run_benchmark --rows 200 --versions v1 v3 --concurrency 8 --llm_latency_ms 300
+    python -m benchmarks.run_benchmark --rows 200 --versions v3 --scoring logprob
+    # CI: сравнить с сохранённым отчётом и упасть при падении rows/sec больше чем на 20%
+    python -m benchmarks.run_benchmark --rows 100 --output report.json --compare baseline_report.json --max_regression 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import functools
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from benchmarks.mock_servers import MockLLMServer, MockTavilyServer, ServerProfile  # noqa: E402
+
+# Узлы графа: имя функции в agent.agent_graph -> имя узла в отчёте
+GRAPH_NODES = {
+    "decide_need_search_node": "decide_need_search",
+    "adecide_need_search_node": "decide_need_search",
+    "speculative_decide_need_search_node": "decide_need_search",
+    "aspeculative_decide_need_search_node": "decide_need_search",
+    "gate_need_search_node": "gate_need_search",
+    "agate_need_search_node": "gate_need_search",
+    "search_node": "search",
+    "asearch_node": "search",
+    "classify_node": "classify",
+    "aclassify_node": "classify",
+}
+
+_QUERIES = [
+    "кафе с завтраками", "шиномонтаж 24", "аптека круглосуточно", "где дешево поесть", "стоматология",
+    "доставка цветов", "автомойка самообслуживания", "детский сад", "ремонт телефонов", "хостел у вокзала",
+]
+_ORGS = [
+    ("Буше", "Пекарня"), ("Шиномонтаж", "Шиномонтаж"), ("Ригла", "Аптека"), ("Теремок", "Быстрое питание"),
+    ("Улыбка", "Стоматологическая клиника"), ("Флора", "Магазин цветов"), ("Мой-ка", "Автомойка"),
+    ("Солнышко", "Детский сад"), ("Мастер", "Ремонт телефонов"), ("Вокзал Хостел", "Хостел"),
+]
+
+
+def synthetic_dataset(rows: int):
+    """Синтетический датасет в формате `load_dataset` (уникальные строки, стабильный порядок)."""
+    import pandas as pd
+
+    data = []
+    for i in range(rows):
+        name, rubric = _ORGS[(i * 7) % len(_ORGS)]
+        data.append({
+            "text": f"{_QUERIES[i % len(_QUERIES)]} {i}",
+            "name": name,
+            "address": f"Москва, улица Тестовая, {i}",
+            "normalized_main_rubric_name_ru": rubric,
+            "reviews_summarized": "Отзывы положительные: хвалят обслуживание и цены." if i % 3 else None,
+            "permalink": 10_000 + i,
+            "relevance_new": float(i % 2),
+        })
+    return pd.DataFrame(data)
+
+
+def percentiles(samples) -> dict:
+    import numpy as np
+
+    if not samples:
+        return {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    values = np.asarray(samples) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(samples), "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+
+def _timed(name, fn, samples):
+    """Обёртка узла, записывающая время выполнения в `samples[name]`."""
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                samples[name].append(time.perf_counter() - started)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            samples[name].append(time.perf_counter() - started)
+    return wrapper
+
+
+def _instrument_agent(samples):
+    """Подменяет функции узлов в `agent.agent_graph` (граф строится из них) и пакетную классификацию оценщика."""
+    import agent.agent_graph as agent_graph
+    import agent.eval_agent as eval_agent
+
+    originals = []
+    for attr, node in GRAPH_NODES.items():
+        fn = getattr(agent_graph, attr, None)
+        if fn is not None:
+            originals.append((agent_graph, attr, fn))
+            setattr(agent_graph, attr, _timed(node, fn, samples))
+    for attr in ("classify_packed_states", "aclassify_packed_states"):
+        fn = getattr(eval_agent, attr)
+        originals.append((eval_agent, attr, fn))
+        setattr(eval_agent, attr, _timed("classify_packed", fn, samples))
+    return originals
+
+
+def _restore(originals):
+    for module, attr, fn in originals:
+        setattr(module, attr, fn)
+
+
+def _server_delta(before, after):
+    return {key: after[key] - before[key] for key in after}
+
+
+def _measure(name, run, rows, llm_server, tavily_server, samples):
+    llm_before, search_before = llm_server.stats(), tavily_server.stats()
+    started = time.perf_counter()
+    responses = run()
+    elapsed = time.perf_counter() - started
+    llm_calls = _server_delta(llm_before, llm_server.stats())
+    search_calls = _server_delta(search_before, tavily_server.stats())
+    return {
+        "target": name,
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 2) if elapsed else 0.0,
+        "llm_calls_per_row": round(llm_calls["requests"] / rows, 3),
+        "search_calls_per_row": round(search_calls["requests"] / rows, 3),
+        "llm_retried": llm_calls["errors"] + llm_calls["rate_limited"],
+        "search_retried": search_calls["errors"] + search_calls["rate_limited"],
+        "error_rows": int(sum(1 for r in responses if not isinstance(r, str) or r.startswith("ERROR"))),
+        "nodes": {node: percentiles(values) for node, values in sorted(samples.items())},
+    }
+
+
+def run_baseline(data, args, llm_server, tavily_server):
+    from baseline.core import RelevanceBaseline
+    from baseline.llm_interface import GPTInterface
+
+    samples = defaultdict(list)
+    llm = GPTInterface(cache=False)
+    llm.complete = _timed("llm_call", llm.complete, samples)
+    baseline = RelevanceBaseline(llm_interface=llm, pack_size=args.pack_size, scoring=args.scoring)
+
+    def run():
+        result, _ = baseline.run_full_evaluation(data.copy(), batch_size=args.batch_size)
+        return result["gpt_response"].tolist()
+
+    return _measure("baseline", run, len(data), llm_server, tavily_server, samples)
+
+
+def run_agent(version, data, args, llm_server, tavily_server):
+    from agent.eval_agent import RelevanceAgentEvaluator
+
+    samples = defaultdict(list)
+    originals = _instrument_agent(samples)
+    try:
+        # Дедупликация, каскад и фильтр поиска выключены: измеряется полный путь каждой строки
+        evaluator = RelevanceAgentEvaluator(
+            use_cache=False, prompt_version=version, max_concurrency=args.concurrency,
+            speculative_search=args.speculative_search, pack_size=args.pack_size,
+            search_gate=False, cascade=False, dedup=False, scoring=args.scoring, search_budget=args.search_budget,
+        )
+
+        def run():
+            result, _ = evaluator.run_full_evaluation(data.copy(), batch_size=args.batch_size)
+            return result["agent_response"].tolist()
+
+        result = _measure(f"agent_{version}", run, len(data), llm_server, tavily_server, samples)
+        if evaluator.telemetry:
+            # Входные токены LLM на строку (по логам агента) — эффект --search_budget и пакетной классификации
+            result["prompt_tokens_per_row"] = round(evaluator.telemetry["llm"]["prompt_tokens"] / len(data), 1)
+        return result
+    finally:
+        _restore(originals)
+
+
+def print_report(results):
+    for result in results:
+        print(f"\n=== {result['target']} ===")
+        print(f"{result['rows']} строк за {result['seconds']:.2f} с: {result['rows_per_sec']:.2f} rows/sec, "
+              f"строк с ERROR: {result['error_rows']}")
+        print(f"LLM-запросов на строку: {result['llm_calls_per_row']:.2f} (повторов {result['llm_retried']}), "
+              f"поисковых: {result['search_calls_per_row']:.2f} (повторов {result['search_retried']})")
+        if "prompt_tokens_per_row" in result:
+            print(f"Входных токенов LLM на строку: {result['prompt_tokens_per_row']:.1f}")
+        for node, stats in result["nodes"].items():
+            print(f"  {node:<20} n={stats['count']:<5} p50={stats['p50_ms']:>8.1f} мс  "
+                  f"p95={stats['p95_ms']:>8.1f} мс  p99={stats['p99_ms']:>8.1f} мс")
+
+
+def compare_reports(results, reference_path, max_regression):
+    """
+    Сравнивает rows/sec и p95 узлов с сохранённым отчётом.
+
+    Returns:
+        list[str]: Описания регрессий (пустой список — регрессий нет).
+    """
+    with open(reference_path, "r", encoding="utf-8") as f:
+        reference = {result["target"]: result for result in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = reference.get(result["target"])
+        if previous is None:
+            continue
+        if result["rows_per_sec"] < previous["rows_per_sec"] * (1 - max_regression):
+            regressions.append(
+                f"{result['target']}: rows/sec {result['rows_per_sec']:.2f} < {previous['rows_per_sec']:.2f}"
+            )
+        for node, stats in result["nodes"].items():
+            old = previous.get("nodes", {}).get(node)
+            if old and old["p95_ms"] and stats["p95_ms"] > old["p95_ms"] * (1 + max_regression):
+                regressions.append(f"{result['target']}/{node}: p95 {stats['p95_ms']:.1f} мс > {old['p95_ms']:.1f} мс")
+    return regressions
+
+
+def main(args):
+    llm_profile = ServerProfile(
+        args.llm_latency_ms, args.latency_sigma, args.error_rate, args.rate_limit_rate, args.retry_after, seed=args.seed,
+    )
+    search_profile = ServerProfile(
+        args.search_latency_ms, args.latency_sigma, args.error_rate, args.rate_limit_rate, args.retry_after,
+        seed=args.seed + 1,
+    )
+
+    with MockLLMServer(llm_profile) as llm_server, MockTavilyServer(search_profile) as tavily_server, \
+            tempfile.TemporaryDirectory() as tmp_dir:
+        # Окружение выставляется до импорта модулей проекта (конфигурация читается при импорте)
+        os.environ.update({
+            "OPENAI_API_KEY": "mock",
+            "TAVILY_API_KEY": "mock",
+            "LLM_BASE_URL": f"{llm_server.url}/v1",
+            "TAVILY_BASE_URL": tavily_server.url,
+            "LLM_CACHE_ENABLED": "false",
+            "SEARCH_CACHE_PATH": os.path.join(tmp_dir, "search_cache.sqlite"),
+            "LLM_REQUESTS_PER_SECOND": str(args.rps),
+            "SEARCH_REQUESTS_PER_SECOND": str(args.rps),
+            "LLM_TOKENS_PER_MINUTE": str(args.rps * 60 * 10_000),
+            "RATE_LIMIT_SHARE": "1",
+        })
+        import logging
+        from utils.config import setup_logging
+
+        setup_logging()
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+        data = synthetic_dataset(args.rows)
+        results = []
+        if not args.skip_baseline:
+            results.append(run_baseline(data, args, llm_server, tavily_server))
+        for version in args.versions:
+            results.append(run_agent(version, data, args, llm_server, tavily_server))
+
+    print_report(results)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\nОтчёт сохранён в {args.output}")
+
+    if args.compare:
+        regressions = compare_reports(results, args.compare, args.max_regression)
+        if regressions:
+            print("\nРегрессии производительности:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nРегрессий относительно {args.compare} нет (допуск {args.max_regression*100:.0f}%)")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк бейзлайна и агента на локальных заглушках OpenAI и Tavily.")
+    parser.add_argument("--rows", type=int, default=100, help="Число синтетических строк")
+    parser.add_argument("--versions", nargs="*", default=["v1", "v2", "v3"], help="Версии агента")
+    parser.add_argument("--skip_baseline", action="store_true", help="Не запускать бейзлайн")
+    parser.add_argument("--batch_size", type=int, default=5, help="Размер batch'а (синхронный режим)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Число строк агента, обрабатываемых одновременно")
+    parser.add_argument("--pack_size", type=int, default=1, help="Строк в одном запросе классификации")
+    parser.add_argument("--speculative_search", action="store_true", help="Спекулятивный поиск в агенте")
+    parser.add_argument("--scoring", type=str, choices=["text", "logprob"], default="text", help="Режим классификации")
+    parser.add_argument("--search_budget", type=int, default=0, help="Бюджет токенов контекста поиска (0 — без сокращения)")
+    parser.add_argument("--llm_latency_ms", type=float, default=50.0, help="Медиана задержки заглушки LLM")
+    parser.add_argument("--search_latency_ms", type=float, default=100.0, help="Медиана задержки заглушки Tavily")
+    parser.add_argument("--latency_sigma", type=float, default=0.3, help="sigma логнормальной задержки")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--retry_after", type=float, default=0.1, help="Retry-After для 429 (с)")
+    parser.add_argument("--rps", type=float, default=1000.0, help="Лимит запросов в секунду для лимитеров")
+    parser.add_argument("--seed", type=int, default=0, help="Зерно заглушек")
+    parser.add_argument("--output", type=str, default=None, help="JSON-отчёт")
+    parser.add_argument("--compare", type=str, default=None, help="JSON-отчёт для сравнения (регрессия -> код выхода 1)")
+    parser.add_argument("--max_regression", type=float, default=0.2, help="Допустимое ухудшение (доля)")
+    sys.exit(main(parser.parse_args()))
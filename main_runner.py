@@ -9,7 +9,8 @@ from dotenv import load_dotenv
 # Подавляем лишние логи от httpx
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-def main(version="v1", batch_size=5):
+def main(version="v1", batch_size=5, concurrency=1, speculative_search=False, pack_size=1, checkpoint_dir=None,
+         log_mode=None, search_gate=None, cascade=None, dedup=None, scoring=None, search_budget=None):
     # Добавляем корень проекта в PYTHONPATH
     from utils.config import BASE_DIR
     if BASE_DIR not in sys.path:
@@ -18,11 +19,14 @@ def main(version="v1", batch_size=5):
     # Импорт после добавления BASE_DIR
     from utils.data_loader import load_dataset
     from utils.config import (
-        DATA_PATH, AGENT_RESULTS_DIR, ENV_PATH,
-        validate_config, create_directories
+        DATA_PATH, AGENT_RESULTS_DIR, ENV_PATH, CHECKPOINT_DIR, TELEMETRY_PROMETHEUS_PORT,
+        validate_config, create_directories, setup_logging
     )
+    from utils.telemetry import start_metrics_server, write_summary
     from agent.eval_agent import RelevanceAgentEvaluator
+    from utils.llm_cache import get_llm_cache
 
+    setup_logging()
     # Загрузка переменных окружения
     load_dotenv(ENV_PATH)
 
@@ -41,17 +45,46 @@ def main(version="v1", batch_size=5):
     print(f" Данные загружены. Train: {len(train_data)}, Val: {len(val_data)}, Test: {len(test_data)}")
 
     # Инициализация агента
-    agent_evaluator = RelevanceAgentEvaluator(use_cache=True, prompt_version=version)
+    agent_evaluator = RelevanceAgentEvaluator(
+        use_cache=True, prompt_version=version, max_concurrency=concurrency,
+        speculative_search=speculative_search, pack_size=pack_size,
+        **({"log_mode": log_mode} if log_mode else {}),
+        **({"search_gate": search_gate} if search_gate is not None else {}),
+        **({"cascade": cascade} if cascade is not None else {}),
+        **({"dedup": dedup} if dedup is not None else {}),
+        **({"scoring": scoring} if scoring else {}),
+        **({"search_budget": search_budget} if search_budget is not None else {}),
+    )
+
+    if TELEMETRY_PROMETHEUS_PORT and start_metrics_server(TELEMETRY_PROMETHEUS_PORT):
+        print(f" Метрики Prometheus: http://localhost:{TELEMETRY_PROMETHEUS_PORT}/metrics")
+
+    # Контрольные точки: прерванный прогон продолжается с места остановки
+    if checkpoint_dir == "":
+        checkpoint_dir = CHECKPOINT_DIR
+
+    def checkpoint_path(split):
+        return os.path.join(checkpoint_dir, f"agent_{version}_{split}.jsonl") if checkpoint_dir else None
 
     # Оценка на валидации
     print(f"\n Запуск на валидации (версия промта: {version})...")
-    val_preds, val_acc = agent_evaluator.run_full_evaluation(val_data, batch_size=batch_size)
+    val_preds, val_acc = agent_evaluator.run_full_evaluation(
+        val_data, batch_size=batch_size, checkpoint_path=checkpoint_path("val"),
+    )
     print(f" Validation accuracy: {val_acc:.4f}")
+    val_telemetry = agent_evaluator.telemetry
 
     # Оценка на тесте
     print(f"\n Запуск на тесте (версия промта: {version})...")
-    test_preds, test_acc = agent_evaluator.run_full_evaluation(test_data, batch_size=batch_size)
+    test_preds, test_acc = agent_evaluator.run_full_evaluation(
+        test_data, batch_size=batch_size, checkpoint_path=checkpoint_path("test"),
+    )
     print(f" Test accuracy: {test_acc:.4f}")
+    test_telemetry = agent_evaluator.telemetry
+
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        print(f" Кэш LLM: {llm_cache.stats()}")
 
     # Сохранение результатов
     val_filename = os.path.join(AGENT_RESULTS_DIR, f"agent_val_predictions_{version}.csv")
@@ -61,12 +94,41 @@ def main(version="v1", batch_size=5):
     test_preds.to_csv(test_filename, index=False)
     print(f" Результаты сохранены в:\n- {val_filename}\n- {test_filename}")
 
+    # Сводки телеметрии (время узлов, токены, кэши, стоимость) рядом с предсказаниями
+    for split, telemetry in (("val", val_telemetry), ("test", test_telemetry)):
+        telemetry_filename = os.path.join(AGENT_RESULTS_DIR, f"agent_{split}_telemetry_{version}.json")
+        write_summary(telemetry_filename, telemetry)
+        print(f" Телеметрия {split}: {telemetry_filename}")
+
 # Точка входа при запуске из командной строки
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Запуск агента для оценки релевантности.")
     parser.add_argument("--version", type=str, default="v1", help="Версия промта для агента (например: v1, v2, v3)")
     parser.add_argument("--batch_size", type=int, default=5, help="Размер batch'а для инференса")
+    parser.add_argument("--concurrency", type=int, default=1, help="Число строк, обрабатываемых одновременно (>1 — асинхронный режим)")
+    parser.add_argument("--speculative_search", action="store_true", help="Запускать поиск параллельно с решением о его необходимости")
+    parser.add_argument("--pack_size", type=int, default=1, help="Число строк в одном запросе классификации (пакетный режим)")
+    parser.add_argument("--checkpoint_dir", type=str, nargs="?", const="", default=None,
+                        help="Директория контрольных точек (JSONL, без значения — experiments/checkpoints); повторный запуск пропускает готовые строки")
+    parser.add_argument("--log_mode", type=str, choices=["full", "slim"], default=None,
+                        help="slim — не хранить полные промты в agent_log (по умолчанию AGENT_LOG_MODE)")
+    parser.add_argument("--search_gate", action="store_true", default=None,
+                        help="Локальный фильтр перед decide_need_search (по умолчанию SEARCH_GATE_ENABLED)")
+    parser.add_argument("--cascade", action="store_true", default=None,
+                        help="Каскад: уверенные строки решает локальный лексический оценщик (по умолчанию CASCADE_ENABLED)")
+    parser.add_argument("--dedup", action="store_true", default=None,
+                        help="Объединять строки с одинаковым запросом и организацией (по умолчанию DEDUP_ENABLED)")
+    parser.add_argument("--scoring", type=str, choices=["text", "logprob"], default=None,
+                        help="Классификация: текстовый ответ или вероятность по logprobs (по умолчанию LLM_SCORING)")
+    parser.add_argument("--search_budget", type=int, default=None,
+                        help="Бюджет токенов контекста поиска в промте classify, 0 — без сокращения (по умолчанию SEARCH_TOKEN_BUDGET)")
     args = parser.parse_args()
 
     # Вызов основного метода
-    main(version=args.version, batch_size=args.batch_size)
+    main(
+        version=args.version, batch_size=args.batch_size,
+        concurrency=args.concurrency, speculative_search=args.speculative_search,
+        pack_size=args.pack_size, checkpoint_dir=args.checkpoint_dir, log_mode=args.log_mode,
+        search_gate=args.search_gate, cascade=args.cascade, dedup=args.dedup, scoring=args.scoring,
+        search_budget=args.search_budget,
+    )
@@ -0,0 +1,297 @@
+# llm_relevance_agent/service/app.py
+"""
+app.py
+
+Онлайн-сервис оценки релевантности пар (запрос, организация).
+
+Граф агента (`build_relevance_graph`) компилируется и клиент LLM (`agent_nodes.get_llm()`, общий `GPTInterface`)
+создаётся один раз при старте; дальше сервис держит их «тёплыми». Все запросы обрабатываются в одном
+фоновом цикле событий: одновременные запросы объединяются в микробатчи (`service.batcher.MicroBatcher`,
+SERVICE_MAX_BATCH_SIZE / SERVICE_MAX_WAIT_MS) и оцениваются через `RelevanceAgentEvaluator.aevaluate_batch`
+(конкурентно, а при `pack_size > 1` — пакетной классификацией). Одинаковые входы внутри батча оцениваются один раз.
+
+HTTP (стандартный `http.server`, без дополнительных зависимостей):
+- `POST /score` — {"query": ..., "org": {"name", "address", "rubric", "reviews"}, "id": ...}
+  или {"items": [...], "include_log": false}; ответ — {"results": [{"id", "response", "label", "prob", "search_used"}]};
+- `GET /health` — состояние и версия промта;
+- `GET /metrics` — метрики Prometheus (если установлен `prometheus_client`), иначе JSON как `GET /stats`;
+- `GET /stats` — число запросов, задержки, размеры батчей, токены LLM.
+
+Запуск:
+    python -m service.app --version v3 --port 8080
+"""
+
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.config import (
+    BASE_DIR, PROMPT_VERSION, AGENT_USE_CACHE, LLM_SCORING, SERVICE_HOST, SERVICE_PORT, SERVICE_MAX_BATCH_SIZE,
+    SERVICE_MAX_WAIT_MS, SERVICE_CONCURRENCY, SERVICE_REQUEST_TIMEOUT,
+)
+from utils.records import EvalRecord, record_from_dict
+from utils.dedup import input_key
+from utils.metrics import responses_to_labels
+from utils.telemetry import latency_summary, metrics_payload
+from service.batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+_LATENCY_WINDOW = 10000
+
+
+def parse_item(payload: dict) -> EvalRecord:
+    """
+    Запись для оценщика из JSON-элемента запроса. Поля организации принимаются как короткими именами
+    (name, address, rubric, reviews), так и именами столбцов датасета.
+
+    Исключения:
+        ValueError: Нет запроса или организация задана не объектом.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Элемент запроса должен быть JSON-объектом")
+    query = payload.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("Поле query обязательно")
+    org = payload.get("org") or {}
+    if not isinstance(org, dict):
+        raise ValueError("Поле org должно быть JSON-объектом")
+    return record_from_dict(query, org, key=str(payload.get("id", "")))
+
+
+class RelevanceService:
+    """
+    Параметры:
+        prompt_version (str): Версия промтов агента.
+        max_batch_size, max_wait_ms: Параметры микробатчинга.
+        max_concurrency (int): Строк агента одновременно внутри батча.
+        pack_size (int): Пакетная классификация внутри батча (1 — по одной строке).
+        scoring (str): "text" или "logprob" (в ответ добавляется `prob`).
+    """
+
+    def __init__(self, prompt_version=PROMPT_VERSION, max_batch_size=SERVICE_MAX_BATCH_SIZE,
+                 max_wait_ms=SERVICE_MAX_WAIT_MS, max_concurrency=SERVICE_CONCURRENCY, pack_size=1,
+                 scoring=LLM_SCORING, use_cache=AGENT_USE_CACHE):
+        from agent import agent_nodes
+        from agent.eval_agent import RelevanceAgentEvaluator
+
+        # Граф и шаблоны промтов готовятся один раз; каскад и дедупликация оценщика работают на уровне прогона
+        # датасета, поэтому в сервисе выключены (одинаковые входы батча объединяет сам сервис)
+        self.evaluator = RelevanceAgentEvaluator(
+            use_cache=use_cache, prompt_version=prompt_version, max_concurrency=max_concurrency,
+            pack_size=pack_size, cascade=False, dedup=False, scoring=scoring,
+        )
+        # Клиент LLM создаётся сразу, чтобы первый запрос не платил за импорт SDK и создание клиента
+        agent_nodes.get_llm()
+        self.prompt_version = prompt_version
+        self.batcher = MicroBatcher(self._process, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self.started_at = time.time()
+        self._loop = None
+        self._thread = None
+        self._counts = {"requests": 0, "items": 0, "errors": 0, "timeouts": 0}
+        self._latency = deque(maxlen=_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    # --- Цикл событий ---
+
+    def start(self):
+        """Запускает фоновый цикл событий, в котором выполняются все оценки."""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="relevance_service_loop")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    # --- Оценка ---
+
+    async def _process(self, records):
+        """Оценивает микробатч: одинаковые входы — один раз."""
+        unique = {}
+        for record in records:
+            unique.setdefault(input_key(record), record)
+        responses, logs = await self.evaluator.aevaluate_batch(list(unique.values()))
+        results = dict(zip(unique, zip(responses, logs)))
+        return [results[input_key(record)] for record in records]
+
+    async def ascore(self, records):
+        return await asyncio.gather(*(self.batcher.submit(record) for record in records))
+
+    def score(self, payloads, include_log=False):
+        """
+        Синхронная оценка элементов запроса (вызывается из потоков HTTP-сервера).
+
+        Returns:
+            list[dict]: id, response, label, prob (режим logprob), search_used и, по запросу, log.
+        """
+        records = [parse_item(payload) for payload in payloads]
+        started = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(self.ascore(records), self._loop)
+        try:
+            outputs = future.result(timeout=SERVICE_REQUEST_TIMEOUT)
+        except FutureTimeoutError:
+            # Клиент ответа уже не ждёт: оценка отменяется, ещё не начатые элементы выпадают из микробатча
+            future.cancel()
+            with self._lock:
+                self._counts["timeouts"] += 1
+            raise
+        elapsed = time.perf_counter() - started
+
+        labels = responses_to_labels([response for response, _ in outputs])
+        results = []
+        for record, (response, log), label in zip(records, outputs, labels):
+            result = {
+                "id": record.key,
+                "response": response,
+                "label": float(label),
+                "prob": log.get("classification_prob"),
+                "search_used": log.get("need_search_decision") == "YES",
+            }
+            if include_log:
+                result["log"] = log
+            results.append(result)
+
+        with self._lock:
+            self._counts["requests"] += 1
+            self._counts["items"] += len(records)
+            self._counts["errors"] += sum(1 for result in results if result["label"] == -1.0)
+            self._latency.append(elapsed)
+        return results
+
+    # --- Состояние ---
+
+    def health(self) -> dict:
+        return {
+            "status": "ok" if self._loop is not None and self._loop.is_running() else "starting",
+            "prompt_version": self.prompt_version,
+            "scoring": self.evaluator.scoring,
+            "uptime_s": round(time.time() - self.started_at, 1),
+        }
+
+    def stats(self) -> dict:
+        from agent import agent_nodes
+
+        with self._lock:
+            counts = dict(self._counts)
+            latency = latency_summary(list(self._latency))
+        llm = agent_nodes.llm
+        return {
+            **counts,
+            "latency": latency,
+            "batching": self.batcher.stats(),
+            "llm_usage": llm.usage_stats() if llm is not None else None,
+            "llm_cache": llm.cache_stats() if llm is not None else None,
+        }
+
+
+def make_handler(service: RelevanceService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _send(self, status, payload, content_type="application/json"):
+            if isinstance(payload, bytes):
+                data = payload
+            else:
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if path == "/health":
+                self._send(200, service.health())
+            elif path == "/metrics":
+                payload = metrics_payload()
+                if payload is None:
+                    self._send(200, service.stats())
+                else:
+                    self._send(200, payload, "text/plain; version=0.0.4; charset=utf-8")
+            elif path == "/stats":
+                self._send(200, service.stats())
+            else:
+                self._send(404, {"error": f"Неизвестный путь: {self.path}"})
+
+        def do_POST(self):
+            if self.path.split("?")[0].rstrip("/") != "/score":
+                self._send(404, {"error": f"Неизвестный путь: {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(body, dict):
+                    raise ValueError("Тело запроса должно быть JSON-объектом")
+                items = body["items"] if "items" in body else [body]
+                if not isinstance(items, list) or not items:
+                    raise ValueError("Поле items должно быть непустым списком")
+                results = service.score(items, include_log=bool(body.get("include_log")))
+            except (ValueError, KeyError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            except FutureTimeoutError:
+                self._send(504, {"error": f"Оценка не завершилась за {SERVICE_REQUEST_TIMEOUT} с"})
+                return
+            except Exception as e:
+                logger.error(f"Ошибка при обработке запроса: {e}")
+                self._send(500, {"error": str(e)})
+                return
+            self._send(200, {"results": results})
+
+    return Handler
+
+
+def serve(service: RelevanceService, host=SERVICE_HOST, port=SERVICE_PORT):
+    """Запускает сервис и HTTP-сервер (блокирующий вызов, остановка — Ctrl+C)."""
+    service.start()
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    httpd.daemon_threads = True
+    print(f"Сервис оценки релевантности: http://{host}:{port} (POST /score, GET /health, GET /metrics)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    from dotenv import load_dotenv
+    from utils.config import ENV_PATH, setup_logging
+
+    parser = argparse.ArgumentParser(description="Онлайн-сервис оценки релевантности с микробатчингом.")
+    parser.add_argument("--version", type=str, default=PROMPT_VERSION, help="Версия промтов агента")
+    parser.add_argument("--host", type=str, default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--max_batch_size", type=int, default=SERVICE_MAX_BATCH_SIZE, help="Элементов в микробатче")
+    parser.add_argument("--max_wait_ms", type=float, default=SERVICE_MAX_WAIT_MS, help="Бюджет ожидания микробатча")
+    parser.add_argument("--concurrency", type=int, default=SERVICE_CONCURRENCY, help="Строк агента одновременно")
+    parser.add_argument("--pack_size", type=int, default=1, help="Пакетная классификация внутри микробатча")
+    parser.add_argument("--scoring", type=str, choices=["text", "logprob"], default=LLM_SCORING, help="Режим классификации")
+    args = parser.parse_args()
+
+    setup_logging()
+    load_dotenv(ENV_PATH)
+    serve(
+        RelevanceService(
+            prompt_version=args.version, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+            max_concurrency=args.concurrency, pack_size=args.pack_size, scoring=args.scoring,
+        ),
+        host=args.host, port=args.port,
+    )
@@ -0,0 +1,118 @@
+# llm_relevance_agent/service/batcher.py
+"""
+batcher.py
+
+Микробатчинг запросов онлайн-сервиса.
+
+`MicroBatcher` собирает одновременно пришедшие элементы в батч: батч отправляется, как только
+набралось `max_batch_size` элементов или с момента прихода первого прошло `max_wait_ms` (бюджет задержки).
+Батч обрабатывается асинхронной функцией `process(items) -> list` (результаты в порядке элементов),
+сбор следующего батча при этом не ждёт завершения предыдущего.
+
+Статистика (`stats()`): число батчей и элементов, средний и максимальный размер батча, время ожидания в очереди.
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from utils.telemetry import latency_summary
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних наблюдений хранить для перцентилей
+_STATS_WINDOW = 10000
+
+
+class MicroBatcher:
+    """
+    Параметры:
+        process (callable): async-функция, принимающая список элементов и возвращающая список результатов.
+        max_batch_size (int): Максимальный размер батча.
+        max_wait_ms (float): Сколько ждать добора батча после прихода первого элемента.
+    """
+
+    def __init__(self, process, max_batch_size: int = 16, max_wait_ms: float = 20.0):
+        self.process = process
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = None
+        self._worker = None
+        self._tasks = set()
+        self._batches = 0
+        self._items = 0
+        self._max_seen = 0
+        self._queue_wait = deque(maxlen=_STATS_WINDOW)
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.create_task(self._collect())
+
+    async def submit(self, item):
+        """Ставит элемент в очередь и ждёт его результат."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        # Элементы отменённых запросов (таймаут на стороне сервиса) не оцениваются
+        batch = [entry for entry in batch if not entry[1].cancelled()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        self._batches += 1
+        self._items += len(batch)
+        self._max_seen = max(self._max_seen, len(batch))
+        self._queue_wait.extend(started - enqueued for _, _, enqueued in batch)
+        futures = [future for _, future, _ in batch]
+        task = asyncio.ensure_future(self.process([item for item, _, _ in batch]))
+
+        def cancel_if_abandoned(_):
+            # Все запросы батча отменены (таймаут) — оценку незачем продолжать
+            if all(future.cancelled() for future in futures):
+                task.cancel()
+
+        for future in futures:
+            future.add_done_callback(cancel_if_abandoned)
+        try:
+            results = await task
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+        except asyncio.CancelledError:
+            if not task.cancelled() or not all(future.cancelled() for future in futures):
+                raise
+            logger.info(f"Батч из {len(batch)} элементов отменён: запросы не дождались результата")
+        except Exception as e:
+            logger.error(f"Ошибка обработки батча: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self._batches,
+            "items": self._items,
+            "mean_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+            "max_batch_size": self._max_seen,
+            "queue_wait": latency_summary(list(self._queue_wait)),
+        }
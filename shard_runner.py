@@ -0,0 +1,192 @@
+# shard_runner.py
+"""
+shard_runner.py
+
+Шардированный запуск агента: val и test делятся на K детерминированных шардов, каждый шард
+оценивается отдельным процессом (или на отдельной машине) со своим `RelevanceAgentEvaluator`,
+а шаг слияния собирает упорядоченные DataFrame с предсказаниями и считает accuracy.
+
+Шард строки определяется хэшем (permalink, text) — тем же ключом, что и в контрольных точках,
+поэтому разбиение не зависит от порядка строк и числа рабочих процессов.
+Каждый шард пишет результаты в свою контрольную точку `{split}_shard{i}_of{K}.jsonl` в общей
+директории (`--output_dir`, может быть сетевой): упавший шард перезапускается с места остановки.
+
+Бюджет запросов к API общий: процесс шарда получает долю лимитов (RATE_LIMIT_SHARE) —
+1/K при запуске шардов на разных машинах и 1/workers в локальном пуле, — так что процессы вместе
+не превышают LLM_REQUESTS_PER_SECOND / LLM_TOKENS_PER_MINUTE / SEARCH_REQUESTS_PER_SECOND.
+
+Примеры:
+    # Все шарды на одной машине (4 процесса) и слияние
+    python shard_runner.py --version v3 --num_shards 4
+
+    # Шард 2 из 4 на отдельной машине (общая директория смонтирована в /mnt/shared)
+    python shard_runner.py --version v3 --num_shards 4 --shard_index 2 --output_dir /mnt/shared/run_v3
+
+    # Слияние готовых шардов
+    python shard_runner.py --version v3 --num_shards 4 --merge --output_dir /mnt/shared/run_v3
+"""
+
+import os
+import sys
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+def shard_of(key: str, num_shards: int) -> int:
+    """Номер шарда строки по её ключу (sha1 из `utils.checkpoint.row_key`)."""
+    return int(key[:16], 16) % num_shards
+
+
+def shard_path(output_dir: str, split: str, shard_index: int, num_shards: int) -> str:
+    return os.path.join(output_dir, f"{split}_shard{shard_index:03d}_of{num_shards:03d}.jsonl")
+
+
+def _default_output_dir(version: str) -> str:
+    from utils.config import CHECKPOINT_DIR
+    return os.path.join(CHECKPOINT_DIR, f"shards_{version}")
+
+
+def _load_splits(columns=None):
+    from utils.data_loader import load_dataset
+    from utils.config import DATA_PATH
+
+    if not os.path.exists(DATA_PATH):
+        raise FileNotFoundError(f"Файл с данными не найден: {DATA_PATH}")
+    _, val_data, test_data = load_dataset(DATA_PATH, drop_uncertain=True, val_frac=0.01, columns=columns)
+    return {"val": val_data, "test": test_data}
+
+
+def run_shard(shard_index, num_shards, output_dir, version="v1", batch_size=5, concurrency=1, pack_size=1,
+              parallel_processes=None):
+    """
+    Оценивает один шард val и test. Вызывается в отдельном процессе.
+
+    Параметры:
+        output_dir (str | None): Общая директория контрольных точек (None — experiments/checkpoints/shards_{version}).
+        parallel_processes (int, optional): Сколько процессов шардов работает одновременно
+            (по умолчанию `num_shards`); каждый получает 1/parallel_processes бюджета запросов.
+
+    Returns:
+        dict: split -> число строк шарда.
+    """
+    # Доля общего бюджета выставляется до импорта модулей, создающих лимитеры
+    # (если процесс пула выполняет несколько шардов подряд, лимитеры уже созданы с той же долей)
+    if "SHARD_BASE_RATE_SHARE" not in os.environ:
+        os.environ["SHARD_BASE_RATE_SHARE"] = os.environ.get("RATE_LIMIT_SHARE", "1")
+        share = float(os.environ["SHARD_BASE_RATE_SHARE"]) / (parallel_processes or num_shards)
+        os.environ["RATE_LIMIT_SHARE"] = str(share)
+
+    from dotenv import load_dotenv
+    from utils.config import ENV_PATH
+    from utils.checkpoint import row_keys
+    from utils.data_loader import EVAL_COLUMNS
+    from agent.eval_agent import RelevanceAgentEvaluator
+
+    load_dotenv(ENV_PATH)
+    output_dir = output_dir or _default_output_dir(version)
+    os.makedirs(output_dir, exist_ok=True)
+
+    evaluator = RelevanceAgentEvaluator(
+        use_cache=True, prompt_version=version, max_concurrency=concurrency, pack_size=pack_size,
+    )
+
+    sizes = {}
+    # Процессы шардов держат в памяти только колонки, нужные для оценки
+    for split, data in _load_splits(columns=EVAL_COLUMNS).items():
+        mask = [shard_of(key, num_shards) == shard_index for key in row_keys(data)]
+        shard = data[mask].reset_index(drop=True)
+        sizes[split] = len(shard)
+        print(f"[шард {shard_index}/{num_shards}] {split}: {len(shard)} строк")
+        evaluator.run_full_evaluation(
+            shard, batch_size=batch_size,
+            checkpoint_path=shard_path(output_dir, split, shard_index, num_shards),
+        )
+    return sizes
+
+
+def merge_shards(output_dir, num_shards, version="v1"):
+    """
+    Собирает результаты всех шардов в DataFrame в исходном порядке строк и сохраняет CSV
+    (как `main_runner.py`: `agent_{split}_predictions_{version}.csv`).
+
+    Returns:
+        dict: split -> (DataFrame, accuracy).
+    """
+    from utils.config import RELEVANCE_COL, AGENT_RESULTS_DIR
+    from utils.checkpoint import JsonlCheckpoint, row_keys
+
+    results = {}
+    for split, data in _load_splits().items():
+        records = {}
+        for shard_index in range(num_shards):
+            records.update(JsonlCheckpoint(shard_path(output_dir, split, shard_index, num_shards)).load())
+
+        keys = row_keys(data)
+        missing = sum(1 for key in keys if key not in records)
+        if missing:
+            print(f"{split}: нет результатов для {missing} строк (шарды не завершены?)")
+
+        data = data.copy()
+        data["agent_response"] = [records[key]["response"] if key in records else "ERROR" for key in keys]
+        data["agent_log"] = [records[key].get("log", {}) if key in records else {} for key in keys]
+        data["agent_pred_relevance"] = [records[key]["label"] if key in records else -1.0 for key in keys]
+
+        valid = data[data["agent_pred_relevance"] != -1.0]
+        acc = (valid[RELEVANCE_COL] == valid["agent_pred_relevance"]).mean() if len(valid) else 0.0
+        print(f"{split}: accuracy {acc:.4f} (по {len(valid)} валидным из {len(data)})")
+
+        os.makedirs(AGENT_RESULTS_DIR, exist_ok=True)
+        filename = os.path.join(AGENT_RESULTS_DIR, f"agent_{split}_predictions_{version}.csv")
+        data.to_csv(filename, index=False)
+        print(f"Результаты сохранены в {filename}")
+        results[split] = (data, acc)
+    return results
+
+
+def main(args):
+    shard_kwargs = dict(
+        version=args.version, batch_size=args.batch_size,
+        concurrency=args.concurrency, pack_size=args.pack_size,
+    )
+
+    if args.shard_index is not None:
+        # Конфигурация ещё не импортирована: run_shard сначала выставит долю бюджета
+        run_shard(args.shard_index, args.num_shards, args.output_dir, **shard_kwargs)
+        return
+
+    output_dir = args.output_dir or _default_output_dir(args.version)
+
+    if not args.merge:
+        workers = min(args.workers or args.num_shards, args.num_shards)
+        # spawn: модули агента (и лимитеры) создаются в каждом процессе заново, уже с долей бюджета
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [
+                executor.submit(
+                    run_shard, shard_index, args.num_shards, output_dir,
+                    parallel_processes=workers, **shard_kwargs,
+                )
+                for shard_index in range(args.num_shards)
+            ]
+            for shard_index, future in enumerate(futures):
+                print(f"Шард {shard_index} завершён: {future.result()}")
+
+    merge_shards(output_dir, args.num_shards, version=args.version)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Шардированный запуск агента для оценки релевантности.")
+    parser.add_argument("--version", type=str, default="v1", help="Версия промта для агента")
+    parser.add_argument("--num_shards", type=int, required=True, help="Число шардов K")
+    parser.add_argument("--shard_index", type=int, default=None, help="Запустить только этот шард (0..K-1), без слияния")
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов (по умолчанию K)")
+    parser.add_argument("--merge", action="store_true", help="Только собрать результаты готовых шардов")
+    parser.add_argument("--output_dir", type=str, default=None, help="Общая директория контрольных точек шардов")
+    parser.add_argument("--batch_size", type=int, default=5, help="Размер batch'а для инференса")
+    parser.add_argument("--concurrency", type=int, default=1, help="Число строк, обрабатываемых одновременно в шарде")
+    parser.add_argument("--pack_size", type=int, default=1, help="Число строк в одном запросе классификации")
+    main(parser.parse_args())
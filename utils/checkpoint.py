@@ -0,0 +1,143 @@
+"""
+checkpoint.py
+
+Контрольные точки длинных прогонов: каждая обработанная строка сразу дописывается в JSONL-файл.
+
+Формат: одна JSON-строка на строку датасета
+    {"key": ..., "response": ..., "label": ..., "log": {...}}
+где `key` — sha1 от (`permalink`, `text`). Файл только дописывается (append-only), поэтому после падения
+процесса в нём остаются все завершённые строки; недописанная последняя строка при чтении пропускается.
+
+Повторный запуск с тем же файлом пропускает уже оценённые строки (`RelevanceBaseline.run_full_evaluation`
+и `RelevanceAgentEvaluator.run_full_evaluation`, параметр `checkpoint_path`). Для возобновления читаются только
+ключи завершённых строк (`finished_keys`); сами записи дочитываются из файла потоком при сборке результата (`lookup`).
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def row_key(row) -> str:
+    """Ключ строки датасета: sha1 от permalink и текста запроса."""
+    permalink = row.get("permalink", "")
+    payload = f"{permalink}\x1f{row['text']}"
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def row_keys(df) -> list:
+    """Ключи всех строк DataFrame (по колонкам `permalink` и `text`)."""
+    permalinks = df["permalink"] if "permalink" in df.columns else [""] * len(df)
+    return [row_key({"permalink": p, "text": t}) for p, t in zip(permalinks, df["text"])]
+
+
+def pending_positions(keys, done) -> list:
+    """
+    Позиции строк, которых нет в `done`; повторяющиеся ключи оцениваются один раз (первое вхождение).
+    """
+    positions = []
+    seen = set(done)
+    for pos, key in enumerate(keys):
+        if key not in seen:
+            seen.add(key)
+            positions.append(pos)
+    return positions
+
+
+def is_finished(record) -> bool:
+    """Запись считается завершённой, если ответ не ошибка — строки с "ERROR" при возобновлении пересчитываются."""
+    response = record.get("response")
+    return isinstance(response, str) and bool(response) and not response.startswith("ERROR")
+
+
+class JsonlCheckpoint:
+    """
+    Append-only JSONL-файл с результатами по строкам.
+
+    Параметры:
+        path (str): Путь к файлу (директория создаётся при необходимости).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def iter_records(self):
+        """
+        Читает записи файла по одной, в порядке записи (файл целиком в память не загружается).
+
+        Yields:
+            dict: Запись; повреждённые строки пропускаются.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Обрыв записи при падении процесса — строка будет пересчитана
+                    logger.warning(f"Пропущена повреждённая строка {line_no} в {self.path}")
+
+    def finished_keys(self) -> set:
+        """
+        Ключи завершённых строк (см. `is_finished`) — всё, что нужно для возобновления прогона.
+        При повторе ключа учитывается последняя запись.
+        """
+        keys = set()
+        for record in self.iter_records():
+            if is_finished(record):
+                keys.add(record["key"])
+            else:
+                keys.discard(record["key"])
+        return keys
+
+    def lookup(self, keys) -> dict:
+        """
+        Записи только для указанных ключей (при повторе ключа побеждает последняя).
+
+        Returns:
+            dict: key -> запись.
+        """
+        keys = set(keys)
+        records = {}
+        if not keys:
+            return records
+        for record in self.iter_records():
+            if record["key"] in keys:
+                records[record["key"]] = record
+        return records
+
+    def load(self) -> dict:
+        """
+        Читает все сохранённые записи (сборка результатов шардов).
+
+        Returns:
+            dict: key -> запись (при повторе ключа побеждает последняя).
+        """
+        return {record["key"]: record for record in self.iter_records()}
+
+    def load_finished(self) -> dict:
+        """Как `load`, но только завершённые записи (см. `is_finished`)."""
+        return self.lookup(self.finished_keys())
+
+    def append(self, records):
+        """Дописывает записи и сбрасывает их на диск (flush + fsync: запись переживает падение процесса и ОС)."""
+        lines = [json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records]
+        if not lines:
+            return
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
@@ -0,0 +1,124 @@
+"""
+compare.py
+
+Сравнение новых предсказаний с сохранёнными ранее (например, `experiments/baseline_test_predictions.csv`).
+
+Используется для оценки компромисса «стоимость / качество» при смене режима инференса
+(пакетная классификация, другой промт и т.п.): строки сопоставляются по (`permalink`, `text`),
+считаются доля совпадающих предсказаний и accuracy обоих вариантов на общих строках.
+
+Функции:
+- `compare_predictions(new_df, reference_path, ...)`: печатает и возвращает сводку сравнения.
+- `consensus_report(df, pred_cols, ...)`: согласие нескольких вариантов в одной таблице (A/B-прогон,
+  см. `agent.ab_runner`): accuracy каждого варианта, попарное совпадение, голосование большинством
+  и accuracy на строках, где все варианты согласны / расходятся.
+"""
+
+import numpy as np
+from utils.config import RELEVANCE_COL
+
+JOIN_KEYS = ["permalink", "text"]
+
+
+def compare_predictions(new_df, reference_path, new_col="gpt_pred_relevance",
+                        reference_col="gpt_pred_relevance", label_col=RELEVANCE_COL):
+    """
+    Сравнивает предсказания `new_df[new_col]` с предсказаниями из CSV `reference_path`.
+
+    Args:
+        new_df (pd.DataFrame): Новые предсказания.
+        reference_path (str): CSV с эталонным прогоном.
+        new_col (str): Колонка предсказания в `new_df`.
+        reference_col (str): Колонка предсказания в эталонном CSV.
+        label_col (str): Колонка с истинной меткой.
+
+    Returns:
+        dict: rows (общих строк), agreement, new_accuracy, reference_accuracy, changed (число изменившихся предсказаний).
+    """
+    import pandas as pd
+
+    reference = pd.read_csv(reference_path)
+    left = new_df[JOIN_KEYS + [label_col, new_col]].drop_duplicates(JOIN_KEYS)
+    right = reference[JOIN_KEYS + [reference_col]].drop_duplicates(JOIN_KEYS)
+    merged = left.merge(right, on=JOIN_KEYS, how="inner", suffixes=("_new", "_ref"))
+
+    new_name = f"{new_col}_new" if new_col == reference_col else new_col
+    ref_name = f"{reference_col}_ref" if new_col == reference_col else reference_col
+
+    if merged.empty:
+        print(f"Нет общих строк с {reference_path}")
+        return {"rows": 0}
+
+    def accuracy(col):
+        valid = merged[merged[col] != -1.0]
+        return (valid[label_col] == valid[col]).mean() if len(valid) else 0.0
+
+    summary = {
+        "rows": len(merged),
+        "agreement": float((merged[new_name] == merged[ref_name]).mean()),
+        "new_accuracy": float(accuracy(new_name)),
+        "reference_accuracy": float(accuracy(ref_name)),
+        "changed": int((merged[new_name] != merged[ref_name]).sum()),
+    }
+    print(
+        f"Сравнение с {reference_path} ({summary['rows']} строк): совпадение {summary['agreement']:.4f}, "
+        f"accuracy {summary['new_accuracy']:.4f} против {summary['reference_accuracy']:.4f}, "
+        f"изменилось предсказаний: {summary['changed']}"
+    )
+    return summary
+
+
+def majority_vote(preds: np.ndarray):
+    """
+    Голосование по строкам матрицы предсказаний (строки x варианты, -1.0 — нет ответа).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: метка большинства (-1.0 при равенстве голосов
+            или отсутствии валидных ответов), число валидных ответов, признак единогласия.
+    """
+    preds = np.asarray(preds, dtype=float)
+    positive = (preds == 1.0).sum(axis=1)
+    negative = (preds == 0.0).sum(axis=1)
+    votes = np.where(positive > negative, 1.0, np.where(negative > positive, 0.0, -1.0))
+    n_valid = positive + negative
+    unanimous = (n_valid == preds.shape[1]) & ((positive == 0) | (negative == 0))
+    return votes, n_valid, unanimous
+
+
+def consensus_report(df, pred_cols, label_col=RELEVANCE_COL) -> dict:
+    """
+    Сводка согласия вариантов по столбцам предсказаний `pred_cols` (1.0 / 0.0 / -1.0).
+
+    Returns:
+        dict: rows, variants ({столбец: accuracy, valid}), agreement ({"a | b": доля совпадений}),
+            majority (accuracy голосования), unanimous (доля строк и accuracy), disagreement (доля строк
+            и accuracy каждого варианта на них).
+    """
+    preds = df[list(pred_cols)].to_numpy(dtype=float)
+    labels = df[label_col].to_numpy(dtype=float)
+    votes, _, unanimous = majority_vote(preds)
+
+    def accuracy(pred, mask=None):
+        valid = pred != -1.0 if mask is None else (pred != -1.0) & mask
+        return float((pred[valid] == labels[valid]).mean()) if valid.any() else 0.0
+
+    variants = {
+        col: {"accuracy": accuracy(preds[:, i]), "valid": int((preds[:, i] != -1.0).sum())}
+        for i, col in enumerate(pred_cols)
+    }
+    agreement = {
+        f"{a} | {b}": float((preds[:, i] == preds[:, j]).mean())
+        for i, a in enumerate(pred_cols) for j, b in enumerate(pred_cols) if i < j
+    }
+    disagree = ~unanimous
+    return {
+        "rows": len(df),
+        "variants": variants,
+        "agreement": agreement,
+        "majority": {"accuracy": accuracy(votes), "valid": int((votes != -1.0).sum())},
+        "unanimous": {"share": float(unanimous.mean()) if len(df) else 0.0, "accuracy": accuracy(votes, unanimous)},
+        "disagreement": {
+            "share": float(disagree.mean()) if len(df) else 0.0,
+            "accuracy": {col: accuracy(preds[:, i], disagree) for i, col in enumerate(pred_cols)},
+        },
+    }
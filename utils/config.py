@@ -2,10 +2,15 @@ import os
 import logging
 
 # ✅ ДОБАВЛЕНО: Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Вызывается точками входа (CLI, сервис, ноутбук): импорт модулей проекта не меняет настройку логирования приложения
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+
+def setup_logging(level=None):
+    logging.basicConfig(
+        level=level or LOG_LEVEL,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
 
 # Корень проекта
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -15,6 +20,11 @@ DATA_PATH = os.path.join(BASE_DIR, "data", "data_final_for_dls_new.jsonl")
 ENV_PATH = os.path.join(BASE_DIR, ".env")
 RANDOM_STATE = 42
 
+# --- Загрузка датасета: потоковое чтение JSONL и кэш разобранных данных ---
+DATA_CACHE_DIR = os.getenv("DATA_CACHE_DIR", os.path.join(BASE_DIR, "data", "cache"))
+DATA_CACHE_ENABLED = os.getenv("DATA_CACHE_ENABLED", "true").lower() == "true"
+DATA_CHUNK_SIZE = int(os.getenv("DATA_CHUNK_SIZE", "5000"))  # строк JSONL в одном куске
+
 # Столбец с таргетом
 RELEVANCE_COL = "relevance_new"
 
@@ -23,10 +33,46 @@ EXPERIMENTS_DIR = os.path.join(BASE_DIR, "experiments")
 AGENT_RESULTS_DIR = os.path.join(EXPERIMENTS_DIR, "agent")
 AGENT_LOGS_DIR = os.path.join(AGENT_RESULTS_DIR, "agent_logs")
 SEARCH_CACHE_DIR = os.path.join(AGENT_RESULTS_DIR, "search_cache")
+CHECKPOINT_DIR = os.path.join(EXPERIMENTS_DIR, "checkpoints")  # JSONL контрольных точек прогонов
+
+# --- Кэш поиска: "sqlite" (один индексированный файл) или "json" (файл на запрос, прежний формат) ---
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "sqlite").lower()
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", os.path.join(AGENT_RESULTS_DIR, "search_cache.sqlite"))
+SEARCH_CACHE_TTL_DAYS = float(os.getenv("SEARCH_CACHE_TTL_DAYS", "0"))  # 0 — без ограничения
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "200000"))
+
+# --- Поиск (Tavily) ---
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+SEARCH_POOL_SIZE = int(os.getenv("SEARCH_POOL_SIZE", "16"))  # размер пула соединений и потоков search_many
+
+# --- Постобработка результатов поиска перед classify (см. agent/search_postprocess.py) ---
+SEARCH_TOKEN_BUDGET = int(os.getenv("SEARCH_TOKEN_BUDGET", "0"))  # токенов {search_info} в промте; 0 — только очистка
+SEARCH_DEDUP_THRESHOLD = float(os.getenv("SEARCH_DEDUP_THRESHOLD", "0.8"))  # Жаккар токенов для почти-дубликатов
+SEARCH_TOKENIZER_ENCODING = os.getenv("SEARCH_TOKENIZER_ENCODING", "o200k_base")  # кодировка tiktoken (gpt-4o-mini)
+
+# --- LLM API (OpenAI-совместимый; в бенчмарках подменяется локальной заглушкой) ---
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.vsegpt.ru/v1")
+
+# --- Кэш ответов LLM (SQLite) ---
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(EXPERIMENTS_DIR, "llm_cache.sqlite"))
+LLM_CACHE_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS", "0"))  # 0 — без ограничения
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "500000"))
+
+# --- Оценка по logprobs: один токен ответа и вероятности меток вместо текстового ответа (baseline/logprob_scoring.py) ---
+LLM_SCORING = os.getenv("LLM_SCORING", "text").lower()  # "text" или "logprob"
+LOGPROB_TOP_K = int(os.getenv("LOGPROB_TOP_K", "5"))  # сколько вариантов первого токена запрашивать
+LOGPROB_CALIBRATION_PATH = os.getenv("LOGPROB_CALIBRATION_PATH", os.path.join(EXPERIMENTS_DIR, "logprob_calibration.json"))
+
+# --- Раскладка сообщений для кэширования префикса на стороне провайдера ---
+# true: статическая инструкция с few-shot примерами уходит в system-сообщение (одинаковый префикс у всех строк),
+# а поля конкретной строки — в user-сообщение. false: весь промт в одном user-сообщении, как раньше.
+PROMPT_PREFIX_LAYOUT = os.getenv("PROMPT_PREFIX_LAYOUT", "false").lower() == "true"
 
 # --- Агент: настройки и пути к промтам ---
 AGENT_PROMPT_DIR = os.path.join(BASE_DIR, "agent", "prompts")
 PROMPT_VERSION = os.getenv("AGENT_PROMPT_VERSION", "v1")
+PROMPT_HOT_RELOAD = os.getenv("PROMPT_HOT_RELOAD", "false").lower() == "true"  # перечитывать изменённые шаблоны
 
 # Пути к конкретным промтам (по версии)
 PROMPT_CLASSIFY_PATH = os.path.join(AGENT_PROMPT_DIR, f"classify_{PROMPT_VERSION}.txt")
@@ -34,6 +80,44 @@ PROMPT_NEED_SEARCH_PATH = os.path.join(AGENT_PROMPT_DIR, f"need_search_{PROMPT_V
 
 # --- Агент: флаги управления ---
 AGENT_USE_CACHE = os.getenv("AGENT_USE_CACHE", "true").lower() == "true"
+# "full" — полные тексты промтов в agent_log; "slim" — id шаблона и хэш, текст восстанавливается по требованию
+AGENT_LOG_MODE = os.getenv("AGENT_LOG_MODE", "full").lower()
+# Один запуск графа на группу строк с одинаковым запросом и организацией (utils/dedup.py)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+
+# --- Локальный фильтр перед decide_need_search (agent/search_gate.py) ---
+SEARCH_GATE_ENABLED = os.getenv("SEARCH_GATE_ENABLED", "false").lower() == "true"
+SEARCH_GATE_DIR = os.getenv("SEARCH_GATE_DIR", AGENT_RESULTS_DIR)  # search_gate_{version}.json
+SEARCH_GATE_THRESHOLD = float(os.getenv("SEARCH_GATE_THRESHOLD", "0.9"))  # уверенность модели для решения без LLM
+
+# --- Каскад: локальный лексический оценщик релевантности перед агентом (agent/lexical_scorer.py) ---
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "false").lower() == "true"
+LEXICAL_SCORER_PATH = os.getenv("LEXICAL_SCORER_PATH", os.path.join(AGENT_RESULTS_DIR, "lexical_scorer.json"))
+CASCADE_LOW_THRESHOLD = float(os.getenv("CASCADE_LOW_THRESHOLD", "0.1"))    # вероятность <= low -> IRRELEVANT
+CASCADE_HIGH_THRESHOLD = float(os.getenv("CASCADE_HIGH_THRESHOLD", "0.9"))  # вероятность >= high -> RELEVANT_PLUS
+
+# --- Телеметрия: цены для оценки стоимости (USD) и экспорт метрик Prometheus ---
+LLM_PRICE_INPUT_PER_1M = float(os.getenv("LLM_PRICE_INPUT_PER_1M", "0.15"))
+LLM_PRICE_CACHED_INPUT_PER_1M = float(os.getenv("LLM_PRICE_CACHED_INPUT_PER_1M", "0.075"))
+LLM_PRICE_OUTPUT_PER_1M = float(os.getenv("LLM_PRICE_OUTPUT_PER_1M", "0.6"))
+SEARCH_PRICE_PER_REQUEST = float(os.getenv("SEARCH_PRICE_PER_REQUEST", "0.008"))
+TELEMETRY_PROMETHEUS_PORT = int(os.getenv("TELEMETRY_PROMETHEUS_PORT", "0"))  # 0 — не запускать эндпоинт
+
+# --- Онлайн-сервис оценки релевантности (service/app.py) ---
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_MAX_BATCH_SIZE = int(os.getenv("SERVICE_MAX_BATCH_SIZE", "16"))  # элементов в микробатче
+SERVICE_MAX_WAIT_MS = float(os.getenv("SERVICE_MAX_WAIT_MS", "20"))      # бюджет ожидания добора микробатча
+SERVICE_CONCURRENCY = int(os.getenv("SERVICE_CONCURRENCY", "16"))        # строк агента одновременно
+SERVICE_REQUEST_TIMEOUT = float(os.getenv("SERVICE_REQUEST_TIMEOUT", "120"))  # секунд на запрос
+
+# --- Ограничение частоты запросов к API (общее для LLM и поиска) ---
+LLM_REQUESTS_PER_SECOND = float(os.getenv("LLM_REQUESTS_PER_SECOND", "10"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+SEARCH_REQUESTS_PER_SECOND = float(os.getenv("SEARCH_REQUESTS_PER_SECOND", "5"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+# Доля общего бюджета, доступная процессу (шардированный запуск: 1/K на каждый из K шардов)
+RATE_LIMIT_SHARE = float(os.getenv("RATE_LIMIT_SHARE", "1"))
 
 # ✅ ДОБАВЛЕНО: Функция валидации
 def validate_config():
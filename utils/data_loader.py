@@ -1,17 +1,135 @@
+import os
+import hashlib
+import logging
 import pandas as pd
 from typing import Tuple
-from utils.config import RELEVANCE_COL, RANDOM_STATE
+from utils.config import RELEVANCE_COL, RANDOM_STATE, DATA_CACHE_DIR, DATA_CACHE_ENABLED, DATA_CHUNK_SIZE
+
+"""
+data_loader.py
+
+Загрузка датасета и детерминированное разбиение на train/val/test.
+
+JSONL читается потоково, кусками по `chunksize` строк; из каждого куска сразу оставляются только
+нужные колонки (`columns`), поэтому длинные текстовые поля, не используемые промтом, не держатся в памяти.
+Прочитанный и типизированный DataFrame кэшируется в DATA_CACHE_DIR (Parquet, если установлен pyarrow,
+иначе pickle) с ключом из хэша исходного файла и набора колонок: повторные запуски не разбирают JSON заново,
+а изменение файла автоматически даёт новый кэш.
+
+Разбиение не зависит от кэша и проекции колонок: test — первые `test_size` строк файла,
+val — случайная выборка из остальных с фиксированным `random_state`.
+"""
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Колонки, которые нужны агенту и бейзлайну (промты, ключ строки, таргет)
+EVAL_COLUMNS = (
+    "text", "permalink", "name", "address", "normalized_main_rubric_name_ru",
+    "reviews_summarized", RELEVANCE_COL,
+)
+
+# Колонки, без которых разбиение и оценка невозможны
+_REQUIRED_COLUMNS = ("text", RELEVANCE_COL)
+
 
 def _filter_uncertain(df: pd.DataFrame) -> pd.DataFrame:
     """Фильтрует строки с неопределенной релевантностью (0.1)."""
     return df[df[RELEVANCE_COL] != 0.1]
 
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """sha256 содержимого файла (читается блоками)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_path(path: str, source_hash: str, columns) -> str:
+    projection = ",".join(sorted(columns)) if columns else "*"
+    projection_hash = hashlib.md5(projection.encode("utf-8")).hexdigest()[:8]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    extension = "parquet" if PARQUET_AVAILABLE else "pkl"
+    return os.path.join(DATA_CACHE_DIR, f"{stem}.{source_hash[:16]}.{projection_hash}.{extension}")
+
+
+def _read_cache(cache_path: str):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        if cache_path.endswith(".parquet"):
+            return pd.read_parquet(cache_path)
+        return pd.read_pickle(cache_path)
+    except Exception as e:
+        logger.error(f"Не удалось прочитать кэш датасета {cache_path}: {e}")
+        return None
+
+
+def _write_cache(data: pd.DataFrame, cache_path: str):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        if cache_path.endswith(".parquet"):
+            data.to_parquet(tmp_path)
+        else:
+            data.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.error(f"Не удалось сохранить кэш датасета {cache_path}: {e}")
+
+
+def read_jsonl(path: str, columns=None, chunksize: int = DATA_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Потоково читает JSONL, оставляя из каждого куска только `columns` (None — все колонки).
+    Имена колонок приводятся к нижнему регистру.
+    """
+    wanted = [c.lower() for c in columns] if columns else None
+    chunks = []
+    with pd.read_json(path, lines=True, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.lower()
+            if wanted is not None:
+                chunk = chunk[[c for c in wanted if c in chunk.columns]]
+            chunks.append(chunk)
+    if not chunks:
+        return pd.DataFrame(columns=wanted)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_dataset(path: str, columns=None, use_cache: bool = DATA_CACHE_ENABLED) -> pd.DataFrame:
+    """
+    Читает датасет с проекцией колонок через кэш (см. описание модуля).
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys([*_REQUIRED_COLUMNS, *columns]))
+
+    cache_path = _cache_path(path, file_hash(path), columns) if use_cache else None
+    if cache_path:
+        data = _read_cache(cache_path)
+        if data is not None:
+            return data
+
+    data = read_jsonl(path, columns=columns)
+    if cache_path:
+        _write_cache(data, cache_path)
+    return data
+
+
 def load_dataset(
     path: str,
     drop_uncertain: bool = True,
     val_frac: float = 0.2,
     test_size: int = 570,  # Задано условиями учебного проекта
-    random_state: int = RANDOM_STATE
+    random_state: int = RANDOM_STATE,
+    columns=None,
+    use_cache: bool = DATA_CACHE_ENABLED,
 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Загружает jsonl и делит на train/val/test с настраиваемым размером теста.
@@ -22,25 +140,26 @@ def load_dataset(
     - val_frac: доля валидации от train данных (после выделения теста)
     - test_size: количество строк в тестовой выборке (по умолчанию 570)
     - random_state: для воспроизводимости разбиения
+    - columns: какие колонки загружать (None — все; `EVAL_COLUMNS` — только нужные для оценки)
+    - use_cache: использовать кэш разобранного датасета (DATA_CACHE_DIR)
 
     Возвращает:
     Кортеж (train_data, val_data, test_data)
     """
-    
+
     # Загрузка данных
-    data = pd.read_json(path, lines=True)
-    data.columns = data.columns.str.lower()
+    data = read_dataset(path, columns=columns, use_cache=use_cache)
 
     # Валидация данных
     if RELEVANCE_COL not in data.columns:
         raise ValueError(f"Столбец {RELEVANCE_COL} не найден в данных")
-    
+
     if len(data) < test_size:
         raise ValueError(f"Данные должны содержать как минимум {test_size} строк для выделения теста")
 
-    # Разбиение на тест и временный train
-    test_data = data.iloc[:test_size].copy()
-    temp_train = data.iloc[test_size:].copy()
+    # Разбиение на тест и временный train (срезы без копий: новые объекты создаются ниже)
+    test_data = data.iloc[:test_size]
+    temp_train = data.iloc[test_size:]
 
     # Фильтрация неопределенных значений
     if drop_uncertain:
@@ -55,4 +174,4 @@ def load_dataset(
         train_data.reset_index(drop=True),
         val_data.reset_index(drop=True),
         test_data.reset_index(drop=True)
-    )
\ No newline at end of file
+    )
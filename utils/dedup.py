@@ -0,0 +1,34 @@
+"""
+dedup.py
+
+Планировщик дедупликации входов оценщика.
+
+В датасете много строк с одинаковым запросом и одинаковой организацией (повторы между val и test,
+одна и та же организация под разными permalink). Ключ входа `input_key` — sha1 от точного текста
+запроса и полей организации, которые попадают в промты; строки с одинаковым ключом дают одинаковые
+промты, поэтому граф агента запускается один раз на группу, а результат копируется остальным строкам.
+Запросы, различающиеся хотя бы регистром или пробелами ("Кафе" и "кафе"), дают разные промты и оцениваются
+отдельно: иначе строка получила бы ответ и лог промта, который для неё не отправлялся.
+"""
+
+import hashlib
+from utils.records import EvalRecord
+
+
+def input_key(record: EvalRecord) -> str:
+    """Ключ входа: текст запроса и поля организации (name, address, rubric, reviews) как есть."""
+    payload = "\x1f".join(str(value) for value in record[1:])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def plan_dedup(records) -> dict:
+    """
+    Группирует записи по `input_key`.
+
+    Returns:
+        dict: input_key -> список записей группы (первая — представитель, в порядке появления).
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(input_key(record), []).append(record)
+    return groups
@@ -4,7 +4,8 @@ inspect_utils.py
 Модуль для интерактивного визуального анализа строк DataFrame с предсказаниями моделей.
 
 Содержит функции:
-- `inspect_row_html`: формирует HTML-контент на основе данных одной строки DataFrame, включая входные данные, предсказания, истинную метку и лог агента.
+- `inspect_row_html`: формирует HTML-контент на основе данных одной строки DataFrame, включая входные данные, предсказания, истинную метку и лог агента
+  (в сжатом логе промты восстанавливаются по шаблону, см. `agent.prompt_log`).
 - `inspect_row`: выводит сгенерированный HTML-блок в ячейке Jupyter Notebook через IPython.display.
 
 Применение:
@@ -25,9 +26,12 @@ inspect_utils.py
 - utils.config (для импорта `RELEVANCE_COL`)
 """
 
+import html
+import pprint
 import pandas as pd
 from IPython.display import display, HTML
 from utils.config import RELEVANCE_COL
+from agent.prompt_log import expand_log
 
 def inspect_row_html(row, idx, *, pred_col="pred_relevance", label_col=RELEVANCE_COL):
     """Формирует HTML для визуального анализа строки DataFrame."""
@@ -38,11 +42,13 @@ def inspect_row_html(row, idx, *, pred_col="pred_relevance", label_col=RELEVANCE
     # Экранирование лога
     agent_log_html = ""
     if "agent_log" in row and pd.notna(row["agent_log"]):
+        # Сжатый лог (AGENT_LOG_MODE=slim) хранит ссылки на шаблоны — промты восстанавливаются здесь
+        agent_log = html.escape(pprint.pformat(expand_log(row), width=120, sort_dicts=False))
         agent_log_html = f"""
         <details style="margin-top:10px;">
             <summary style="cursor:pointer;"><strong>🧠 Agent log (раскрыть)</strong></summary>
             <pre style="white-space:pre-wrap; background:#eee; padding:10px; border-radius:6px;">
-{row['agent_log']}
+{agent_log}
             </pre>
         </details>
         """
@@ -0,0 +1,168 @@
+"""
+kv_store.py
+
+Простое персистентное key-value хранилище в одном файле SQLite.
+
+Используется как основа для кэшей (ответы LLM, результаты поиска):
+- атомарная запись (INSERT OR REPLACE в транзакции), режим WAL — безопасно
+  для нескольких потоков и процессов, читающих и пишущих один файл;
+- TTL: записи старше `ttl_seconds` считаются промахом и удаляются;
+- ограничение размера: при превышении `max_entries` удаляются давно не читавшиеся записи (LRU);
+- статистика попаданий/промахов (`stats()`).
+
+Путь ":memory:" создаёт временное хранилище в памяти процесса (общее для всех потоков).
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в числе записей) проверять превышение max_entries
+_EVICT_EVERY = 100
+
+
+class SQLiteKVStore:
+    """
+    Key-value хранилище поверх SQLite.
+
+    Параметры:
+        path (str): Путь к файлу базы (создаётся при необходимости) или ":memory:".
+        table (str): Имя таблицы (позволяет хранить несколько кэшей в одном файле).
+        ttl_seconds (float, optional): Время жизни записи; None — без ограничения.
+        max_entries (int, optional): Максимальное число записей; None — без ограничения.
+    """
+
+    def __init__(self, path: str, table: str = "cache", ttl_seconds: float = None, max_entries: int = None):
+        self.path = path
+        self.table = table
+        self.ttl_seconds = ttl_seconds or None
+        self.max_entries = max_entries or None
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory_conn = None
+
+        if path == ":memory:":
+            # Одно соединение на все потоки: у каждого нового ":memory:" соединения своя база
+            self._memory_conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            self._conn().execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn().execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_idx ON {self.table}(accessed_at)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._memory_conn is not None:
+            return self._memory_conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit: каждая команда — отдельная атомарная транзакция
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        """Возвращает значение по ключу или None (промах или истёкший TTL)."""
+        now = time.time()
+        with self._lock:
+            conn = self._conn()
+            row = conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str, created_at: float = None):
+        """Атомарно сохраняет значение (перезаписывая существующее)."""
+        now = time.time()
+        with self._lock:
+            self._conn().execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, created_at or now, now),
+            )
+            self._writes += 1
+            if self.max_entries and self._writes % _EVICT_EVERY == 0:
+                self._evict_locked()
+
+    def set_many(self, items, created_at: float = None):
+        """Сохраняет пары (key, value) одной транзакцией."""
+        now = time.time()
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    [(key, value, created_at or now, now) for key, value in items],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if self.max_entries:
+                self._evict_locked()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._conn().execute(
+                f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _evict_locked(self) -> int:
+        conn = self._conn()
+        removed = 0
+        if self.ttl_seconds:
+            removed += conn.execute(
+                f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+        if self.max_entries:
+            count = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if count > self.max_entries:
+                removed += conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN ("
+                    f"SELECT key FROM {self.table} ORDER BY accessed_at ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+        return removed
+
+    def evict(self) -> int:
+        """Удаляет истёкшие записи и лишние записи сверх `max_entries`. Возвращает число удалённых."""
+        with self._lock:
+            return self._evict_locked()
+
+    def stats(self) -> dict:
+        """Статистика кэша: попадания, промахи, доля попаданий, число записей."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self),
+        }
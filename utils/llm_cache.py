@@ -0,0 +1,59 @@
+"""
+llm_cache.py
+
+Персистентный кэш ответов LLM.
+
+Ключ — sha256 от модели, сообщений (system + user) и параметров декодирования,
+поэтому при смене версии промта заново оплачиваются только те строки, чей промт действительно изменился.
+Хранилище — один файл SQLite (`SQLiteKVStore`), путь и ограничения задаются в `utils.config`
+(LLM_CACHE_PATH, LLM_CACHE_TTL_DAYS, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_ENABLED).
+"""
+
+import json
+import hashlib
+import threading
+from utils.kv_store import SQLiteKVStore
+from utils.config import LLM_CACHE_PATH, LLM_CACHE_TTL_DAYS, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_ENABLED
+
+
+class LLMResponseCache(SQLiteKVStore):
+    """
+    Кэш ответов LLM поверх SQLite.
+
+    Параметры:
+        path (str): Путь к файлу кэша (или ":memory:").
+        ttl_seconds (float, optional): Время жизни записи.
+        max_entries (int, optional): Максимальное число записей (LRU-вытеснение).
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_seconds: float = None, max_entries: int = None):
+        super().__init__(path, table="llm_responses", ttl_seconds=ttl_seconds, max_entries=max_entries)
+
+    @staticmethod
+    def make_key(params: dict) -> str:
+        """
+        Хэш запроса: модель, сообщения и параметры декодирования (всё, кроме служебных полей клиента).
+        """
+        payload = json.dumps(params, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Возвращает общий для процесса кэш ответов LLM или None, если кэш отключён (LLM_CACHE_ENABLED=false).
+    """
+    global _CACHE
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = LLMResponseCache(
+                LLM_CACHE_PATH,
+                ttl_seconds=LLM_CACHE_TTL_DAYS * 24 * 3600 if LLM_CACHE_TTL_DAYS else None,
+                max_entries=LLM_CACHE_MAX_ENTRIES,
+            )
+        return _CACHE
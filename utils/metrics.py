@@ -0,0 +1,38 @@
+"""
+metrics.py
+
+Векторные метки и метрики по ответам модели (вместо `.apply(map_response_to_label)` и sklearn).
+
+- `responses_to_labels(responses)`: 1.0 — "RELEVANT_PLUS", 0.0 — "IRRELEVANT", -1.0 — ошибка или неизвестный ответ.
+- `accuracy(labels, preds)`: accuracy по валидным предсказаниям (pred != -1) и их число.
+"""
+
+import numpy as np
+
+
+def responses_to_labels(responses) -> np.ndarray:
+    """
+    Преобразует ответы модели в числовые метки (та же логика, что `map_response_to_label`).
+    """
+    texts = np.array([r if isinstance(r, str) else "" for r in responses], dtype=str)
+    if texts.size == 0:
+        return np.zeros(0, dtype=float)
+    relevant = np.char.find(texts, "RELEVANT_PLUS") >= 0
+    irrelevant = np.char.find(texts, "IRRELEVANT") >= 0
+    return np.where(relevant, 1.0, np.where(irrelevant, 0.0, -1.0))
+
+
+def accuracy(labels, preds):
+    """
+    Accuracy по строкам с валидным предсказанием.
+
+    Returns:
+        tuple[float, int]: (accuracy, число валидных предсказаний); accuracy = 0.0, если валидных нет.
+    """
+    labels = np.asarray(labels, dtype=float)
+    preds = np.asarray(preds, dtype=float)
+    valid = preds != -1.0
+    n_valid = int(valid.sum())
+    if not n_valid:
+        return 0.0, 0
+    return float((labels[valid] == preds[valid]).mean()), n_valid
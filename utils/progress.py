@@ -0,0 +1,27 @@
+# llm_relevance_agent/utils/progress.py
+"""
+progress.py
+
+Индикатор прогресса прогонов.
+
+`tqdm.notebook` тянет IPython и ipywidgets (~0.6 с при импорте), поэтому выбирается при первом вызове:
+в Jupyter (загружено ядро IPython) — виджет `tqdm.notebook`, в консоли — обычный `tqdm`.
+"""
+
+import sys
+
+
+def _tqdm_class():
+    if "ipykernel" in sys.modules:
+        try:
+            from tqdm.notebook import tqdm as notebook_tqdm
+            return notebook_tqdm
+        except ImportError:
+            pass
+    from tqdm import tqdm as console_tqdm
+    return console_tqdm
+
+
+def tqdm(*args, **kwargs):
+    """Прогресс-бар с тем же интерфейсом, что у `tqdm.tqdm` (итератор или `total=` + `update`)."""
+    return _tqdm_class()(*args, **kwargs)
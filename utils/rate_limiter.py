@@ -0,0 +1,259 @@
+"""
+rate_limiter.py
+
+Общий ограничитель частоты запросов для всех внешних вызовов (LLM и поиск).
+
+Содержит:
+- `TokenBucket`: классическое «ведро токенов» с резервированием (поддерживает уход в минус,
+  вызывающий код просто ждёт, пока ведро восполнится).
+- `RateLimiter`: комбинирует лимит запросов в секунду (RPS) и токенов в минуту (TPM),
+  умеет глобально «ставить на паузу» всех клиентов по заголовку Retry-After.
+- `call_with_retries` / `acall_with_retries`: выполнение вызова через лимитер
+  с повтором при 429/таймаутах/5xx и экспоненциальной задержкой с джиттером.
+- `get_limiter(name)`: общий (на процесс) лимитер по имени — "llm" или "search".
+
+Лимиты задаются в `utils.config` (переменные окружения LLM_REQUESTS_PER_SECOND,
+LLM_TOKENS_PER_MINUTE, SEARCH_REQUESTS_PER_SECOND, RATE_LIMIT_MAX_RETRIES).
+При шардированном запуске каждый процесс получает долю бюджета RATE_LIMIT_SHARE (см. `shard_runner.py`),
+так что суммарная нагрузка K процессов не превышает лимитов провайдера.
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from utils.config import (
+    LLM_REQUESTS_PER_SECOND, LLM_TOKENS_PER_MINUTE,
+    SEARCH_REQUESTS_PER_SECOND, RATE_LIMIT_MAX_RETRIES, RATE_LIMIT_SHARE,
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP-статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Фрагменты имён классов исключений, означающих временную ошибку
+# (openai.RateLimitError, openai.APITimeoutError, tavily UsageLimitExceededError, TimeoutError и т.п.)
+RETRYABLE_ERROR_NAMES = ("RateLimit", "UsageLimitExceeded", "Timeout", "Connection", "InternalServer")
+
+
+class TokenBucket:
+    """
+    Ведро токенов: `rate` токенов в секунду, вместимость `capacity`.
+
+    `reserve(amount)` списывает токены сразу (баланс может уйти в минус)
+    и возвращает время ожидания в секундах, после которого вызов укладывается в лимит.
+    Благодаря резервированию один и тот же объект работает и из потоков, и из asyncio.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def refund(self, amount: float):
+        """Возвращает (amount > 0) или дополнительно списывает (amount < 0) токены."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    """
+    Лимитер запросов в секунду и токенов в минуту.
+
+    Параметры:
+        name (str): Имя лимитера (для логов).
+        requests_per_second (float, optional): Лимит RPS; None или 0 — без ограничения.
+        tokens_per_minute (float, optional): Лимит TPM; None или 0 — без ограничения.
+    """
+
+    def __init__(self, name: str, requests_per_second: float = None, tokens_per_minute: float = None):
+        self.name = name
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second)) if requests_per_second else None
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        wait = max(0.0, self._paused_until - time.monotonic())
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens: float = 0):
+        """Блокирует поток, пока запрос (и `tokens` токенов) не уложится в лимит."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 0):
+        """Асинхронная версия `acquire`."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def reconcile_tokens(self, estimated: float, actual: float):
+        """Корректирует TPM-бюджет после ответа: возвращает переоценку или списывает недооценку."""
+        if self.tokens and actual:
+            self.tokens.refund(estimated - actual)
+
+    def pause(self, seconds: float):
+        """Приостанавливает все запросы через этот лимитер (например, по Retry-After)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(text: str, completion_tokens: int = 0) -> int:
+    """
+    Грубая оценка числа токенов запроса до отправки (≈3 символа на токен для русского текста).
+    Точное значение подставляется после ответа через `RateLimiter.reconcile_tokens`.
+    """
+    return len(text or "") // 3 + 1 + completion_tokens
+
+
+def _status_code(error: Exception):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Определяет, временная ли ошибка (429, таймаут, обрыв соединения, 5xx)."""
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return any(part in type(error).__name__ for part in RETRYABLE_ERROR_NAMES)
+
+
+def retry_after_seconds(error: Exception):
+    """
+    Извлекает задержку из заголовков `retry-after-ms` / `retry-after` ответа, если они есть.
+
+    Возвращает:
+        float | None: Задержка в секундах или None, если заголовка нет.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Экспоненциальная задержка с полным джиттером: U(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _next_delay(limiter: RateLimiter, error: Exception, attempt: int) -> float:
+    delay = backoff_delay(attempt)
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        # Сервер сам сказал, сколько ждать, — ставим на паузу всех клиентов этого лимитера
+        limiter.pause(retry_after)
+        delay = max(delay, retry_after)
+    logger.warning(
+        f"[{limiter.name}] временная ошибка ({type(error).__name__}: {error}), "
+        f"повтор {attempt + 1} через {delay:.2f} с"
+    )
+    return delay
+
+
+def call_with_retries(fn, limiter: RateLimiter, tokens: float = 0, max_retries: int = None, stats: dict = None):
+    """
+    Вызывает `fn()` через лимитер, повторяя вызов при временных ошибках.
+
+    Параметры:
+        fn (callable): Функция без аргументов, выполняющая запрос.
+        limiter (RateLimiter): Лимитер, через который проходит каждая попытка.
+        tokens (float): Оценка числа токенов запроса (для TPM).
+        max_retries (int, optional): Максимум повторов (по умолчанию RATE_LIMIT_MAX_RETRIES).
+        stats (dict, optional): Сюда записывается число выполненных повторов (`stats["retries"]`).
+
+    Возвращает:
+        Результат `fn()`. Если ошибка не временная или повторы исчерпаны — исключение пробрасывается.
+    """
+    max_retries = RATE_LIMIT_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        limiter.acquire(tokens)
+        if stats is not None:
+            stats["retries"] = attempt
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            time.sleep(_next_delay(limiter, e, attempt))
+            attempt += 1
+
+
+async def acall_with_retries(afn, limiter: RateLimiter, tokens: float = 0, max_retries: int = None, stats: dict = None):
+    """Асинхронная версия `call_with_retries`: `afn` — функция без аргументов, возвращающая корутину."""
+    max_retries = RATE_LIMIT_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        await limiter.aacquire(tokens)
+        if stats is not None:
+            stats["retries"] = attempt
+        try:
+            return await afn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            await asyncio.sleep(_next_delay(limiter, e, attempt))
+            attempt += 1
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(name: str) -> RateLimiter:
+    """
+    Возвращает общий для процесса лимитер по имени ("llm" или "search").
+    Все экземпляры GPTInterface и все вызовы search_info делят один бюджет.
+    """
+    with _LIMITERS_LOCK:
+        if name not in _LIMITERS:
+            if name == "llm":
+                _LIMITERS[name] = RateLimiter(
+                    name, LLM_REQUESTS_PER_SECOND * RATE_LIMIT_SHARE, LLM_TOKENS_PER_MINUTE * RATE_LIMIT_SHARE,
+                )
+            elif name == "search":
+                _LIMITERS[name] = RateLimiter(name, SEARCH_REQUESTS_PER_SECOND * RATE_LIMIT_SHARE)
+            else:
+                raise ValueError(f"Неизвестный лимитер: {name}")
+        return _LIMITERS[name]
@@ -0,0 +1,64 @@
+"""
+records.py
+
+Лёгкие записи строк датасета для оценщиков.
+
+Вместо `DataFrame.iterrows()` (Series на каждую строку) DataFrame один раз превращается
+в список `EvalRecord` по массивам колонок; дальше оценщики работают только со списком.
+Отсутствующая колонка даёт "—", как прежний `row.get(col, "—")`; значения колонок
+передаются без изменений, поэтому промты (и ключи кэша LLM) остаются прежними.
+"""
+
+from typing import Any, NamedTuple
+from utils.checkpoint import row_keys
+
+
+class EvalRecord(NamedTuple):
+    key: str        # sha1(permalink, text) — ключ контрольной точки
+    query: str
+    name: Any
+    address: Any
+    rubric: Any
+    reviews: Any
+
+
+# Поле записи -> колонка датасета
+RECORD_COLUMNS = {
+    "name": "name",
+    "address": "address",
+    "rubric": "normalized_main_rubric_name_ru",
+    "reviews": "reviews_summarized",
+}
+
+
+def _column(df, column):
+    if column in df.columns:
+        return df[column].tolist()
+    return ["—"] * len(df)
+
+
+def build_records(df) -> list:
+    """
+    Строит список `EvalRecord` из DataFrame (по колонкам, без обхода строк).
+    """
+    return [
+        EvalRecord(*values)
+        for values in zip(
+            row_keys(df),
+            df["text"].tolist(),
+            *(_column(df, column) for column in RECORD_COLUMNS.values()),
+        )
+    ]
+
+
+def as_records(batch) -> list:
+    """Принимает DataFrame или уже готовый список записей."""
+    return batch if isinstance(batch, list) else build_records(batch)
+
+
+def record_from_dict(query, org: dict, key: str = "") -> EvalRecord:
+    """
+    Запись по запросу и словарю организации (онлайн-оценка, ранжирование кандидатов). Поля принимаются
+    как короткими именами (name, address, rubric, reviews), так и именами колонок датасета.
+    """
+    return EvalRecord(key, query, *(org.get(field, org.get(column)) for field, column in RECORD_COLUMNS.items()))
@@ -0,0 +1,281 @@
+"""
+telemetry.py
+
+Телеметрия прогонов: время узлов графа, токены и повторы вызовов LLM, кэш и повторы поиска, стоимость.
+
+Данные пишутся в лог строки (`agent_log`), поэтому сохраняются вместе с предсказаниями и контрольными точками:
+- `node_time`: {узел: секунды} — заполняет `instrument_node` (обёртка узлов в `build_relevance_graph`);
+- `{stage}_prompt_tokens`, `{stage}_cached_tokens`, `{stage}_completion_tokens`, `{stage}_llm_time`,
+  `{stage}_llm_cache_hit`, `{stage}_llm_retries` — `record_llm_call` для каждого вызова LLM узла;
+- `search_time`, `search_cache_hit`, `search_retries` — `record_search`.
+
+`summarize_logs(logs)` собирает сводку: перцентили и гистограммы времени узлов, токены, доли попаданий в кэши,
+повторы и стоимость (цены — LLM_PRICE_* и SEARCH_PRICE_PER_REQUEST в `utils.config`, USD) в пересчёте на 1000 строк.
+
+Если установлен `prometheus_client`, те же наблюдения экспортируются как метрики Prometheus
+(`start_metrics_server(port)` или `metrics_payload()` для собственного HTTP-эндпоинта).
+"""
+
+import time
+import json
+import asyncio
+import logging
+import functools
+import threading
+import numpy as np
+from utils.config import (
+    LLM_PRICE_INPUT_PER_1M, LLM_PRICE_CACHED_INPUT_PER_1M, LLM_PRICE_OUTPUT_PER_1M, SEARCH_PRICE_PER_REQUEST,
+)
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    prometheus_client = None
+    PROMETHEUS_AVAILABLE = False
+
+# Границы корзин гистограмм времени узлов (секунды)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LLM_STAGES = ("need_search", "classification")
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def _prometheus():
+    """Метрики Prometheus (создаются один раз) или None, если prometheus_client не установлен."""
+    global _metrics
+    if not PROMETHEUS_AVAILABLE:
+        return None
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = {
+                "node_latency": prometheus_client.Histogram(
+                    "agent_node_latency_seconds", "Время выполнения узла графа", ["node"], buckets=LATENCY_BUCKETS,
+                ),
+                "llm_tokens": prometheus_client.Counter(
+                    "agent_llm_tokens_total", "Токены вызовов LLM", ["stage", "kind"],
+                ),
+                "llm_calls": prometheus_client.Counter(
+                    "agent_llm_calls_total", "Вызовы LLM", ["stage", "cache"],
+                ),
+                "llm_retries": prometheus_client.Counter(
+                    "agent_llm_retries_total", "Повторы вызовов LLM после временных ошибок", ["stage"],
+                ),
+                "search_calls": prometheus_client.Counter(
+                    "agent_search_calls_total", "Поисковые запросы", ["cache"],
+                ),
+            }
+        return _metrics
+
+
+def start_metrics_server(port: int) -> bool:
+    """Запускает HTTP-эндпоинт Prometheus; False, если prometheus_client не установлен."""
+    if _prometheus() is None:
+        logger.warning("prometheus_client не установлен, метрики Prometheus не экспортируются")
+        return False
+    prometheus_client.start_http_server(port)
+    return True
+
+
+def metrics_payload():
+    """Текст метрик в формате Prometheus или None, если prometheus_client не установлен."""
+    if _prometheus() is None:
+        return None
+    return prometheus_client.generate_latest()
+
+
+def _log_of(state) -> dict:
+    if "log" not in state or state["log"] is None:
+        state["log"] = {}
+    return state["log"]
+
+
+def add_node_time(state, node: str, elapsed: float):
+    """Добавляет время `elapsed` узла `node` в лог состояния (например, для пакетной классификации вне графа)."""
+    if not isinstance(state, dict):
+        return
+    times = _log_of(state).setdefault("node_time", {})
+    times[node] = round(times.get(node, 0.0) + elapsed, 4)
+    metrics = _prometheus()
+    if metrics is not None:
+        metrics["node_latency"].labels(node=node).observe(elapsed)
+
+
+def instrument_node(node: str, fn):
+    """
+    Оборачивает узел графа (синхронный или асинхронный): время выполнения пишется в `log["node_time"][node]`.
+    """
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(state):
+            started = time.perf_counter()
+            result = await fn(state)
+            add_node_time(result if isinstance(result, dict) else state, node, time.perf_counter() - started)
+            return result
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(state):
+        started = time.perf_counter()
+        result = fn(state)
+        add_node_time(result if isinstance(result, dict) else state, node, time.perf_counter() - started)
+        return result
+    return wrapper
+
+
+def record_llm_call(state, stage: str, result):
+    """Записывает в лог статистику вызова LLM (`LLMResult`) для этапа `stage`."""
+    log = _log_of(state)
+    log[f"{stage}_prompt_tokens"] = result.prompt_tokens
+    log[f"{stage}_cached_tokens"] = result.cached_tokens
+    log[f"{stage}_completion_tokens"] = result.completion_tokens
+    log[f"{stage}_llm_time"] = round(result.latency, 4)
+    log[f"{stage}_llm_cache_hit"] = result.cache_hit
+    log[f"{stage}_llm_retries"] = result.retries
+
+    metrics = _prometheus()
+    if metrics is not None:
+        metrics["llm_calls"].labels(stage=stage, cache="hit" if result.cache_hit else "miss").inc()
+        metrics["llm_retries"].labels(stage=stage).inc(result.retries)
+        for kind in ("prompt", "cached", "completion"):
+            metrics["llm_tokens"].labels(stage=stage, kind=kind).inc(getattr(result, f"{kind}_tokens"))
+
+
+def record_search(state, meta: dict):
+    """Записывает в лог статистику поиска (`search_info_meta`)."""
+    log = _log_of(state)
+    log["search_time"] = round(meta.get("time", 0.0), 4)
+    log["search_cache_hit"] = bool(meta.get("cache_hit"))
+    log["search_retries"] = meta.get("retries", 0)
+
+    metrics = _prometheus()
+    if metrics is not None:
+        metrics["search_calls"].labels(cache="hit" if log["search_cache_hit"] else "miss").inc()
+
+
+def latency_summary(samples) -> dict:
+    """Перцентили (мс) и гистограмма по LATENCY_BUCKETS для списка длительностей в секундах."""
+    values = np.asarray(samples, dtype=float)
+    if not values.size:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000.0
+    edges = np.array([*LATENCY_BUCKETS, np.inf])
+    counts = np.bincount(np.searchsorted(edges, values, side="left"), minlength=len(edges))
+    labels = [f"<={edge:g}s" for edge in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]:g}s"]
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()) * 1000.0, 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "histogram": dict(zip(labels, counts[:len(labels)].tolist())),
+    }
+
+
+def estimate_cost(prompt_tokens=0, cached_tokens=0, completion_tokens=0, search_requests=0) -> float:
+    """Стоимость в USD по ценам из конфигурации (закэшированные провайдером токены — по сниженной цене)."""
+    return (
+        (prompt_tokens - cached_tokens) * LLM_PRICE_INPUT_PER_1M / 1e6
+        + cached_tokens * LLM_PRICE_CACHED_INPUT_PER_1M / 1e6
+        + completion_tokens * LLM_PRICE_OUTPUT_PER_1M / 1e6
+        + search_requests * SEARCH_PRICE_PER_REQUEST
+    )
+
+
+def summarize_logs(logs, usage: dict = None) -> dict:
+    """
+    Сводка телеметрии по логам строк.
+
+    Параметры:
+        usage (dict, optional): Токены, фактически отправленные в API за прогон (разность `GPTInterface.usage_stats()`);
+            если передан, стоимость LLM считается по нему — он учитывает и вызовы вне узлов графа
+            (пакетная классификация), и не учитывает строки, взятые из контрольной точки.
+
+    Returns:
+        dict: rows, nodes (сводка времени по узлам), llm (вызовы, попадания в кэш, повторы, токены),
+            search (запросы, попадания в кэш, повторы; `context` — сжатие выдачи постобработкой), cost (USD всего и на 1000 строк).
+    """
+    logs = [log for log in logs if isinstance(log, dict)]
+    rows = len(logs)
+    # Повторы входа (`dedup_of`) несут копию лога представителя и ничего не стоят
+    logs = [log for log in logs if "dedup_of" not in log]
+
+    node_samples = {}
+    for log in logs:
+        for node, elapsed in (log.get("node_time") or {}).items():
+            node_samples.setdefault(node, []).append(elapsed)
+
+    llm = {"calls": 0, "cache_hits": 0, "retries": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+    for log in logs:
+        for stage in LLM_STAGES:
+            if f"{stage}_prompt_tokens" not in log:
+                continue
+            llm["calls"] += 1
+            llm["cache_hits"] += int(bool(log.get(f"{stage}_llm_cache_hit")))
+            llm["retries"] += log.get(f"{stage}_llm_retries", 0)
+            for kind in ("prompt", "cached", "completion"):
+                llm[f"{kind}_tokens"] += log.get(f"{stage}_{kind}_tokens", 0)
+    llm["cache_hit_rate"] = llm["cache_hits"] / llm["calls"] if llm["calls"] else 0.0
+
+    searches = [log for log in logs if "search_cache_hit" in log or "speculative_search_cache_hit" in log]
+    search_hits = sum(1 for log in searches if log.get("search_cache_hit", log.get("speculative_search_cache_hit")))
+    search = {
+        "requests": len(searches),
+        "cache_hits": search_hits,
+        "cache_hit_rate": search_hits / len(searches) if searches else 0.0,
+        "retries": sum(log.get("search_retries", 0) for log in searches),
+    }
+    # Постобработка контекста поиска (agent.search_postprocess): токены выдачи до и после сокращения
+    compressed = [log for log in logs if "search_tokens_raw" in log]
+    if compressed:
+        tokens_raw = sum(log["search_tokens_raw"] for log in compressed)
+        tokens_kept = sum(log["search_tokens_kept"] for log in compressed)
+        search["context"] = {
+            "rows": len(compressed),
+            "tokens_raw": tokens_raw,
+            "tokens_kept": tokens_kept,
+            "compression": round(tokens_kept / tokens_raw, 4) if tokens_raw else 1.0,
+        }
+
+    tokens = usage if usage is not None else llm
+    total = estimate_cost(
+        tokens["prompt_tokens"], tokens["cached_tokens"], tokens["completion_tokens"],
+        search["requests"] - search["cache_hits"],
+    )
+    return {
+        "rows": rows,
+        "nodes": {node: latency_summary(samples) for node, samples in sorted(node_samples.items())},
+        "llm": llm,
+        "search": search,
+        "cost": {"total_usd": round(total, 6), "per_1k_rows_usd": round(total / rows * 1000, 4) if rows else 0.0},
+    }
+
+
+def format_summary(summary: dict) -> str:
+    """Краткая текстовая сводка для печати после прогона."""
+    llm, search, cost = summary["llm"], summary["search"], summary["cost"]
+    lines = [
+        f"Телеметрия ({summary['rows']} строк):",
+        f"  LLM: {llm['calls']} вызовов, из кэша {llm['cache_hit_rate']*100:.1f}%, повторов {llm['retries']}, "
+        f"токены вход/выход {llm['prompt_tokens']}/{llm['completion_tokens']}",
+        f"  Поиск: {search['requests']} запросов, из кэша {search['cache_hit_rate']*100:.1f}%, повторов {search['retries']}",
+        f"  Стоимость: ${cost['total_usd']:.4f}, на 1000 строк ${cost['per_1k_rows_usd']:.4f}",
+    ]
+    context = search.get("context")
+    if context:
+        lines.insert(3, f"  Контекст поиска: {context['rows']} строк, токены {context['tokens_raw']} -> "
+                        f"{context['tokens_kept']} ({context['compression']*100:.1f}%)")
+    for node, stats in summary["nodes"].items():
+        if stats["count"]:
+            lines.append(f"  {node:<20} n={stats['count']:<6} p50={stats['p50_ms']:.0f} мс  "
+                         f"p95={stats['p95_ms']:.0f} мс  p99={stats['p99_ms']:.0f} мс")
+    return "\n".join(lines)
+
+
+def write_summary(path: str, summary: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
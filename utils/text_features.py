@@ -0,0 +1,128 @@
+"""
+text_features.py
+
+Лёгкие лексические признаки пары (запрос, организация) без внешних зависимостей (только NumPy).
+
+- `tokenize(text)`: слова в нижнем регистре, "ё" -> "е", без стоп-слов; каждое слово обрезается
+  до STEM_LENGTH символов — грубый стемминг, достаточный для русских словоформ
+  ("шиномонтаж" / "шиномонтажом" / "шиномонтажа" -> "шином"); тот же стемминг отдельного слова — `stem(word)`.
+- `coverage(query_tokens, tokens)`: доля токенов запроса, встречающихся в тексте поля.
+- `LogisticModel`: логистическая регрессия на NumPy (градиентный спуск с L2),
+  сохраняется в JSON — используется локальными фильтрами агента (`agent.search_gate`).
+"""
+
+import re
+import json
+import numpy as np
+
+STEM_LENGTH = 5
+
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+
+# Служебные слова, не несущие смысла для сопоставления запроса с организацией
+STOP_WORDS = frozenset("""
+в во на с со и или а но по к ко у о об от до из за для при без под над про через около
+не ни же ли бы то это как что где куда когда какой какая какие который мне мой моя
+я ты мы вы он она они его ее их все весь вся всё там тут здесь есть нет
+""".split())
+
+
+def stem(word: str) -> str:
+    """Основа слова: первые STEM_LENGTH символов (числа не обрезаются)."""
+    return word if word.isdigit() else word[:STEM_LENGTH]
+
+
+def tokenize(text) -> list:
+    """Токены текста (пустой список для None/NaN и нестроковых значений)."""
+    if not isinstance(text, str) or not text:
+        return []
+    words = _WORD.findall(text.lower().replace("ё", "е"))
+    return [stem(w) for w in words if w not in STOP_WORDS]
+
+
+def coverage(query_tokens, tokens) -> float:
+    """Доля токенов запроса, встречающихся среди `tokens` (0.0 для пустого запроса)."""
+    if not query_tokens:
+        return 0.0
+    vocabulary = set(tokens)
+    return sum(1 for t in query_tokens if t in vocabulary) / len(query_tokens)
+
+
+def uncovered(query_tokens, *token_lists) -> list:
+    """Токены запроса, которых нет ни в одном из переданных списков."""
+    vocabulary = set().union(*token_lists)
+    return [t for t in query_tokens if t not in vocabulary]
+
+
+class LogisticModel:
+    """
+    Логистическая регрессия (бинарная) на NumPy.
+
+    Параметры:
+        feature_names (list[str]): Имена признаков (порядок столбцов X).
+        weights, bias, mean, scale: Параметры обученной модели (None — не обучена).
+    """
+
+    def __init__(self, feature_names, weights=None, bias=0.0, mean=None, scale=None):
+        self.feature_names = list(feature_names)
+        self.weights = None if weights is None else np.asarray(weights, dtype=float)
+        self.bias = float(bias)
+        self.mean = None if mean is None else np.asarray(mean, dtype=float)
+        self.scale = None if scale is None else np.asarray(scale, dtype=float)
+
+    @property
+    def fitted(self) -> bool:
+        return self.weights is not None
+
+    def _standardize(self, X):
+        return (np.asarray(X, dtype=float) - self.mean) / self.scale
+
+    def fit(self, X, y, l2: float = 1e-2, lr: float = 0.5, epochs: int = 500):
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.mean = X.mean(axis=0)
+        self.scale = X.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        Z = self._standardize(X)
+
+        w = np.zeros(Z.shape[1])
+        b = 0.0
+        n = len(y)
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(Z @ w + b)))
+            error = p - y
+            w -= lr * (Z.T @ error / n + l2 * w)
+            b -= lr * error.mean()
+        self.weights, self.bias = w, float(b)
+        return self
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Вероятность класса 1 для каждой строки X."""
+        if not self.fitted:
+            raise ValueError("Модель не обучена")
+        Z = self._standardize(np.atleast_2d(X))
+        return 1.0 / (1.0 + np.exp(-(Z @ self.weights + self.bias)))
+
+    def to_dict(self) -> dict:
+        return {
+            "feature_names": self.feature_names,
+            "weights": self.weights.tolist(),
+            "bias": self.bias,
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LogisticModel":
+        return cls(data["feature_names"], data["weights"], data["bias"], data["mean"], data["scale"])
+
+    def save(self, path: str, **meta):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({**meta, "model": self.to_dict()}, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str):
+        """Returns: tuple[LogisticModel, dict] — модель и сохранённые вместе с ней метаданные."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls.from_dict(data.pop("model")), data